@@ -1,20 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import math
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.config import settings
 from app.db import get_session
 from app.db.repositories import RefreshTokenRepository
-from app.models.token import TokenResponse
+from app.models.token import TokenPayload, TokenResponse
 from app.models.user import User, UserCreate, UserWithToken
 from app.services.auth import (
+    access_token_expires_in,
     authenticate_user,
     create_access_token,
     create_user_refresh_token,
+    get_access_token_payload,
     get_current_user,
     refresh_access_token,
     register_new_user,
+    revoke_access_token,
+    revoke_all_access_tokens,
 )
+from app.services.login_throttle import login_throttle
 
 # Create router with prefix to match API Gateway configuration
 router = APIRouter(prefix="/auth")
@@ -34,7 +40,7 @@ async def register(
     user = await register_new_user(db, user_in)
     
     # Create access token
-    access_token = create_access_token(user.id)
+    access_token = create_access_token(user.id, user=user)
     
     # Create refresh token
     refresh_token = await create_user_refresh_token(db, user.id)
@@ -48,22 +54,39 @@ async def register(
 
 @router.post("/token", response_model=TokenResponse)
 async def login_for_access_token(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_session),
 ):
     """
     OAuth2 compatible token login, get an access token for future requests
     """
+    client_ip = login_throttle.client_ip(
+        request.client.host if request.client else None,
+        request.headers.get("x-forwarded-for"),
+    )
+    
+    # Count the attempt, or reject it if throttled, before any password hashing
+    retry_after = await login_throttle.attempt(form_data.username, client_ip)
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed login attempts, try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    
     user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
+        login_throttle.record_failure()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    await login_throttle.record_success(form_data.username, client_ip)
     
     # Create access token
-    access_token = create_access_token(user.id)
+    access_token = create_access_token(user.id, user=user)
     
     # Create refresh token
     refresh_token = await create_user_refresh_token(db, user.id)
@@ -71,7 +94,7 @@ async def login_for_access_token(
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "expires_in": settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "expires_in": access_token_expires_in(user),
         "refresh_token": refresh_token,
     }
 
@@ -91,15 +114,18 @@ async def refresh_token(
 async def logout(
     refresh_token: str,
     current_user: User = Depends(get_current_user),
+    token_data: TokenPayload = Depends(get_access_token_payload),
     db: AsyncSession = Depends(get_session),
 ):
     """
-    Logout user by revoking refresh token
+    Logout user by revoking refresh token and the current access token
     """
     token = await refresh_token_repository.get_by_token(db, refresh_token)
     if token and token.user_id == current_user.id:
         await refresh_token_repository.revoke(db, token.id)
     
+    await revoke_access_token(token_data)
+    
     return {"detail": "Successfully logged out"}
 
 
@@ -109,8 +135,9 @@ async def logout_all(
     db: AsyncSession = Depends(get_session),
 ):
     """
-    Logout user from all devices by revoking all refresh tokens
+    Logout user from all devices by revoking all refresh and access tokens
     """
     await refresh_token_repository.revoke_all_for_user(db, current_user.id)
+    await revoke_all_access_tokens(current_user.id)
     
     return {"detail": "Successfully logged out from all devices"}
\ No newline at end of file
@@ -7,7 +7,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.db import get_session
 from app.db.repositories import UserRepository
 from app.models.user import User, UserUpdate
-from app.services.auth import get_current_user
+from app.services.auth import (
+    get_current_user,
+    get_current_user_profile,
+    update_user_profile,
+)
 
 router = APIRouter()
 user_repository = UserRepository()
@@ -15,10 +19,10 @@ user_repository = UserRepository()
 
 @router.get("/me", response_model=User)
 async def read_users_me(
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_profile),
 ):
     """
-    Get current user
+    Get current user, served from the access token's profile claims when available
     """
     return current_user
 
@@ -32,7 +36,7 @@ async def update_user_me(
     """
     Update current user
     """
-    user = await user_repository.update(db, db_obj=current_user, obj_in=user_in)
+    user = await update_user_profile(db, current_user, user_in)
     return user
 
 
@@ -14,6 +14,32 @@ class Settings(BaseSettings):
         """Alias for DATABASE_URL for backward compatibility"""
         return self.DATABASE_URL
     
+    # Database pool and connection tuning
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_JIT: bool = False
+    DB_SQLITE_SYNCHRONOUS: str = "NORMAL"
+    DB_ECHO: bool = False
+    
+    # Read replicas (comma-separated); empty means all reads go to DATABASE_URL
+    DATABASE_READ_URLS: List[str] = []
+    
+    @validator("DATABASE_READ_URLS", pre=True)
+    def assemble_read_urls(cls, v: str | List[str]) -> List[str]:
+        if isinstance(v, str) and not v.startswith("["):
+            return [i.strip() for i in v.split(",") if i.strip()]
+        elif isinstance(v, (list, str)):
+            return v
+        raise ValueError(v)
+    
+    DB_READ_STICKY_SECONDS: float = 2.0
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    DB_REPLICA_LAG_CHECK_INTERVAL: float = 5.0
+    
     # Redis
     REDIS_URL: str = "redis://localhost:6379/0"
     
@@ -23,6 +49,16 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 15
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
     
+    # Embed profile claims in access tokens so /api/users/me skips the database.
+    # Tokens carrying claims use the shorter lifetime below to bound staleness.
+    ACCESS_TOKEN_PROFILE_CLAIMS: bool = False
+    ACCESS_TOKEN_PROFILE_CLAIMS_EXPIRE_MINUTES: int = 5
+    
+    # Access token denylist ("local" or "redis" for cross-replica sync)
+    TOKEN_DENYLIST_BACKEND: str = "local"
+    TOKEN_DENYLIST_CHANNEL: str = "auth:token-revocations"
+    TOKEN_DENYLIST_CAPACITY: int = 100_000
+    
     # CORS
     CORS_ORIGINS: List[str] = ["http://localhost:3000"]
     
@@ -37,6 +73,20 @@ class Settings(BaseSettings):
     # Security
     PASSWORD_HASH_ROUNDS: int = 12
     
+    # Login throttling
+    LOGIN_THROTTLE_ENABLED: bool = True
+    LOGIN_THROTTLE_BACKEND: str = "memory"  # "memory" or "redis"
+    LOGIN_THROTTLE_ACCOUNT_FREE_ATTEMPTS: int = 5
+    LOGIN_THROTTLE_IP_FREE_ATTEMPTS: int = 20
+    LOGIN_THROTTLE_BASE_DELAY_SECONDS: float = 1.0
+    LOGIN_THROTTLE_MAX_DELAY_SECONDS: float = 900.0
+    LOGIN_THROTTLE_WINDOW_SECONDS: float = 900.0
+    LOGIN_THROTTLE_MAX_ENTRIES: int = 100_000
+    # Per-IP throttling; off by default since behind a proxy every client shares its IP
+    LOGIN_THROTTLE_IP_ENABLED: bool = False
+    # Comma-separated proxy IPs/CIDRs whose X-Forwarded-For is believed, e.g. the gateway
+    LOGIN_THROTTLE_TRUSTED_PROXIES: str = ""
+    
     # Supabase
     SUPABASE_URL: str = "https://mock.supabase.co"
     SUPABASE_SERVICE_ROLE_KEY: str = "mock_key"
@@ -0,0 +1,379 @@
+"""
+Async database engine and session management.
+
+This module is kept identical in the auth, chat and notification services;
+change all three together. Pool sizing, asyncpg and SQLite tuning come from
+the DB_* settings, and pool usage is exposed through get_pool_metrics().
+
+When DATABASE_READ_URLS is set, statements issued inside repository methods
+decorated with @read_only are routed to a healthy replica, unless the same
+session or sticky key (usually the current user) wrote within the last
+DB_READ_STICKY_SECONDS. Replicas lagging more than DB_REPLICA_MAX_LAG_SECONDS
+are skipped until they catch up.
+"""
+
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from sqlalchemy import event, exc, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlmodel import SQLModel
+
+from app.core.config import settings
+
+
+class PoolMetrics:
+    """Connection pool usage and checkout wait statistics"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.wait_count += 1
+        self.wait_total += seconds
+        if seconds > self.wait_max:
+            self.wait_max = seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "checkouts": self.checkouts,
+            "checked_out": self.checked_out,
+            "max_checked_out": self.max_checked_out,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": (self.wait_total / self.wait_count * 1000) if self.wait_count else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long callers wait for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start)
+
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """Engine keyword arguments for a database URL"""
+    options: Dict[str, Any] = {
+        "echo": settings.DB_ECHO,
+        "future": True,
+    }
+    if is_sqlite(url):
+        return options
+
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    if url.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {
+            # Set to 0 when running behind pgbouncer in transaction mode
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {"jit": "on" if settings.DB_JIT else "off"},
+        }
+    return options
+
+
+def create_engine(url: str):
+    """Create an async engine with the configured pool and connection tuning"""
+    engine = create_async_engine(url, **engine_options(url))
+    sync_engine = engine.sync_engine
+
+    if url.startswith("sqlite+aiosqlite"):
+        @event.listens_for(sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={settings.DB_SQLITE_SYNCHRONOUS}")
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+    @event.listens_for(sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        pool_metrics.connects += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_metrics.checkouts += 1
+        pool_metrics.checked_out += 1
+        if pool_metrics.checked_out > pool_metrics.max_checked_out:
+            pool_metrics.max_checked_out = pool_metrics.checked_out
+
+    @event.listens_for(sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        pool_metrics.checked_out -= 1
+
+    @event.listens_for(sync_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool_metrics.invalidations += 1
+
+    return engine
+
+
+# Create async engine for the database
+engine = create_engine(settings.DATABASE_URL)
+
+logger = logging.getLogger(__name__)
+
+# Set while a @read_only repository method runs
+_read_only: ContextVar[bool] = ContextVar("db_read_only", default=False)
+
+# Identifies the caller (e.g. user id) for read-your-writes stickiness
+_sticky_key: ContextVar[Optional[str]] = ContextVar("db_sticky_key", default=None)
+
+
+def read_only(func):
+    """Mark a repository method as safe to serve from a read replica"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _read_only.reset(token)
+
+    return wrapper
+
+
+def set_sticky_key(key: Any) -> None:
+    """Tie reads and writes in the current context to a key such as a user id"""
+    _sticky_key.set(str(key) if key is not None else None)
+
+
+def use_primary(session: AsyncSession) -> None:
+    """Send every statement of a session to the primary, even @read_only ones"""
+    session.sync_session.info["primary"] = True
+
+
+class ReplicaRouter:
+    """Chooses between the primary and read replicas"""
+
+    def __init__(self, replica_urls: List[str]):
+        self.replicas = [create_engine(url) for url in replica_urls]
+        self.healthy = list(self.replicas)
+        self.lag: Dict[int, float] = {}
+        self._cycle = itertools.cycle(self.healthy) if self.healthy else None
+        self._recent_writes: Dict[str, float] = {}
+        self._monitor: Optional[asyncio.Task] = None
+        self.counters: Dict[str, int] = {"primary_reads": 0, "replica_reads": 0, "sticky_reads": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def note_write(self, session: Session) -> None:
+        now = time.monotonic()
+        session.info["last_write"] = now
+        key = _sticky_key.get()
+        if key is not None:
+            self._recent_writes[key] = now
+            if len(self._recent_writes) > 100_000:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        window = settings.DB_READ_STICKY_SECONDS
+        self._recent_writes = {k: t for k, t in self._recent_writes.items() if now - t < window}
+
+    def is_sticky(self, session: Session) -> bool:
+        window = settings.DB_READ_STICKY_SECONDS
+        now = time.monotonic()
+        last_write = session.info.get("last_write")
+        if last_write is not None and now - last_write < window:
+            return True
+        key = _sticky_key.get()
+        if key is not None:
+            last_write = self._recent_writes.get(key)
+            if last_write is not None and now - last_write < window:
+                return True
+        return False
+
+    def pick_replica(self):
+        if not self.healthy:
+            return None
+        return next(self._cycle)
+
+    async def check_lag(self) -> None:
+        """Measure replication lag and drop lagging replicas from rotation"""
+        healthy = []
+        for index, replica in enumerate(self.replicas):
+            try:
+                async with replica.connect() as conn:
+                    if replica.dialect.name == "postgresql":
+                        # The last replayed transaction ages while the primary is
+                        # idle, so a replica that has replayed all it received is current
+                        lag = (await conn.execute(text(
+                            "SELECT CASE WHEN NOT pg_is_in_recovery() "
+                            "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+                            "END"
+                        ))).scalar()
+                    else:
+                        lag = 0.0
+                self.lag[index] = float(lag or 0.0)
+                if self.lag[index] <= settings.DB_REPLICA_MAX_LAG_SECONDS:
+                    healthy.append(replica)
+            except Exception as e:
+                self.lag[index] = float("inf")
+                logger.warning(f"Read replica {index} unavailable: {str(e)}")
+        self.healthy = healthy
+        self._cycle = itertools.cycle(healthy) if healthy else None
+
+    async def start(self) -> None:
+        if self.enabled and self._monitor is None:
+            await self.check_lag()
+            self._monitor = asyncio.create_task(self._monitor_loop())
+
+    async def stop(self) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for replica in self.replicas:
+            await replica.dispose()
+
+    async def _monitor_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.DB_REPLICA_LAG_CHECK_INTERVAL)
+            await self.check_lag()
+
+
+replica_router = ReplicaRouter(settings.DATABASE_READ_URLS)
+
+
+class RoutingSession(Session):
+    """Session that sends read-only statements to replicas when possible"""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not replica_router.enabled:
+            return engine.sync_engine
+        if self._flushing or isinstance(clause, UpdateBase):
+            replica_router.note_write(self)
+            return engine.sync_engine
+        if not _read_only.get() or self.info.get("primary"):
+            return engine.sync_engine
+        if replica_router.is_sticky(self):
+            replica_router.counters["sticky_reads"] += 1
+            return engine.sync_engine
+        replica = replica_router.pick_replica()
+        if replica is None:
+            replica_router.counters["primary_reads"] += 1
+            return engine.sync_engine
+        replica_router.counters["replica_reads"] += 1
+        return replica.sync_engine
+
+
+# Create async session factory
+async_session_factory = sessionmaker(
+    engine,
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    expire_on_commit=False,
+    autocommit=False,
+    autoflush=False,
+)
+
+
+def get_pool_metrics() -> Dict[str, Any]:
+    """Current pool status together with the accumulated pool metrics"""
+    metrics = pool_metrics.snapshot()
+    pool = engine.sync_engine.pool
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        metrics.update(
+            pool_size=pool.size(),
+            pool_overflow=pool.overflow(),
+            pool_idle=pool.checkedin(),
+        )
+    if replica_router.enabled:
+        metrics["replicas"] = {
+            "healthy": len(replica_router.healthy),
+            "total": len(replica_router.replicas),
+            "lag_seconds": replica_router.lag,
+            **replica_router.counters,
+        }
+    return metrics
+
+
+async def create_db_and_tables():
+    """Create database tables if they don't exist"""
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    """Dependency for getting async database session"""
+    async with async_session_factory() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+
+@asynccontextmanager
+async def get_db_context() -> AsyncGenerator[AsyncSession, None]:
+    """Context manager for getting async database session"""
+    async with async_session_factory() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+
+# Lifespan event handler for FastAPI
+@asynccontextmanager
+async def lifespan(app):
+    """Lifespan event handler for FastAPI"""
+    # Create tables on startup
+    await create_db_and_tables()
+    await replica_router.start()
+
+    # Yield control back to FastAPI
+    yield
+
+    # Cleanup on shutdown
+    await replica_router.stop()
+    await engine.dispose()
@@ -2,23 +2,10 @@ from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
 from uuid import UUID
 
 from pydantic import BaseModel
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import Field, SQLModel, select
 
-from app.core.config import settings
-
-# Create async engine for SQLModel
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=settings.ENVIRONMENT == "development",
-    future=True,
-)
-
-# Create async session factory
-async_session = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
-)
+from app.core.database import async_session_factory as async_session, engine, read_only
 
 
 async def get_session() -> AsyncSession:
@@ -44,6 +31,7 @@ class BaseRepository(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         """
         self.model = model
 
+    @read_only
     async def get(self, db: AsyncSession, id: UUID) -> Optional[ModelType]:
         """
         Get a record by ID
@@ -52,6 +40,7 @@ class BaseRepository(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         results = await db.execute(statement)
         return results.scalar_one_or_none()
 
+    @read_only
     async def get_multi(
         self, db: AsyncSession, *, skip: int = 0, limit: int = 100
     ) -> List[ModelType]:
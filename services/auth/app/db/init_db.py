@@ -1,9 +1,8 @@
 import asyncio
 import logging
-from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.sql import text
 
-from app.core.config import settings
+from app.core.database import engine
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,9 +11,6 @@ async def init_db():
     """Initialize the database with required tables"""
     logger.info("Creating database tables...")
     
-    # Create async engine
-    engine = create_async_engine(settings.DATABASE_URL)
-    
     # Define SQL statements for creating tables
     create_users_table = """
     CREATE TABLE IF NOT EXISTS users (
@@ -24,6 +20,7 @@ async def init_db():
         hashed_password VARCHAR(255) NOT NULL,
         profile_image_url VARCHAR(255),
         is_active BOOLEAN NOT NULL DEFAULT TRUE,
+        profile_version INTEGER NOT NULL DEFAULT 0,
         created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
         updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
     );
@@ -41,10 +38,15 @@ async def init_db():
     );
     """
     
+    add_profile_version_column = """
+    ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_version INTEGER NOT NULL DEFAULT 0;
+    """
+    
     # Execute SQL statements
     async with engine.begin() as conn:
         logger.info("Creating users table...")
         await conn.execute(text(create_users_table))
+        await conn.execute(text(add_profile_version_column))
         
         logger.info("Creating refresh_tokens table...")
         await conn.execute(text(create_refresh_tokens_table))
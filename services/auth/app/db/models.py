@@ -15,6 +15,7 @@ class User(SQLModel, table=True):
     hashed_password: str
     profile_image_url: Optional[str] = None
     is_active: bool = True
+    profile_version: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
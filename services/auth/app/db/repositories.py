@@ -5,6 +5,7 @@ from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 
+from app.core.database import read_only
 from app.db.base import BaseRepository
 from app.db.models import User, RefreshToken
 from app.models.user import UserCreate, UserUpdate
@@ -16,6 +17,7 @@ class UserRepository(BaseRepository[User, UserCreate, UserUpdate]):
     def __init__(self):
         super().__init__(User)
 
+    @read_only
     async def get_by_email(self, db: AsyncSession, email: str) -> Optional[User]:
         """Get a user by email"""
         statement = select(User).where(User.email == email)
@@ -40,6 +42,7 @@ class RefreshTokenRepository:
         await db.refresh(db_obj)
         return db_obj
 
+    @read_only
     async def get_by_token(self, db: AsyncSession, token: str) -> Optional[RefreshToken]:
         """Get a refresh token by token value"""
         statement = select(RefreshToken).where(RefreshToken.token == token)
@@ -2,9 +2,12 @@ from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
+from app.core.database import get_pool_metrics, replica_router
 from app.api.auth import router as auth_router
 from app.api.users import router as users_router
 from app.core.exceptions import setup_exception_handlers
+from app.services.profile_claims import profile_versions
+from app.services.token_denylist import token_denylist
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -30,6 +33,20 @@ setup_exception_handlers(app)
 app.include_router(auth_router, tags=["auth"])
 app.include_router(users_router, prefix="/api/users", tags=["users"])
 
+@app.on_event("startup")
+async def startup():
+    """Start listening for token revocations and profile changes, and monitoring read replicas"""
+    await token_denylist.start()
+    await profile_versions.start()
+    await replica_router.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await token_denylist.stop()
+    await replica_router.stop()
+
+
 @app.get("/api/health", tags=["health"])
 async def health_check():
     """
@@ -37,6 +54,13 @@ async def health_check():
     """
     return {"status": "ok", "service": "auth"}
 
+@app.get("/api/health/db", tags=["health"])
+async def database_health():
+    """
+    Database connection pool usage and checkout wait metrics
+    """
+    return {"service": "auth", "pool": get_pool_metrics()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
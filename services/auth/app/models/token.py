@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional
 from pydantic import BaseModel, Field
 from uuid import UUID, uuid4
 
@@ -18,6 +18,7 @@ class TokenPayload(BaseModel):
     iat: Optional[datetime] = None
     jti: Optional[str] = None  # JWT ID for token identification
     type: str = "access"  # Token type: access or refresh
+    prf: Optional[Dict[str, Any]] = None  # Compact profile claims, see services/profile_claims.py
 
 
 class RefreshToken(BaseModel):
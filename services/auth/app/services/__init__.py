@@ -1,23 +1,37 @@
 from app.services.auth import (
+    access_token_expires_in,
     authenticate_user,
     create_access_token,
     create_refresh_token,
     create_user_refresh_token,
+    decode_access_token,
+    get_access_token_payload,
     get_current_user,
+    get_current_user_profile,
     get_password_hash,
     refresh_access_token,
     register_new_user,
+    revoke_access_token,
+    revoke_all_access_tokens,
+    update_user_profile,
     verify_password,
 )
 
 __all__ = [
+    "access_token_expires_in",
     "authenticate_user",
     "create_access_token",
     "create_refresh_token",
     "create_user_refresh_token",
+    "decode_access_token",
+    "get_access_token_payload",
     "get_current_user",
+    "get_current_user_profile",
     "get_password_hash",
     "refresh_access_token",
     "register_new_user",
+    "revoke_access_token",
+    "revoke_all_access_tokens",
+    "update_user_profile",
     "verify_password",
 ] 
\ No newline at end of file
@@ -1,3 +1,4 @@
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Union
 from uuid import UUID, uuid4
@@ -9,11 +10,21 @@ from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
+from app.core.database import set_sticky_key
 from app.db import get_session
 from app.db.repositories import UserRepository, RefreshTokenRepository
 from app.models.token import TokenPayload
-from app.models.user import User, UserCreate, UserInDB
+from app.models.user import User, UserCreate, UserInDB, UserUpdate
+from app.services.login_throttle import login_throttle
+from app.services.profile_claims import (
+    PROFILE_FIELDS,
+    build_profile_claims,
+    profile_claims_expire_seconds,
+    profile_versions,
+    user_from_profile_claims,
+)
 from app.services.supabase_adapter import supabase_adapter
+from app.services.token_denylist import token_denylist
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
@@ -36,6 +47,22 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+_dummy_password_hash: Optional[str] = None
+
+
+def dummy_verify_password(plain_password: str) -> bool:
+    """
+    Run a password verification against a throwaway hash so that unknown
+    accounts cost the same as known ones and do not leak through timing
+    """
+    global _dummy_password_hash
+    if _dummy_password_hash is None:
+        _dummy_password_hash = get_password_hash(uuid4().hex)
+    login_throttle.counters["dummy_verifications"] += 1
+    pwd_context.verify(plain_password, _dummy_password_hash)
+    return False
+
+
 async def authenticate_user(
     db: AsyncSession, email: str, password: str
 ) -> Optional[User]:
@@ -63,29 +90,45 @@ async def authenticate_user(
     # Fall back to local authentication
     user = await user_repository.get_by_email(db, email)
     if not user:
+        dummy_verify_password(password)
         return None
     if not verify_password(password, user.hashed_password):
         return None
     return user
 
 
+def access_token_expires_in(user: Optional[User] = None) -> int:
+    """Lifetime in seconds of an access token issued for a user"""
+    if user is not None and settings.ACCESS_TOKEN_PROFILE_CLAIMS:
+        return profile_claims_expire_seconds()
+    return settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+
 def create_access_token(
-    subject: Union[str, UUID], expires_delta: Optional[timedelta] = None
+    subject: Union[str, UUID],
+    expires_delta: Optional[timedelta] = None,
+    user: Optional[User] = None,
 ) -> str:
-    """Create a JWT access token"""
+    """
+    Create a JWT access token
+
+    If profile claims are enabled and the user is given, the token embeds
+    the user's profile so it can be served without a database read.
+    """
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(
-            minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
-        )
+        expire = datetime.utcnow() + timedelta(seconds=access_token_expires_in(user))
     
     to_encode = {
         "sub": str(subject),
         "exp": expire,
         "iat": datetime.utcnow(),
+        "jti": uuid4().hex,
         "type": "access"
     }
+    if user is not None and settings.ACCESS_TOKEN_PROFILE_CLAIMS:
+        to_encode["prf"] = build_profile_claims(user)
     
     return jwt.encode(
         to_encode, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM
@@ -115,16 +158,17 @@ def create_refresh_token(
     )
 
 
-async def get_current_user(
-    db: AsyncSession = Depends(get_session),
-    token: str = Depends(oauth2_scheme),
-) -> User:
-    """Get the current authenticated user from a JWT token"""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def decode_access_token(token: str) -> TokenPayload:
+    """Decode and validate an access token without touching the database"""
+    credentials_exception = _credentials_exception()
     
     try:
         payload = jwt.decode(
@@ -137,7 +181,7 @@ async def get_current_user(
             raise credentials_exception
         
         # Check token expiration
-        if datetime.fromtimestamp(token_data.exp) < datetime.utcnow():
+        if token_data.exp.timestamp() < time.time():
             raise credentials_exception
             
         user_id = token_data.sub
@@ -146,16 +190,103 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = await user_repository.get(db, UUID(user_id))
-    if user is None:
+    issued_at = token_data.iat.timestamp() if token_data.iat else 0.0
+    if token_denylist.is_revoked(token_data.jti, user_id, issued_at):
         raise credentials_exception
     
+    return token_data
+
+
+async def get_access_token_payload(
+    token: str = Depends(oauth2_scheme),
+) -> TokenPayload:
+    """Get the validated payload of the current access token"""
+    return decode_access_token(token)
+
+
+async def revoke_access_token(token_data: TokenPayload) -> None:
+    """Revoke an access token immediately instead of waiting for it to expire"""
+    if token_data.jti:
+        await token_denylist.revoke_token(token_data.jti, token_data.exp.timestamp())
+
+
+async def revoke_all_access_tokens(user_id: Union[str, UUID]) -> None:
+    """Revoke every access token issued to a user up to now"""
+    await token_denylist.revoke_user(str(user_id))
+
+
+async def get_current_user(
+    db: AsyncSession = Depends(get_session),
+    token: str = Depends(oauth2_scheme),
+) -> User:
+    """Get the current authenticated user from a JWT token"""
+    token_data = decode_access_token(token)
+    set_sticky_key(token_data.sub)
+    
+    user = await user_repository.get(db, UUID(token_data.sub))
+    if user is None:
+        raise _credentials_exception()
+    
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     
     return user
 
 
+async def get_current_user_profile(
+    db: AsyncSession = Depends(get_session),
+    token: str = Depends(oauth2_scheme),
+) -> User:
+    """
+    Get the current user's public profile, served from the token's profile
+    claims when they are present and current, otherwise from the database
+    """
+    token_data = decode_access_token(token)
+    
+    if token_data.prf is not None:
+        if profile_versions.is_current(token_data.sub, token_data.prf.get("pv", 0)):
+            user = user_from_profile_claims(token_data.sub, token_data.prf)
+            if user is not None:
+                if not user.is_active:
+                    raise HTTPException(status_code=400, detail="Inactive user")
+                profile_versions.counters["served_from_claims"] += 1
+                return user
+        else:
+            profile_versions.counters["stale_claims"] += 1
+    
+    # The session only connects when queried, so the claims path never hits the database
+    set_sticky_key(token_data.sub)
+    user = await user_repository.get(db, UUID(token_data.sub))
+    if user is None:
+        raise _credentials_exception()
+    
+    if not user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    
+    return user
+
+
+async def update_user_profile(
+    db: AsyncSession, user: User, user_in: UserUpdate
+) -> User:
+    """Update a user, bumping the profile version when profile fields change"""
+    update_data = user_in.dict(exclude_unset=True)
+    if any(
+        field in update_data and update_data[field] != getattr(user, field)
+        for field in PROFILE_FIELDS
+    ):
+        update_data["profile_version"] = (user.profile_version or 0) + 1
+        update_data["updated_at"] = datetime.utcnow()
+    
+    user = await user_repository.update(db, db_obj=user, obj_in=update_data)
+    
+    if "profile_version" in update_data:
+        # Outstanding tokens carry the old snapshot; stop serving them from claims
+        await profile_versions.bump(user.id, user.profile_version)
+    
+    return user
+
+
 async def register_new_user(
     db: AsyncSession, user_in: UserCreate
 ) -> User:
@@ -274,7 +405,7 @@ async def refresh_access_token(
             )
         
         # Create new access token
-        access_token = create_access_token(user.id)
+        access_token = create_access_token(user.id, user=user)
         
         # Create new refresh token (token rotation)
         new_refresh_token = await create_user_refresh_token(db, user.id)
@@ -285,7 +416,7 @@ async def refresh_access_token(
         return {
             "access_token": access_token,
             "token_type": "bearer",
-            "expires_in": settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+            "expires_in": access_token_expires_in(user),
             "refresh_token": new_refresh_token,
         }
     
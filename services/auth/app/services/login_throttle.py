@@ -0,0 +1,300 @@
+"""
+Login throttling for the authentication service.
+
+Sign-in attempts are tracked per account and, when enabled, per client IP.
+An attempt is counted before its password is checked and refunded if it
+succeeds, so concurrent guesses cannot all slip through before the first
+failure is recorded. Once a key exceeds its free attempts it is blocked with
+an exponentially growing delay, and blocked attempts are rejected before any
+password hashing work is done. State lives in process memory by default, or
+in Redis so all auth replicas share the same view.
+
+Behind a reverse proxy every request comes from the proxy's address, so the
+client IP is only taken from X-Forwarded-For when the request was sent by
+one of LOGIN_THROTTLE_TRUSTED_PROXIES.
+"""
+
+import ipaddress
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from app.core.config import settings
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_networks(value: str) -> List[Network]:
+    """Parse a comma-separated list of IP addresses and CIDR ranges"""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+
+def _is_trusted(address: str, trusted: Sequence[Network]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted)
+
+
+def resolve_client_ip(
+    peer: Optional[str], forwarded_for: Optional[str], trusted: Sequence[Network]
+) -> Optional[str]:
+    """
+    Client address of a request: the peer itself, or, when the peer is a
+    trusted proxy, the nearest X-Forwarded-For hop that is not one
+    """
+    if not peer or not forwarded_for or not _is_trusted(peer, trusted):
+        return peer
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    # Proxies append, so anything left of the first untrusted hop is client supplied
+    for hop in reversed(hops):
+        if not _is_trusted(hop, trusted):
+            return hop
+    return hops[0] if hops else peer
+
+
+class InMemoryThrottleStore:
+    """Bounded in-process store of attempt counters"""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        # key -> (attempts, blocked_until, expires_at)
+        self._entries: "OrderedDict[str, Tuple[int, float, float]]" = OrderedDict()
+
+    def _get(self, key: str, now: float) -> Tuple[int, float]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0, 0.0
+        attempts, blocked_until, expires_at = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return 0, 0.0
+        return attempts, blocked_until
+
+    async def get(self, key: str, now: float) -> Tuple[int, float]:
+        """Return (attempts, blocked_until) for a key"""
+        return self._get(key, now)
+
+    async def attempt(
+        self, key: str, now: float, window: float, delay_for
+    ) -> Tuple[bool, float]:
+        """
+        Count an attempt unless the key is blocked; returns (allowed, blocked_until)
+        """
+        # No awaits in here, so concurrent attempts are counted one at a time
+        attempts, blocked_until = self._get(key, now)
+        if blocked_until > now:
+            return False, blocked_until
+        attempts += 1
+        blocked_until = now + delay_for(attempts)
+        self._entries[key] = (attempts, blocked_until, max(now + window, blocked_until))
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True, blocked_until
+
+    async def refund(self, key: str) -> None:
+        """Take back one counted attempt"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries[key] = (max(entry[0] - 1, 0), entry[1], entry[2])
+
+    async def reset(self, key: str) -> None:
+        """Forget a key"""
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisThrottleStore:
+    """Redis-backed store so that throttling state is shared across replicas"""
+
+    def __init__(self, redis_url: str, prefix: str = "auth:throttle:"):
+        self.redis_url = redis_url
+        self.prefix = prefix
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from redis import asyncio as aioredis
+
+            self._client = aioredis.from_url(self.redis_url, decode_responses=True)
+        return self._client
+
+    async def get(self, key: str, now: float) -> Tuple[int, float]:
+        """Return (attempts, blocked_until) for a key"""
+        values = await self.client.hmget(self.prefix + key, "attempts", "blocked_until")
+        return int(values[0] or 0), float(values[1] or 0.0)
+
+    async def attempt(
+        self, key: str, now: float, window: float, delay_for
+    ) -> Tuple[bool, float]:
+        """
+        Count an attempt unless the key is blocked; returns (allowed, blocked_until)
+        """
+        redis_key = self.prefix + key
+
+        async def count(pipe) -> Tuple[bool, float]:
+            # Runs again if another replica changes the key before EXEC
+            values = await pipe.hmget(redis_key, "attempts", "blocked_until")
+            attempts, blocked_until = int(values[0] or 0), float(values[1] or 0.0)
+            if blocked_until > now:
+                return False, blocked_until
+            attempts += 1
+            delay = delay_for(attempts)
+            pipe.multi()
+            pipe.hset(redis_key, mapping={"attempts": attempts, "blocked_until": now + delay})
+            pipe.expire(redis_key, int(max(window, delay)) + 1)
+            return True, now + delay
+
+        return await self.client.transaction(count, redis_key, value_from_callable=True)
+
+    async def refund(self, key: str) -> None:
+        """Take back one counted attempt"""
+        redis_key = self.prefix + key
+        if await self.client.hincrby(redis_key, "attempts", -1) <= 0:
+            # Expired meanwhile, or nothing left to hold on to
+            await self.client.delete(redis_key)
+
+    async def reset(self, key: str) -> None:
+        """Forget a key"""
+        await self.client.delete(self.prefix + key)
+
+
+class LoginThrottle:
+    """Per-account and per-IP attempt tracker with exponential backoff"""
+
+    def __init__(
+        self,
+        store=None,
+        *,
+        account_free_attempts: int = 5,
+        ip_free_attempts: int = 20,
+        base_delay: float = 1.0,
+        max_delay: float = 900.0,
+        window: float = 900.0,
+        enabled: bool = True,
+        ip_enabled: bool = False,
+        trusted_proxies: Sequence[Network] = (),
+    ):
+        self.store = store or InMemoryThrottleStore()
+        self.account_free_attempts = account_free_attempts
+        self.ip_free_attempts = ip_free_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.enabled = enabled
+        self.ip_enabled = ip_enabled
+        self.trusted_proxies = list(trusted_proxies)
+        self.counters: Dict[str, int] = {
+            "checks": 0,
+            "blocked_account": 0,
+            "blocked_ip": 0,
+            "failures": 0,
+            "successes": 0,
+            "dummy_verifications": 0,
+        }
+
+    @classmethod
+    def from_settings(cls) -> "LoginThrottle":
+        """Build a throttle from the service settings"""
+        if settings.LOGIN_THROTTLE_BACKEND == "redis":
+            store = RedisThrottleStore(settings.REDIS_URL)
+        else:
+            store = InMemoryThrottleStore(settings.LOGIN_THROTTLE_MAX_ENTRIES)
+        return cls(
+            store,
+            account_free_attempts=settings.LOGIN_THROTTLE_ACCOUNT_FREE_ATTEMPTS,
+            ip_free_attempts=settings.LOGIN_THROTTLE_IP_FREE_ATTEMPTS,
+            base_delay=settings.LOGIN_THROTTLE_BASE_DELAY_SECONDS,
+            max_delay=settings.LOGIN_THROTTLE_MAX_DELAY_SECONDS,
+            window=settings.LOGIN_THROTTLE_WINDOW_SECONDS,
+            enabled=settings.LOGIN_THROTTLE_ENABLED,
+            ip_enabled=settings.LOGIN_THROTTLE_IP_ENABLED,
+            trusted_proxies=parse_networks(settings.LOGIN_THROTTLE_TRUSTED_PROXIES),
+        )
+
+    def client_ip(self, peer: Optional[str], forwarded_for: Optional[str]) -> Optional[str]:
+        """The address to throttle a request by, or None when IP throttling is off"""
+        if not self.ip_enabled:
+            return None
+        return resolve_client_ip(peer, forwarded_for, self.trusted_proxies)
+
+    @staticmethod
+    def _account_key(email: str) -> str:
+        return "account:" + email.strip().lower()
+
+    @staticmethod
+    def _ip_key(ip: str) -> str:
+        return "ip:" + ip
+
+    def _delay(self, attempts: int, free_attempts: int) -> float:
+        """Backoff delay once a key has used up its free attempts"""
+        excess = attempts - free_attempts
+        if excess <= 0:
+            return 0.0
+        return min(self.base_delay * (2 ** (excess - 1)), self.max_delay)
+
+    async def attempt(self, email: str, ip: Optional[str]) -> float:
+        """
+        Count a sign-in attempt before its password is verified. Returns the
+        number of seconds the caller must wait before retrying, or 0 if the
+        attempt may proceed to password verification
+        """
+        if not self.enabled:
+            return 0.0
+        self.counters["checks"] += 1
+        now = time.time()
+
+        allowed, blocked_until = await self.store.attempt(
+            self._account_key(email),
+            now,
+            self.window,
+            lambda attempts: self._delay(attempts, self.account_free_attempts),
+        )
+        if not allowed:
+            self.counters["blocked_account"] += 1
+            return blocked_until - now
+
+        if ip:
+            allowed, blocked_until = await self.store.attempt(
+                self._ip_key(ip),
+                now,
+                self.window,
+                lambda attempts: self._delay(attempts, self.ip_free_attempts),
+            )
+            if not allowed:
+                self.counters["blocked_ip"] += 1
+                # The attempt never reaches the account, so give it back
+                await self.store.refund(self._account_key(email))
+                return blocked_until - now
+
+        return 0.0
+
+    def record_failure(self) -> None:
+        """Note a failed sign-in; it was already counted by attempt()"""
+        if self.enabled:
+            self.counters["failures"] += 1
+
+    async def record_success(self, email: str, ip: Optional[str]) -> None:
+        """Clear the account's history and refund the IP's attempt after a successful sign-in"""
+        if not self.enabled:
+            return
+        self.counters["successes"] += 1
+        await self.store.reset(self._account_key(email))
+        if ip:
+            await self.store.refund(self._ip_key(ip))
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of the throttle counters"""
+        stats = dict(self.counters)
+        if isinstance(self.store, InMemoryThrottleStore):
+            stats["tracked_keys"] = len(self.store)
+        return stats
+
+
+# Create a singleton instance
+login_throttle = LoginThrottle.from_settings()
@@ -0,0 +1,133 @@
+"""
+Profile claims embedded in access tokens.
+
+When ACCESS_TOKEN_PROFILE_CLAIMS is enabled, access tokens carry a compact,
+versioned snapshot of the user's profile under the "prf" claim so that
+/api/users/me (and any service that shares the JWT secret) can answer from
+the verified token instead of reading the users table.
+
+Claim layout (schema version 1):
+    v    claim schema version
+    pv   user's profile_version when the token was issued
+    em   email
+    dn   display_name
+    img  profile_image_url
+    act  is_active
+    ca   created_at (unix seconds)
+    ua   updated_at (unix seconds)
+
+Profile version bumps are broadcast on the token revocation channel, so a
+profile change on any auth replica stops every replica serving the old
+snapshot.
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from app.core.config import settings
+from app.models.user import User
+from app.services.token_denylist import token_denylist
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CLAIMS_VERSION = 1
+
+# Fields whose change makes outstanding profile claims stale
+PROFILE_FIELDS = ("email", "display_name", "profile_image_url", "is_active")
+
+
+def build_profile_claims(user) -> Dict[str, Any]:
+    """Build the compact profile claim set for a user"""
+    return {
+        "v": PROFILE_CLAIMS_VERSION,
+        "pv": getattr(user, "profile_version", 0) or 0,
+        "em": user.email,
+        "dn": user.display_name,
+        "img": user.profile_image_url,
+        "act": user.is_active,
+        "ca": int(user.created_at.timestamp()),
+        "ua": int(user.updated_at.timestamp()),
+    }
+
+
+def user_from_profile_claims(user_id: str, claims: Dict[str, Any]) -> Optional[User]:
+    """Rebuild the public user model from profile claims, or None if unusable"""
+    if claims.get("v") != PROFILE_CLAIMS_VERSION:
+        return None
+    try:
+        return User(
+            id=UUID(user_id),
+            email=claims["em"],
+            display_name=claims["dn"],
+            profile_image_url=claims.get("img"),
+            is_active=claims["act"],
+            created_at=datetime.fromtimestamp(claims["ca"]),
+            updated_at=datetime.fromtimestamp(claims["ua"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class ProfileVersionRegistry:
+    """
+    Tracks bumped profile versions so that tokens carrying an older profile
+    snapshot stop being served from their claims
+    """
+
+    def __init__(self, pubsub=None, channel: str = "auth:token-revocations", max_entries: int = 100_000):
+        self.pubsub = pubsub
+        self.channel = channel
+        self.max_entries = max_entries
+        self._versions: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {"served_from_claims": 0, "stale_claims": 0, "publish_errors": 0}
+
+    async def start(self) -> None:
+        """Receive version bumps made by other replicas"""
+        if self.pubsub is not None:
+            await self.pubsub.subscribe(self.channel, self._apply)
+
+    async def bump(self, user_id: Any, profile_version: int) -> None:
+        """Record a user's new profile version here and on every other replica"""
+        self._set(str(user_id), profile_version)
+        if self.pubsub is None:
+            return
+        try:
+            await self.pubsub.publish(
+                self.channel, {"op": "profile", "sub": str(user_id), "pv": profile_version}
+            )
+        except Exception as e:
+            self.counters["publish_errors"] += 1
+            logger.error(f"Failed to broadcast profile version: {str(e)}")
+
+    async def _apply(self, message: Dict) -> None:
+        # The channel also carries token revocations
+        if message.get("op") == "profile":
+            self._set(message["sub"], int(message["pv"]))
+
+    def _set(self, key: str, profile_version: int) -> None:
+        current = self._versions.get(key)
+        if current is not None and current >= profile_version:
+            return
+        if len(self._versions) >= self.max_entries and key not in self._versions:
+            # Drop the oldest entry; those tokens expire within the claim lifetime anyway
+            self._versions.pop(next(iter(self._versions)))
+        self._versions[key] = profile_version
+
+    def is_current(self, user_id: str, profile_version: int) -> bool:
+        """Check whether a token's profile snapshot is still current"""
+        latest = self._versions.get(str(user_id))
+        return latest is None or profile_version >= latest
+
+
+def profile_claims_expire_seconds() -> int:
+    """Lifetime of access tokens that carry profile claims"""
+    return min(
+        settings.ACCESS_TOKEN_PROFILE_CLAIMS_EXPIRE_MINUTES,
+        settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+    ) * 60
+
+
+# Create a singleton instance
+profile_versions = ProfileVersionRegistry(token_denylist.pubsub, channel=token_denylist.channel)
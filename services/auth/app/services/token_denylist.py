@@ -0,0 +1,291 @@
+"""
+Access token denylist for immediate logout.
+
+Revoked access tokens are remembered by their jti until their own expiry,
+and "logout everywhere" is remembered per user as a cut-off issue time.
+A Bloom filter sits in front of both maps so the common case, a token that
+was never revoked, is answered without touching the maps or any I/O.
+Revocations are broadcast to the other auth replicas over a pub/sub
+channel; LocalPubSub stands in for Redis in a single process and in tests.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import time
+from hashlib import blake2b
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[Dict], Awaitable[None]]
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys"""
+
+    def __init__(self, capacity: int = 100_000, hashes: int = 7):
+        # ~10 bits per key keeps false positives around 1% at capacity
+        self.size = max(capacity * 10, 64)
+        self.hashes = hashes
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class LocalPubSub:
+    """In-process pub/sub used when no shared broker is configured"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+
+    async def publish(self, channel: str, message: Dict) -> None:
+        for handler in list(self._handlers.get(channel, ())):
+            await handler(message)
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def close(self) -> None:
+        self._handlers.clear()
+
+
+class RedisPubSub:
+    """Redis pub/sub so revocations reach every auth replica"""
+
+    def __init__(self, redis_url: str):
+        self.redis_url = redis_url
+        self._client = None
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            from redis import asyncio as aioredis
+
+            self._client = aioredis.from_url(self.redis_url, decode_responses=True)
+        return self._client
+
+    async def publish(self, channel: str, message: Dict) -> None:
+        await self.client.publish(channel, json.dumps(message))
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        if self._pubsub is None:
+            self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._handlers.setdefault(channel, []).append(handler)
+        await self._pubsub.subscribe(channel)
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+
+    async def _read(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                async for raw in self._pubsub.listen():
+                    delay = 1.0
+                    try:
+                        message = json.loads(raw["data"])
+                        for handler in self._handlers.get(raw["channel"], ()):
+                            await handler(message)
+                    except Exception as e:
+                        logger.error(f"Failed to apply token revocation message: {str(e)}")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Lost Redis pub/sub connection, reconnecting in {delay:.0f}s: {str(e)}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+            try:
+                await self._resubscribe()
+            except Exception as e:
+                logger.error(f"Failed to resubscribe to Redis: {str(e)}")
+
+    async def _resubscribe(self) -> None:
+        """Replace the pub/sub connection and subscribe it to every channel again"""
+        old, self._pubsub = self._pubsub, self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await old.close()
+        except Exception:
+            pass
+        if self._handlers:
+            await self._pubsub.subscribe(*self._handlers)
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class AccessTokenDenylist:
+    """jti- and user-based access token revocation held in memory"""
+
+    def __init__(
+        self,
+        pubsub=None,
+        channel: str = "auth:token-revocations",
+        capacity: int = 100_000,
+        purge_interval: float = 60.0,
+    ):
+        self.pubsub = pubsub or LocalPubSub()
+        self.channel = channel
+        self.capacity = capacity
+        self.purge_interval = purge_interval
+        self._bloom = BloomFilter(capacity)
+        # jti -> exp (unix seconds)
+        self._revoked_jtis: Dict[str, float] = {}
+        # user id -> (tokens issued before this time are revoked, entry expiry)
+        self._revoked_users: Dict[str, Tuple[float, float]] = {}
+        self._purge_task: Optional[asyncio.Task] = None
+        self.counters: Dict[str, int] = {
+            "checks": 0,
+            "bloom_hits": 0,
+            "revoked_hits": 0,
+            "revocations": 0,
+            "publish_errors": 0,
+        }
+
+    @classmethod
+    def from_settings(cls) -> "AccessTokenDenylist":
+        """Build a denylist from the service settings"""
+        if settings.TOKEN_DENYLIST_BACKEND == "redis":
+            pubsub = RedisPubSub(settings.REDIS_URL)
+        else:
+            pubsub = LocalPubSub()
+        return cls(
+            pubsub,
+            channel=settings.TOKEN_DENYLIST_CHANNEL,
+            capacity=settings.TOKEN_DENYLIST_CAPACITY,
+        )
+
+    async def start(self) -> None:
+        """Subscribe to revocations from other replicas and start purging"""
+        await self.pubsub.subscribe(self.channel, self._apply)
+        if self._purge_task is None:
+            self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self) -> None:
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            self._purge_task = None
+        await self.pubsub.close()
+
+    async def revoke_token(self, jti: str, exp: float) -> None:
+        """Revoke a single access token until its expiry"""
+        self.counters["revocations"] += 1
+        self._add_jti(jti, exp)
+        await self._publish({"op": "jti", "jti": jti, "exp": exp})
+
+    async def revoke_user(self, user_id: str, issued_before: Optional[float] = None) -> None:
+        """Revoke every access token issued to a user before the given time"""
+        # iat claims are whole seconds, so round up: every token issued in
+        # the same second as the revocation, before or after it, is revoked
+        issued_before = math.ceil(issued_before or time.time())
+        expires_at = issued_before + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        self.counters["revocations"] += 1
+        self._add_user(user_id, issued_before, expires_at)
+        await self._publish({"op": "user", "sub": user_id, "before": issued_before, "exp": expires_at})
+
+    async def _publish(self, message: Dict) -> None:
+        # Already applied here; other replicas miss it until the token expires
+        try:
+            await self.pubsub.publish(self.channel, message)
+        except Exception as e:
+            self.counters["publish_errors"] += 1
+            logger.error(f"Failed to broadcast token revocation: {str(e)}")
+
+    def is_revoked(self, jti: Optional[str], user_id: str, issued_at: float) -> bool:
+        """Check whether an access token has been revoked"""
+        self.counters["checks"] += 1
+        if not self._revoked_jtis and not self._revoked_users:
+            return False
+        bloom = self._bloom
+        jti_maybe = jti is not None and jti in bloom
+        user_maybe = ("u:" + user_id) in bloom if self._revoked_users else False
+        if not jti_maybe and not user_maybe:
+            return False
+
+        self.counters["bloom_hits"] += 1
+        now = time.time()
+        if jti_maybe:
+            exp = self._revoked_jtis.get(jti)
+            if exp is not None and exp > now:
+                self.counters["revoked_hits"] += 1
+                return True
+        if user_maybe:
+            entry = self._revoked_users.get(user_id)
+            if entry is not None and entry[1] > now and int(issued_at) < entry[0]:
+                self.counters["revoked_hits"] += 1
+                return True
+        return False
+
+    def purge_expired(self) -> None:
+        """Drop expired entries and rebuild the Bloom filter without them"""
+        now = time.time()
+        self._revoked_jtis = {j: e for j, e in self._revoked_jtis.items() if e > now}
+        self._revoked_users = {u: v for u, v in self._revoked_users.items() if v[1] > now}
+        self._rebuild_bloom()
+
+    def _rebuild_bloom(self) -> None:
+        capacity = max(self.capacity, len(self._revoked_jtis) + len(self._revoked_users))
+        bloom = BloomFilter(capacity)
+        for jti in self._revoked_jtis:
+            bloom.add(jti)
+        for user_id in self._revoked_users:
+            bloom.add("u:" + user_id)
+        self._bloom = bloom
+
+    def _add_jti(self, jti: str, exp: float) -> None:
+        self._revoked_jtis[jti] = exp
+        self._bloom.add(jti)
+        if len(self._revoked_jtis) > self.capacity:
+            self.purge_expired()
+
+    def _add_user(self, user_id: str, issued_before: float, expires_at: float) -> None:
+        current = self._revoked_users.get(user_id)
+        if current is None or current[0] < issued_before:
+            self._revoked_users[user_id] = (issued_before, expires_at)
+        self._bloom.add("u:" + user_id)
+
+    async def _apply(self, message: Dict) -> None:
+        """Apply a revocation published by any replica, including this one"""
+        if message.get("op") == "jti":
+            self._add_jti(message["jti"], float(message["exp"]))
+        elif message.get("op") == "user":
+            self._add_user(message["sub"], math.ceil(float(message["before"])), float(message["exp"]))
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            self.purge_expired()
+
+
+# Create a singleton instance
+token_denylist = AccessTokenDenylist.from_settings()
@@ -0,0 +1,4 @@
+from app.api.messages import router as messages_router
+from app.api.websocket import router as websocket_router
+
+__all__ = ["messages_router", "websocket_router"]
@@ -0,0 +1,39 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Path, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.deps import get_current_user_id
+from app.core.database import get_db
+from app.models.message import ROOM_ID_PATTERN, MessageCreate, MessagePage, MessageRead
+from app.services.message_service import MessageService
+
+router = APIRouter()
+
+
+@router.get("/{room_id}", response_model=MessagePage)
+async def read_messages(
+    room_id: str = Path(..., regex=ROOM_ID_PATTERN),
+    before: Optional[int] = Query(None, ge=0, description="Return the messages just before this id"),
+    after: Optional[int] = Query(None, ge=0, description="Return the messages just after this id"),
+    limit: int = Query(50, ge=1, le=200),
+    user_id: str = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_db),
+):
+    """
+    Page through a room's history, oldest first within a page
+    """
+    return await MessageService(session).get_history(room_id, before=before, after=after, limit=limit)
+
+
+@router.post("/{room_id}", response_model=MessageRead, status_code=status.HTTP_201_CREATED)
+async def send_message(
+    message: MessageCreate,
+    room_id: str = Path(..., regex=ROOM_ID_PATTERN),
+    user_id: str = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_db),
+):
+    """
+    Send a message to a room
+    """
+    return await MessageService(session).send_message(room_id, user_id, message)
@@ -0,0 +1,62 @@
+import json
+from typing import Any, Dict
+
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect, status
+
+from app.api.deps import decode_user_id
+from app.core.database import set_sticky_key
+from app.core.exceptions import AppException
+from app.models.message import is_valid_room_id
+from app.services.hub import ChatConnection, hub
+
+router = APIRouter()
+
+
+def handle_frame(connection: ChatConnection, frame: Dict[str, Any]) -> None:
+    """Act on one client frame"""
+    frame_type = frame.get("type")
+    room_id = frame.get("room_id")
+    if frame_type == "ping":
+        hub.send(connection, {"type": "pong"})
+    elif frame_type in ("join", "leave") and not (isinstance(room_id, str) and is_valid_room_id(room_id)):
+        hub.send(connection, {"type": "error", "detail": "Invalid room id"})
+    elif frame_type == "join":
+        # Subscribes to the room's live events only
+        hub.join(connection, room_id)
+        hub.send(connection, {"type": "joined", "room_id": room_id})
+    elif frame_type == "leave":
+        hub.leave(connection, room_id)
+        hub.send(connection, {"type": "left", "room_id": room_id})
+    else:
+        hub.send(connection, {"type": "error", "detail": f"Unknown frame type {frame_type}"})
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket, token: str = Query(...)):
+    """
+    Real-time chat connection of the current user
+    """
+    try:
+        user_id = decode_user_id(token)
+    except AppException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    set_sticky_key(user_id)
+
+    await websocket.accept()
+    connection = hub.connect(user_id, websocket)
+    try:
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+            except (ValueError, KeyError):
+                hub.send(connection, {"type": "error", "detail": "Frames must be JSON objects"})
+                continue
+            if not isinstance(frame, dict):
+                hub.send(connection, {"type": "error", "detail": "Frames must be JSON objects"})
+                continue
+            handle_frame(connection, frame)
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the server closed the socket, e.g. for a slow consumer
+        pass
+    finally:
+        await hub.disconnect(connection)
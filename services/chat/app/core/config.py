@@ -9,6 +9,32 @@ class Settings(BaseSettings):
     # Database
     DATABASE_URL: str = "sqlite+aiosqlite:///./test.db"
     
+    # Database pool and connection tuning
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_JIT: bool = False
+    DB_SQLITE_SYNCHRONOUS: str = "NORMAL"
+    DB_ECHO: bool = False
+    
+    # Read replicas (comma-separated); empty means all reads go to DATABASE_URL
+    DATABASE_READ_URLS: List[str] = []
+    
+    @validator("DATABASE_READ_URLS", pre=True)
+    def assemble_read_urls(cls, v: str | List[str]) -> List[str]:
+        if isinstance(v, str) and not v.startswith("["):
+            return [i.strip() for i in v.split(",") if i.strip()]
+        elif isinstance(v, (list, str)):
+            return v
+        raise ValueError(v)
+    
+    DB_READ_STICKY_SECONDS: float = 2.0
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    DB_REPLICA_LAG_CHECK_INTERVAL: float = 5.0
+    
     # Redis
     REDIS_URL: str = "redis://localhost:6379/1"
     
@@ -32,6 +58,28 @@ class Settings(BaseSettings):
     
     # WebSocket
     WS_MESSAGE_QUEUE_SIZE: int = 128
+    # What to do when a connection's queue is full: "drop_oldest" or "disconnect"
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"
+    # Broadcasts to larger rooms are queued in chunks of this many connections
+    WS_BROADCAST_CHUNK_SIZE: int = 1000
+    
+    # Room event fan-out across chat nodes ("nats", "redis", or "memory" for a single node)
+    CHAT_FANOUT_BACKEND: str = "memory"
+    CHAT_FANOUT_SUBJECT_PREFIX: str = "chat.room"
+    # Defaults to hostname:pid
+    CHAT_NODE_ID: str = ""
+    
+    # Node component of message ids, 0-1023 and distinct per process; required
+    # outside development, where it is derived from hostname:pid when unset
+    MESSAGE_ID_NODE: Optional[int] = None
+    
+    # Group commit of sent messages: a batch is written after this many
+    # messages or seconds, whichever comes first. Senders wait up to the
+    # enqueue timeout while MAX_PENDING messages are unwritten, then get a 503.
+    CHAT_WRITE_BATCH_SIZE: int = 500
+    CHAT_WRITE_FLUSH_INTERVAL: float = 0.005
+    CHAT_WRITE_MAX_PENDING: int = 10000
+    CHAT_WRITE_ENQUEUE_TIMEOUT: float = 1.0
     
     class Config:
         env_file = ".env"
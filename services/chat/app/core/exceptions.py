@@ -52,6 +52,12 @@ class WebSocketError(AppException):
     detail = "WebSocket error"
 
 
+class MessageBackpressureError(AppException):
+    """Exception raised when too many messages are waiting to be stored"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    detail = "Too many messages are waiting to be stored, try again shortly"
+
+
 def setup_exception_handlers(app: FastAPI):
     """Set up exception handlers for the application"""
     
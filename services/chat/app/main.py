@@ -1,8 +1,13 @@
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.api import messages_router, websocket_router
 from app.core.config import settings
+from app.core.database import create_db_and_tables, engine, get_pool_metrics, replica_router
 from app.core.exceptions import setup_exception_handlers
+from app.services.cluster import cluster
+from app.services.hub import hub
+from app.services.message_writer import message_writer
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -26,7 +31,26 @@ setup_exception_handlers(app)
 
 # Include routers
 # app.include_router(rooms_router, prefix="/api/rooms", tags=["rooms"])
-# app.include_router(messages_router, prefix="/api/messages", tags=["messages"])
+app.include_router(messages_router, prefix="/api/messages", tags=["messages"])
+app.include_router(websocket_router, prefix="/api", tags=["websocket"])
+
+@app.on_event("startup")
+async def startup():
+    """Create tables, start monitoring read replicas and join the chat cluster"""
+    await create_db_and_tables()
+    await replica_router.start()
+    await cluster.start()
+    await message_writer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await message_writer.stop()
+    await cluster.stop()
+    await hub.stop()
+    await replica_router.stop()
+    await engine.dispose()
+
 
 @app.get("/api/health", tags=["health"])
 async def health_check():
@@ -35,6 +59,20 @@ async def health_check():
     """
     return {"status": "ok", "service": "chat"}
 
+@app.get("/api/health/db", tags=["health"])
+async def database_health():
+    """
+    Database connection pool usage, checkout wait and message write batching metrics
+    """
+    return {"service": "chat", "pool": get_pool_metrics(), "message_writes": message_writer.snapshot()}
+
+@app.get("/api/health/websocket", tags=["health"])
+async def websocket_health():
+    """
+    Live WebSocket connections, send queue and cross-node fan-out metrics
+    """
+    return {"service": "chat", "hub": hub.snapshot(), "cluster": cluster.snapshot()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
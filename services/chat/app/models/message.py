@@ -0,0 +1,57 @@
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import BigInteger, Column, PrimaryKeyConstraint
+from sqlmodel import Field, SQLModel
+
+
+# Room ids become pub/sub subject tokens (see app.services.cluster), so only
+# characters that are literal in NATS and Redis subjects are allowed
+ROOM_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+_room_id = re.compile(ROOM_ID_PATTERN)
+
+
+def is_valid_room_id(room_id: str) -> bool:
+    return bool(_room_id.match(room_id))
+
+
+class MessageBase(SQLModel):
+    """Base model for a chat message"""
+    content: str = Field(min_length=1, max_length=4000)
+
+
+class Message(MessageBase, table=True):
+    """A chat message, keyed by room and time-ordered id"""
+    __tablename__ = "messages"
+    # Keeps each room's messages together in id order, so history pages are
+    # index range scans
+    __table_args__ = (PrimaryKeyConstraint("room_id", "id", name="pk_messages"),)
+
+    room_id: str = Field(primary_key=True)
+    # See app.services.message_ids; assigned by the service, never by the database
+    id: int = Field(sa_column=Column(BigInteger, primary_key=True, autoincrement=False))
+    sender_id: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class MessageCreate(MessageBase):
+    """Schema for sending a message"""
+    pass
+
+
+class MessageRead(MessageBase):
+    """Schema for reading a message; ids are strings since they exceed JavaScript's safe integers"""
+    id: str
+    room_id: str
+    sender_id: str
+    created_at: datetime
+
+
+class MessagePage(SQLModel):
+    """Schema for a page of room history, oldest first"""
+    items: List[MessageRead]
+    # Pass as before= for the older page, or after= for the newer one; None
+    # when there is nothing further in that direction
+    before: Optional[str] = None
+    after: Optional[str] = None
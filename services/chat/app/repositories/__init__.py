@@ -0,0 +1,3 @@
+"""
+Repositories package initialization.
+"""
@@ -0,0 +1,65 @@
+from typing import List, Optional, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import col
+
+from app.core.database import read_only
+from app.models.message import Message
+
+
+class MessageRepository:
+    """Repository for chat message database operations"""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def create_many(self, messages: List[Message]) -> None:
+        """Insert messages in one multi-row INSERT and commit"""
+        if not messages:
+            return
+        await self.session.execute(
+            insert(Message.__table__).values(
+                [
+                    {
+                        "room_id": message.room_id,
+                        "id": message.id,
+                        "sender_id": message.sender_id,
+                        "content": message.content,
+                        "created_at": message.created_at,
+                    }
+                    for message in messages
+                ]
+            )
+        )
+        await self.session.commit()
+
+    @read_only
+    async def get_history(
+        self,
+        room_id: str,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        limit: int = 50,
+    ) -> Tuple[List[Message], bool]:
+        """
+        Up to limit messages of a room, oldest first, and whether more exist past them
+
+        With after, returns the messages just after it; otherwise the ones
+        just before before, or the latest. Both cursors seek on the primary
+        key, so a page costs the same at any depth.
+        """
+        query = select(Message).where(Message.room_id == room_id)
+        if before is not None:
+            query = query.where(col(Message.id) < before)
+        if after is not None:
+            query = query.where(col(Message.id) > after)
+        ascending = after is not None
+        query = query.order_by(col(Message.id).asc() if ascending else col(Message.id).desc()).limit(limit + 1)
+        result = await self.session.execute(query)
+        messages = list(result.scalars().all())
+        more = len(messages) > limit
+        messages = messages[:limit]
+        if not ascending:
+            messages.reverse()
+        return messages, more
@@ -0,0 +1,356 @@
+"""
+Fan-out of room events across chat nodes.
+
+Every node subscribes to the pub/sub subject of each room that at least one
+of its local connections has joined, and unsubscribes once the last one
+leaves, so a node only receives traffic for rooms it serves. Subscriptions
+are reference-counted per room and applied in order by a single task.
+
+An event is encoded once by the node that publishes it, delivered to that
+node's own connections straight away and published once to the room's
+subject. Receiving nodes queue the frame they got as is, without decoding
+the JSON; a node ignores its own events coming back from the broker.
+
+Each published frame carries its origin node and send time, from which
+receiving nodes report their delivery lag (this relies on node clocks being
+in sync). The backend is chosen by CHAT_FANOUT_BACKEND: "nats", "redis" or
+"memory" (one process, for tests and single-node development).
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from app.core.config import settings
+from app.models.message import is_valid_room_id
+from app.services.hub import ConnectionHub, encode_event, hub
+
+
+logger = logging.getLogger(__name__)
+
+FrameHandler = Callable[[bytes], Awaitable[None]]
+
+
+def default_node_id() -> str:
+    """Identify a chat node uniquely across hosts and processes"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class MemoryBroker:
+    """In-process broker shared by the memory transports of one process"""
+
+    def __init__(self):
+        self.handlers: Dict[str, Set[FrameHandler]] = {}
+
+    async def publish(self, subject: str, data: bytes) -> None:
+        for handler in tuple(self.handlers.get(subject, ())):
+            await handler(data)
+
+
+memory_broker = MemoryBroker()
+
+
+class MemoryTransport:
+    """Pub/sub within one process"""
+
+    def __init__(self, broker: Optional[MemoryBroker] = None):
+        self.broker = broker or memory_broker
+        self._handlers: Dict[str, FrameHandler] = {}
+
+    async def connect(self) -> None:
+        pass
+
+    async def publish(self, subject: str, data: bytes) -> None:
+        await self.broker.publish(subject, data)
+
+    async def subscribe(self, subject: str, handler: FrameHandler) -> None:
+        self._handlers[subject] = handler
+        self.broker.handlers.setdefault(subject, set()).add(handler)
+
+    async def unsubscribe(self, subject: str) -> None:
+        handler = self._handlers.pop(subject, None)
+        handlers = self.broker.handlers.get(subject)
+        if handler is not None and handlers is not None:
+            handlers.discard(handler)
+            if not handlers:
+                del self.broker.handlers[subject]
+
+    async def close(self) -> None:
+        for subject in list(self._handlers):
+            await self.unsubscribe(subject)
+
+
+class NatsTransport:
+    """Core NATS pub/sub (no persistence; missed events are read back from history)"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._nc = None
+        self._subscriptions: Dict[str, Any] = {}
+
+    async def connect(self) -> None:
+        if self._nc is None:
+            import nats
+
+            self._nc = await nats.connect(self.url)
+
+    async def publish(self, subject: str, data: bytes) -> None:
+        await self._nc.publish(subject, data)
+
+    async def subscribe(self, subject: str, handler: FrameHandler) -> None:
+        async def on_message(msg):
+            await handler(msg.data)
+
+        self._subscriptions[subject] = await self._nc.subscribe(subject, cb=on_message)
+
+    async def unsubscribe(self, subject: str) -> None:
+        subscription = self._subscriptions.pop(subject, None)
+        if subscription is not None:
+            await subscription.unsubscribe()
+
+    async def close(self) -> None:
+        if self._nc is not None:
+            await self._nc.drain()
+            self._nc = None
+            self._subscriptions = {}
+
+
+class RedisTransport:
+    """Redis pub/sub"""
+
+    def __init__(self, redis_url: str):
+        self.redis_url = redis_url
+        self._client = None
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._handlers: Dict[str, FrameHandler] = {}
+
+    async def connect(self) -> None:
+        if self._client is None:
+            from redis import asyncio as aioredis
+
+            self._client = aioredis.from_url(self.redis_url)
+            self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+
+    async def publish(self, subject: str, data: bytes) -> None:
+        await self._client.publish(subject, data)
+
+    async def subscribe(self, subject: str, handler: FrameHandler) -> None:
+        self._handlers[subject] = handler
+        await self._pubsub.subscribe(subject)
+        # listen() returns once nothing is subscribed, so restart it as needed
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read())
+
+    async def unsubscribe(self, subject: str) -> None:
+        if self._handlers.pop(subject, None) is not None:
+            await self._pubsub.unsubscribe(subject)
+
+    async def _read(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                async for raw in self._pubsub.listen():
+                    delay = 1.0
+                    handler = self._handlers.get(raw["channel"].decode())
+                    if handler is None:
+                        continue
+                    try:
+                        await handler(raw["data"])
+                    except Exception as e:
+                        logger.error(f"Failed to dispatch room event: {str(e)}")
+                # Nothing is subscribed any more
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Lost Redis pub/sub connection, reconnecting in {delay:.0f}s: {str(e)}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+            try:
+                await self._resubscribe()
+            except Exception as e:
+                logger.error(f"Failed to resubscribe to Redis: {str(e)}")
+
+    async def _resubscribe(self) -> None:
+        """Replace the pub/sub connection and subscribe it to every current room"""
+        old, self._pubsub = self._pubsub, self._client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await old.close()
+        except Exception:
+            pass
+        if self._handlers:
+            await self._pubsub.subscribe(*self._handlers)
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        self._handlers = {}
+
+
+class ClusterFanout:
+    """Publishes room events to every node serving the room"""
+
+    def __init__(self, hub: ConnectionHub, transport, node_id: str, prefix: str = "chat.room"):
+        self.hub = hub
+        self.transport = transport
+        self.node_id = node_id
+        self._origin = node_id.encode()
+        self.prefix = prefix
+        # room id -> local connections in the room
+        self.refs: Dict[str, int] = {}
+        self.subscribed: Set[str] = set()
+        self._changes: "asyncio.Queue[str]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {
+            "published": 0,
+            "publish_errors": 0,
+            "received": 0,
+            "echoes": 0,
+            "subscribes": 0,
+            "unsubscribes": 0,
+        }
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._lag_last = 0.0
+
+    def subject(self, room_id: str) -> str:
+        # A wildcard or separator would subscribe to, or publish into, other rooms
+        if not is_valid_room_id(room_id):
+            raise ValueError(f"Invalid room id {room_id!r}")
+        return f"{self.prefix}.{room_id}"
+
+    def acquire(self, room_id: str) -> None:
+        """A local connection joined the room"""
+        self.refs[room_id] = self.refs.get(room_id, 0) + 1
+        if self.refs[room_id] == 1:
+            self._changes.put_nowait(room_id)
+
+    def release(self, room_id: str) -> None:
+        """A local connection left the room"""
+        count = self.refs.get(room_id, 0) - 1
+        if count > 0:
+            self.refs[room_id] = count
+        else:
+            self.refs.pop(room_id, None)
+            self._changes.put_nowait(room_id)
+
+    async def _apply_changes(self) -> None:
+        while True:
+            room_id = await self._changes.get()
+            wanted = room_id in self.refs
+            if wanted == (room_id in self.subscribed):
+                continue
+            try:
+                subject = self.subject(room_id)
+            except ValueError as e:
+                # Retrying would never succeed
+                logger.error(f"Not subscribing to room: {str(e)}")
+                continue
+            try:
+                if wanted:
+                    await self.transport.subscribe(subject, functools.partial(self._receive, room_id))
+                    self.subscribed.add(room_id)
+                    self.stats["subscribes"] += 1
+                else:
+                    await self.transport.unsubscribe(subject)
+                    self.subscribed.discard(room_id)
+                    self.stats["unsubscribes"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Transport errors are transient; the retry is dropped once
+                # the room is no longer wanted, or already in the wanted state
+                logger.error(f"Failed to update subscription of room {room_id}: {str(e)}")
+                await asyncio.sleep(1)
+                self._changes.put_nowait(room_id)
+
+    async def publish(self, room_id: str, event: Dict[str, Any]) -> int:
+        """Send an event to the room's connections on every node; returns the local members reached"""
+        frame = encode_event(event)
+        self.hub.stats["encodes"] += 1
+        local = self.hub.broadcast_frame(room_id, frame)
+        envelope = b"|".join((self._origin, b"%.6f" % time.time(), frame.encode()))
+        try:
+            await self.transport.publish(self.subject(room_id), envelope)
+            self.stats["published"] += 1
+        except Exception as e:
+            # Members on other nodes catch up from history
+            self.stats["publish_errors"] += 1
+            logger.error(f"Failed to publish event to room {room_id}: {str(e)}")
+        return local
+
+    async def _receive(self, room_id: str, data: bytes) -> None:
+        origin, sent_at, frame = data.split(b"|", 2)
+        if origin == self._origin:
+            self.stats["echoes"] += 1
+            return
+        lag = max(0.0, time.time() - float(sent_at))
+        self.stats["received"] += 1
+        self._lag_total += lag
+        self._lag_last = lag
+        self._lag_max = max(self._lag_max, lag)
+        self.hub.broadcast_frame(room_id, frame.decode())
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        await self.transport.connect()
+        self.hub.cluster = self
+        for room_id, members in self.hub.rooms.items():
+            self.refs[room_id] = len(members)
+            self._changes.put_nowait(room_id)
+        self._task = asyncio.create_task(self._apply_changes())
+
+    async def stop(self) -> None:
+        self.hub.cluster = None
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.transport.close()
+        self.refs = {}
+        self.subscribed = set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        received = self.stats["received"]
+        return {
+            "node_id": self.node_id,
+            "rooms": len(self.refs),
+            "subscriptions": len(self.subscribed),
+            "pending_subscription_changes": self._changes.qsize(),
+            **self.stats,
+            "lag_ms_avg": self._lag_total / received * 1000 if received else 0.0,
+            "lag_ms_max": self._lag_max * 1000,
+            "lag_ms_last": self._lag_last * 1000,
+        }
+
+
+def create_cluster_fanout() -> ClusterFanout:
+    """Build the cluster fan-out for the configured CHAT_FANOUT_BACKEND"""
+    if settings.CHAT_FANOUT_BACKEND == "nats":
+        transport = NatsTransport(settings.NATS_URL)
+    elif settings.CHAT_FANOUT_BACKEND == "redis":
+        transport = RedisTransport(settings.REDIS_URL)
+    else:
+        transport = MemoryTransport()
+    return ClusterFanout(
+        hub,
+        transport,
+        settings.CHAT_NODE_ID or default_node_id(),
+        prefix=settings.CHAT_FANOUT_SUBJECT_PREFIX,
+    )
+
+
+cluster = create_cluster_fanout()
@@ -0,0 +1,302 @@
+"""
+WebSocket connection hub.
+
+Every accepted chat WebSocket registers with the hub under its user id. A
+connection owns a bounded send queue of WS_MESSAGE_QUEUE_SIZE frames and a
+writer task that drains it, so a slow client never blocks whoever is
+sending to it. When the queue is full, WS_SLOW_CONSUMER_POLICY decides:
+"drop_oldest" discards the oldest queued frame, "disconnect" closes the
+socket and the client reconnects and catches up from history.
+
+Connections subscribe to rooms, and the hub indexes room -> connections.
+An event is encoded to JSON once per broadcast and the same immutable
+string is queued on every member connection, so fan-out costs one encode
+plus a queue append per member. Broadcasts to rooms larger than
+WS_BROADCAST_CHUNK_SIZE are handed to the room's drain task, which queues
+them one chunk at a time and yields in between, so a huge room does not
+stall the event loop. While a room has broadcasts waiting, every new one
+goes behind them, so each connection sees a room's events in order.
+
+Idle connections are kept small: per-connection state lives in __slots__
+and the queue and room set are only allocated when used.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional, Sequence, Set, Tuple
+
+from fastapi import WebSocket, status
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+_connection_ids = itertools.count(1)
+
+
+def encode_event(event: Dict[str, Any]) -> str:
+    """Encode an event into the text frame sent to clients"""
+    return json.dumps(event, separators=(",", ":"), default=str)
+
+
+class ChatConnection:
+    """One live WebSocket, its rooms, send queue and writer task"""
+
+    __slots__ = ("id", "user_id", "websocket", "rooms", "queue", "writer", "close_code", "dropped", "_wakeup")
+
+    def __init__(self, user_id: str, websocket: WebSocket):
+        self.id = next(_connection_ids)
+        self.user_id = user_id
+        self.websocket = websocket
+        self.rooms: Optional[Set[str]] = None
+        # Encoded frames, allocated when one is queued and released once drained
+        self.queue: Optional[Deque[str]] = None
+        self.writer: Optional[asyncio.Task] = None
+        # Set when the connection is being closed by the server
+        self.close_code: Optional[int] = None
+        self.dropped = 0
+        self._wakeup: Optional[asyncio.Future] = None
+
+    def offer(self, frame: str, max_queue: int, policy: str) -> bool:
+        """Queue an encoded frame without blocking; returns False if it was not queued"""
+        if self.close_code is not None:
+            return False
+        if self.queue is None:
+            self.queue = deque()
+        elif len(self.queue) >= max_queue:
+            if policy == DISCONNECT:
+                self.close(status.WS_1013_TRY_AGAIN_LATER)
+                return False
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(frame)
+        self._wake()
+        return True
+
+    def close(self, code: int = status.WS_1000_NORMAL_CLOSURE) -> None:
+        """Discard queued frames and have the writer close the socket"""
+        if self.close_code is not None:
+            return
+        self.close_code = code
+        self.queue = None
+        if self.writer is not None and self._wakeup is None:
+            # The writer is stuck sending to a client that stopped reading
+            self.writer.cancel()
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    async def write(self) -> None:
+        """Writer task: send queued frames in order until the connection closes"""
+        loop = asyncio.get_running_loop()
+        try:
+            while self.close_code is None:
+                while self.queue:
+                    await self.websocket.send_text(self.queue.popleft())
+                self.queue = None
+                if self.close_code is not None:
+                    break
+                self._wakeup = loop.create_future()
+                try:
+                    await self._wakeup
+                finally:
+                    self._wakeup = None
+        except asyncio.CancelledError:
+            if self.close_code is None:
+                raise
+        except Exception:
+            # The client went away; the endpoint notices on its next receive
+            return
+        try:
+            await self.websocket.close(code=self.close_code)
+        except Exception:
+            pass
+
+
+class ConnectionHub:
+    """Live chat connections of this process, indexed by user and by room"""
+
+    def __init__(self, max_queue: int, policy: str = DROP_OLDEST, chunk_size: int = 1000):
+        if policy not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f"Unknown slow consumer policy {policy}")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.chunk_size = chunk_size
+        self.connections: Dict[int, ChatConnection] = {}
+        self._by_user: Dict[str, Set[ChatConnection]] = {}
+        # room id -> members in join order (values unused)
+        self.rooms: Dict[str, Dict[ChatConnection, None]] = {}
+        # Told about joins and leaves so it can follow the rooms across nodes
+        self.cluster = None
+        # room id -> broadcasts waiting for the room's drain task, and the task
+        self._backlog: Dict[str, Deque[Tuple[Tuple[ChatConnection, ...], str]]] = {}
+        self._draining: Dict[str, asyncio.Task] = {}
+        self.stats: Dict[str, int] = {
+            "connects": 0,
+            "sent": 0,
+            "dropped": 0,
+            "slow_disconnects": 0,
+            "broadcasts": 0,
+            "encodes": 0,
+        }
+
+    def connect(self, user_id: str, websocket: WebSocket) -> ChatConnection:
+        """Register an accepted WebSocket and start its writer"""
+        connection = ChatConnection(user_id, websocket)
+        connection.writer = asyncio.create_task(connection.write())
+        self.connections[connection.id] = connection
+        self._by_user.setdefault(user_id, set()).add(connection)
+        self.stats["connects"] += 1
+        return connection
+
+    async def disconnect(self, connection: ChatConnection) -> None:
+        """Unregister a connection and stop its writer"""
+        if self.connections.pop(connection.id, None) is None:
+            return
+        user_connections = self._by_user.get(connection.user_id)
+        if user_connections is not None:
+            user_connections.discard(connection)
+            if not user_connections:
+                del self._by_user[connection.user_id]
+        for room_id in tuple(connection.rooms or ()):
+            self.leave(connection, room_id)
+        self.stats["dropped"] += connection.dropped
+        if connection.writer is not None and not connection.writer.done():
+            connection.writer.cancel()
+            await asyncio.gather(connection.writer, return_exceptions=True)
+
+    def join(self, connection: ChatConnection, room_id: str) -> None:
+        """Subscribe a connection to a room's events"""
+        if connection.rooms is None:
+            connection.rooms = set()
+        members = self.rooms.setdefault(room_id, {})
+        if connection in members:
+            return
+        connection.rooms.add(room_id)
+        members[connection] = None
+        if self.cluster is not None:
+            self.cluster.acquire(room_id)
+
+    def leave(self, connection: ChatConnection, room_id: str) -> None:
+        if connection.rooms is not None:
+            connection.rooms.discard(room_id)
+            if not connection.rooms:
+                connection.rooms = None
+        members = self.rooms.get(room_id)
+        if members is None or connection not in members:
+            return
+        del members[connection]
+        if not members:
+            del self.rooms[room_id]
+        if self.cluster is not None:
+            self.cluster.release(room_id)
+
+    def send(self, connection: ChatConnection, event: Dict[str, Any]) -> bool:
+        """Queue an event for one connection under the slow consumer policy"""
+        self.stats["encodes"] += 1
+        return self._offer(connection, encode_event(event))
+
+    def _offer(self, connection: ChatConnection, frame: str) -> bool:
+        was_open = connection.close_code is None
+        queued = connection.offer(frame, self.max_queue, self.policy)
+        if queued:
+            self.stats["sent"] += 1
+        elif was_open and connection.close_code is not None:
+            self.stats["slow_disconnects"] += 1
+            logger.info(f"Disconnecting slow chat connection {connection.id} of user {connection.user_id}")
+        return queued
+
+    def _offer_all(self, connections: Sequence[ChatConnection], frame: str) -> None:
+        for connection in connections:
+            self._offer(connection, frame)
+
+    async def _drain_room(self, room_id: str) -> None:
+        backlog = self._backlog[room_id]
+        try:
+            while backlog:
+                members, frame = backlog.popleft()
+                for start in range(0, len(members), self.chunk_size):
+                    self._offer_all(members[start:start + self.chunk_size], frame)
+                    await asyncio.sleep(0)
+        finally:
+            del self._backlog[room_id]
+            del self._draining[room_id]
+
+    def send_to_users(self, user_ids: Iterable[str], event: Dict[str, Any]) -> int:
+        """Queue an event for every connection of the given users; returns how many took it"""
+        frame = None
+        queued = 0
+        for user_id in user_ids:
+            for connection in tuple(self._by_user.get(user_id, ())):
+                if frame is None:
+                    frame = encode_event(event)
+                    self.stats["encodes"] += 1
+                queued += self._offer(connection, frame)
+        return queued
+
+    def broadcast(self, room_id: str, event: Dict[str, Any]) -> int:
+        """Queue an event for every connection in a room; returns the number of members"""
+        if room_id not in self.rooms:
+            return 0
+        self.stats["encodes"] += 1
+        return self.broadcast_frame(room_id, encode_event(event))
+
+    def broadcast_frame(self, room_id: str, frame: str) -> int:
+        """Queue an already encoded frame for every connection in a room"""
+        members = self.rooms.get(room_id)
+        if not members:
+            return 0
+        self.stats["broadcasts"] += 1
+        count = len(members)
+        if room_id not in self._draining and count <= self.chunk_size:
+            self._offer_all(tuple(members), frame)
+            return count
+        # Behind any broadcasts the room is still working through
+        self._backlog.setdefault(room_id, deque()).append((tuple(members), frame))
+        if room_id not in self._draining:
+            self._draining[room_id] = asyncio.create_task(self._drain_room(room_id))
+        return count
+
+    async def drain(self) -> None:
+        """Wait until every broadcast has been queued on its members"""
+        while self._draining:
+            await asyncio.gather(*self._draining.values(), return_exceptions=True)
+
+    def is_online(self, user_id: str) -> bool:
+        return user_id in self._by_user
+
+    async def stop(self) -> None:
+        """Close every connection, e.g. on shutdown"""
+        await self.drain()
+        connections = list(self.connections.values())
+        for connection in connections:
+            connection.close(status.WS_1001_GOING_AWAY)
+        await asyncio.gather(
+            *(connection.writer for connection in connections if connection.writer is not None),
+            return_exceptions=True,
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self.connections),
+            "users": len(self._by_user),
+            "rooms": len(self.rooms),
+            "queued": sum(len(c.queue) for c in self.connections.values() if c.queue),
+            **self.stats,
+        }
+
+
+hub = ConnectionHub(
+    settings.WS_MESSAGE_QUEUE_SIZE,
+    settings.WS_SLOW_CONSUMER_POLICY,
+    chunk_size=settings.WS_BROADCAST_CHUNK_SIZE,
+)
@@ -0,0 +1,53 @@
+import json
+from typing import Any, Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.message import Message, MessageCreate, MessagePage, MessageRead
+from app.repositories.message_repository import MessageRepository
+from app.services.cluster import cluster
+from app.services.message_writer import message_writer
+
+
+def message_event(message: Message) -> Dict[str, Any]:
+    """Room event for a new message"""
+    return {
+        "type": "message",
+        "room_id": message.room_id,
+        "message": json.loads(MessageRead.from_orm(message).json()),
+    }
+
+
+class MessageService:
+    """Service for sending chat messages and reading room history"""
+
+    def __init__(self, session: AsyncSession):
+        self.repository = MessageRepository(session)
+
+    async def send_message(self, room_id: str, sender_id: str, data: MessageCreate) -> Message:
+        """Store a message, then push it to the room's live connections on every node"""
+        message = Message(room_id=room_id, sender_id=sender_id, content=data.content)
+        # Resumes once the batch holding the message has committed, with its
+        # id and created_at assigned in commit order
+        await message_writer.write(message)
+        await cluster.publish(room_id, message_event(message))
+        return message
+
+    async def get_history(
+        self,
+        room_id: str,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        limit: int = 50,
+    ) -> MessagePage:
+        """A page of room history with the cursors of the pages around it"""
+        messages, more = await self.repository.get_history(room_id, before=before, after=after, limit=limit)
+        page = MessagePage(items=[MessageRead.from_orm(message) for message in messages])
+        if messages:
+            # Paging forward from after: older messages exist, newer ones if more
+            # Paging back (or the latest page): older ones if more, newer ones if before was given
+            older = more if after is None else True
+            newer = more if after is not None else before is not None
+            page.before = str(messages[0].id) if older else None
+            page.after = str(messages[-1].id) if newer else None
+        return page
@@ -0,0 +1,206 @@
+"""
+Group commit of chat messages.
+
+Sending a message does not commit it on its own. Messages are buffered and
+written in one multi-row INSERT and one commit per batch, once
+CHAT_WRITE_BATCH_SIZE messages are waiting or the oldest has waited
+CHAT_WRITE_FLUSH_INTERVAL, whichever comes first. One batch is written at a
+time and the next one fills meanwhile, so under load batches grow and
+commits per message fall. Each sender is resumed only once the batch
+holding its message has committed. If the batch fails, its messages are
+retried one at a time, so only the senders of messages that cannot be
+stored get an error.
+
+Message ids are assigned just before a batch is inserted rather than when
+a message is sent. Batches commit one after another, so a process commits
+its messages in id order and a reader paging with after= never sees a
+lower id commit behind one it has already read.
+
+At most CHAT_WRITE_MAX_PENDING messages may be buffered or being written;
+further senders wait for room up to CHAT_WRITE_ENQUEUE_TIMEOUT and are then
+refused. Stopping the writer refuses new messages and flushes the rest.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import get_db_context
+from app.core.exceptions import MessageBackpressureError
+from app.models.message import Message
+from app.repositories.message_repository import MessageRepository
+from app.services.message_ids import message_id_datetime, message_ids
+
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """Batches message inserts so many messages share one commit"""
+
+    def __init__(
+        self,
+        max_batch: int = 500,
+        max_delay: float = 0.005,
+        max_pending: int = 10000,
+        enqueue_timeout: float = 1.0,
+    ):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        # (message, sender's future, arrival time)
+        self._buffer: List[Tuple[Message, asyncio.Future, float]] = []
+        # When the oldest buffered message arrived
+        self._oldest = 0.0
+        # Buffered plus being written
+        self.pending = 0
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+        self._room = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "messages": 0,
+            "batches": 0,
+            "failed": 0,
+            "batch_retries": 0,
+            "rejected": 0,
+            "batch_max": 0,
+            "flush_ms_max": 0.0,
+        }
+        self._flush_total = 0.0
+
+    async def write(self, message: Message) -> None:
+        """Buffer a message and return once it has been committed"""
+        if self._closing or self._task is None:
+            raise MessageBackpressureError("Messages are not being accepted right now")
+        if self.pending >= self.max_pending:
+            deadline = time.monotonic() + self.enqueue_timeout
+            while self.pending >= self.max_pending:
+                self._room.clear()
+                try:
+                    await asyncio.wait_for(self._room.wait(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    self.stats["rejected"] += 1
+                    raise MessageBackpressureError()
+
+        future = asyncio.get_running_loop().create_future()
+        arrived = time.monotonic()
+        if not self._buffer:
+            self._oldest = arrived
+        self._buffer.append((message, future, arrived))
+        self.pending += 1
+        if len(self._buffer) >= self.max_batch:
+            self._full.set()
+        self._ready.set()
+        await future
+
+    async def _run(self) -> None:
+        while True:
+            await self._ready.wait()
+            wait = self._oldest + self.max_delay - time.monotonic()
+            if len(self._buffer) < self.max_batch and wait > 0 and not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._buffer[:self.max_batch]
+            self._buffer = self._buffer[self.max_batch:]
+            if self._buffer:
+                self._oldest = self._buffer[0][2]
+            if len(self._buffer) < self.max_batch:
+                self._full.clear()
+            if not self._buffer:
+                self._ready.clear()
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[Message, asyncio.Future, float]]) -> None:
+        started = time.perf_counter()
+        for message, _, _ in batch:
+            message.id = message_ids.next_id()
+            message.created_at = message_id_datetime(message.id)
+        try:
+            try:
+                await self._insert([message for message, _, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    self._settle(batch, e)
+                    return
+                # One bad message must not fail everyone else's
+                logger.error(f"Failed to store {len(batch)} messages, retrying one at a time: {str(e)}")
+                self.stats["batch_retries"] += 1
+                for entry in batch:
+                    try:
+                        await self._insert([entry[0]])
+                    except Exception as row_error:
+                        self._settle([entry], row_error)
+                    else:
+                        self._settle([entry])
+            else:
+                self._settle(batch)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stats["batches"] += 1
+            self.stats["batch_max"] = max(self.stats["batch_max"], len(batch))
+            self.stats["flush_ms_max"] = max(self.stats["flush_ms_max"], elapsed)
+            self._flush_total += elapsed
+            self.pending -= len(batch)
+            self._room.set()
+
+    @staticmethod
+    async def _insert(messages: List[Message]) -> None:
+        async with get_db_context() as session:
+            await MessageRepository(session).create_many(messages)
+
+    def _settle(
+        self, entries: List[Tuple[Message, asyncio.Future, float]], error: Optional[Exception] = None
+    ) -> None:
+        """Resume the senders of stored messages, or fail them with the error"""
+        if error is None:
+            self.stats["messages"] += len(entries)
+        else:
+            logger.error(f"Failed to store {len(entries)} messages: {str(error)}")
+            self.stats["failed"] += len(entries)
+        for _, future, _ in entries:
+            if not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Refuse new messages and write out the buffered ones"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._full.set()
+        while self.pending:
+            await asyncio.sleep(self.max_delay)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            "pending": self.pending,
+            **self.stats,
+            "batch_avg": (self.stats["messages"] + self.stats["failed"]) / batches if batches else 0.0,
+            "flush_ms_avg": self._flush_total / batches if batches else 0.0,
+        }
+
+
+message_writer = MessageWriteBuffer(
+    max_batch=settings.CHAT_WRITE_BATCH_SIZE,
+    max_delay=settings.CHAT_WRITE_FLUSH_INTERVAL,
+    max_pending=settings.CHAT_WRITE_MAX_PENDING,
+    enqueue_timeout=settings.CHAT_WRITE_ENQUEUE_TIMEOUT,
+)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Room broadcast fan-out benchmark.
+
+Connects --members in-memory sockets to one room, broadcasts --messages
+events and times how long it takes until every frame has been written,
+once with the hub's encode-once broadcast and once encoding per member
+(the naive fan-out) for comparison.
+
+    cd services/chat
+    python benchmarks/bench_fanout.py --members 10000 --messages 200
+
+No database or network is needed; sockets only count the bytes written.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.hub import ConnectionHub, encode_event  # noqa: E402
+
+
+class CountingSocket:
+    """Stands in for a WebSocket and counts what is written to it"""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    async def send_text(self, data: str) -> None:
+        self.frames += 1
+        self.bytes += len(data.encode())
+
+    async def close(self, code: int) -> None:
+        pass
+
+
+def event(index: int, size: int) -> dict:
+    return {
+        "type": "message",
+        "room_id": "bench-room",
+        "message": {"id": str(index), "sender_id": "user-0", "content": "x" * size},
+    }
+
+
+async def run(members: int, messages: int, size: int, naive: bool) -> None:
+    hub = ConnectionHub(max_queue=messages + 1, chunk_size=1000)
+    sockets = [CountingSocket() for _ in range(members)]
+    connections = [hub.connect(f"user-{i}", socket) for i, socket in enumerate(sockets)]
+    for connection in connections:
+        hub.join(connection, "bench-room")
+    await asyncio.sleep(0)
+
+    began = time.perf_counter()
+    for index in range(messages):
+        if naive:
+            for connection in connections:
+                hub.send(connection, event(index, size))
+        else:
+            hub.broadcast("bench-room", event(index, size))
+        # Let writers and fan-out chunks run, as they would between requests
+        await asyncio.sleep(0)
+    await hub.drain()
+    while any(socket.frames < messages for socket in sockets):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - began
+
+    frames = sum(socket.frames for socket in sockets)
+    sent = sum(socket.bytes for socket in sockets)
+    label = "per-member encode" if naive else "encode once"
+    print(
+        f"{label:>17}: {frames} frames, {sent / 1e6:.0f}MB in {elapsed:.2f}s, "
+        f"{frames / elapsed:,.0f} frames/s, {sent / elapsed / 1e6:.0f}MB/s, "
+        f"{hub.stats['encodes']} encodes"
+    )
+    await hub.stop()
+    for connection in connections:
+        await hub.disconnect(connection)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=10_000)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--size", type=int, default=200, help="message content length")
+    args = parser.parse_args()
+
+    print(f"{args.members} members, {args.messages} messages of {len(encode_event(event(0, args.size)))} bytes")
+    await run(args.members, args.messages, args.size, naive=False)
+    await run(args.members, args.messages, args.size, naive=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,4 @@
+from app.api.notifications import router as notifications_router
+from app.api.preferences import router as preferences_router
+
+__all__ = ["notifications_router", "preferences_router"]
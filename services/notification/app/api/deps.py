@@ -0,0 +1,36 @@
+from typing import Optional
+
+from fastapi import Query, Request
+from jose import JWTError, jwt
+
+from app.core.config import settings
+from app.core.database import set_sticky_key
+from app.core.exceptions import AuthenticationError
+
+
+def decode_user_id(token: str) -> str:
+    """Validate an access token issued by the auth service and return its subject"""
+    try:
+        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
+        raise AuthenticationError("Could not validate credentials")
+    if payload.get("type") != "access" or not payload.get("sub"):
+        raise AuthenticationError("Could not validate credentials")
+    return payload["sub"]
+
+
+async def get_current_user_id(request: Request, token: Optional[str] = Query(None)) -> str:
+    """
+    Authenticate a request from its bearer token
+
+    The token may also be passed as a query parameter, since browsers cannot
+    set headers on EventSource or WebSocket connections.
+    """
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise AuthenticationError("Not authenticated")
+    user_id = decode_user_id(token)
+    set_sticky_key(user_id)
+    return user_id
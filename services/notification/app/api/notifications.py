@@ -0,0 +1,248 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Header, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+
+from app.api.deps import decode_user_id, get_current_user_id
+from app.core.config import settings
+from app.core.database import get_db_context, set_sticky_key, use_primary
+from app.core.exceptions import AppException
+from app.models.notification import NotificationPage, UnreadCount
+from app.services.notification_service import NotificationService
+from app.services.push import (
+    SYNC,
+    UNREAD,
+    PushConnection,
+    decode_event_id,
+    encode_event_id,
+    notification_event,
+    push_hub,
+)
+
+router = APIRouter()
+
+
+def not_modified(etag: str) -> Response:
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+    )
+
+
+def set_etag(response: Response, etag: Optional[str]) -> None:
+    if etag is not None:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+
+
+@router.get("", response_model=NotificationPage)
+async def read_notifications(
+    response: Response,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=100),
+    include_read: bool = Query(True),
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_current_user_id),
+):
+    """
+    A page of the current user's notifications, newest first
+
+    Answers 304 without a database read while the feed version in the ETag
+    has not changed.
+    """
+    # Read the version before the feed so a change in between is never hidden
+    etag = push_hub.versions.etag(user_id)
+    if etag is not None and if_none_match == etag:
+        return not_modified(etag)
+    async with get_db_context() as session:
+        if etag is not None:
+            # A lagging replica would tie a page from before a change to the
+            # ETag after it, and every later poll would get 304 on it
+            use_primary(session)
+        items, next_cursor = await NotificationService(session).get_notification_page(
+            user_id, limit=limit, include_read=include_read, before=cursor
+        )
+    set_etag(response, etag)
+    return NotificationPage(items=items, next_cursor=next_cursor)
+
+
+@router.get("/unread-count", response_model=UnreadCount)
+async def read_unread_count(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_current_user_id),
+):
+    """
+    The current user's unread count, with the same ETag as the feed
+    """
+    etag = push_hub.versions.etag(user_id)
+    if etag is not None and if_none_match == etag:
+        return not_modified(etag)
+    async with get_db_context() as session:
+        unread_count = await NotificationService(session).count_unread_notifications(user_id)
+    set_etag(response, etag)
+    return UnreadCount(unread_count=unread_count)
+
+
+@router.get("/poll", response_model=UnreadCount)
+async def poll_notifications(
+    response: Response,
+    timeout: float = Query(25.0, ge=0),
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_current_user_id),
+):
+    """
+    Long-poll for a change to the current user's notifications
+
+    Waits while the ETag in If-None-Match is current, then answers with the
+    new ETag and unread count, or 304 if nothing changed within the timeout.
+    """
+    if if_none_match and not await push_hub.versions.wait(
+        user_id, if_none_match, min(timeout, settings.NOTIFICATION_POLL_TIMEOUT_MAX)
+    ):
+        return not_modified(if_none_match)
+    return await read_unread_count(response, None, user_id)
+
+
+async def unread_event(user_id: str) -> Dict[str, Any]:
+    async with get_db_context() as session:
+        unread_count = await NotificationService(session).count_unread_notifications(user_id)
+    return {"event": "unread_count", "data": {"unread_count": unread_count}}
+
+
+async def stream_events(
+    connection: PushConnection, resume_from: Optional[Tuple[datetime, int]] = None
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Events for one push connection
+
+    Replays changes after resume_from, sends the current unread count, then
+    relays live events with heartbeats in between. Markers are resolved here
+    against the database. Ends when the connection's queue overflows.
+    """
+    user_id = connection.user_id
+    limit = settings.NOTIFICATION_PUSH_REPLAY_LIMIT
+    # Without a resume point, "sync" replays changes made after connecting
+    position = resume_from or (datetime.utcnow(), 0)
+
+    async def replay():
+        nonlocal position
+        async with get_db_context() as session:
+            changes = await NotificationService(session).get_changes_since(
+                user_id, position, limit=limit + 1
+            )
+        if not changes:
+            return []
+        position = (changes[-1].updated_at, changes[-1].id)
+        if len(changes) > limit:
+            # Too far behind to replay; the client should reload its feed
+            return [{"event": "reset", "id": encode_event_id(*position)}]
+        return [notification_event(n) for n in changes]
+
+    if resume_from is not None:
+        for event in await replay():
+            yield event
+    yield await unread_event(user_id)
+
+    while True:
+        event = await connection.next_event(settings.NOTIFICATION_PUSH_HEARTBEAT_SECONDS)
+        if event is None:
+            yield {"event": "heartbeat"}
+        elif event is PushConnection.OVERFLOW:
+            yield event
+            return
+        elif event["event"] == UNREAD:
+            yield await unread_event(user_id)
+        elif event["event"] == SYNC:
+            for replayed in await replay():
+                yield replayed
+        else:
+            if event.get("id"):
+                position = max(position, decode_event_id(event["id"]))
+            yield event
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    if event["event"] == "heartbeat":
+        return ": heartbeat\n\n"
+    lines = []
+    if event.get("id"):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['event']}")
+    lines.append(f"data: {json.dumps(event.get('data'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+@router.get("/stream")
+async def stream_notifications(
+    request: Request,
+    last_event_id: Optional[str] = Query(None),
+    user_id: str = Depends(get_current_user_id),
+):
+    """
+    Server-Sent Events stream of the current user's notification changes
+    """
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    resume_from = decode_event_id(last_event_id) if last_event_id else None
+    connection = push_hub.connect(user_id)
+
+    async def frames():
+        try:
+            yield f"retry: {settings.NOTIFICATION_PUSH_RETRY_MS}\n\n"
+            async for event in stream_events(connection, resume_from):
+                yield format_sse(event)
+        finally:
+            push_hub.disconnect(connection)
+
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def notifications_websocket(
+    websocket: WebSocket,
+    token: str = Query(...),
+    last_event_id: Optional[str] = Query(None),
+):
+    """
+    WebSocket stream of the current user's notification changes
+    """
+    try:
+        user_id = decode_user_id(token)
+        resume_from = decode_event_id(last_event_id) if last_event_id else None
+    except AppException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    set_sticky_key(user_id)
+
+    await websocket.accept()
+    connection = push_hub.connect(user_id)
+
+    async def send_events():
+        async for event in stream_events(connection, resume_from):
+            await websocket.send_text(json.dumps(event))
+        # The client fell behind; it reconnects and resumes from its last event id
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+
+    async def watch_disconnect():
+        # Clients only listen, but reading is what surfaces their disconnect
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(watch_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        push_hub.disconnect(connection)
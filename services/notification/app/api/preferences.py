@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.deps import get_current_user_id
+from app.core.database import get_db
+from app.models.preference import NotificationPreferences
+from app.services.preferences import PreferenceService
+
+router = APIRouter()
+
+
+@router.get("", response_model=NotificationPreferences)
+async def read_preferences(
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Get the current user's notification preferences
+    """
+    return await PreferenceService(db).get_preferences(user_id)
+
+
+@router.put("", response_model=NotificationPreferences)
+async def update_preferences(
+    preferences: NotificationPreferences,
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Replace the current user's notification preferences
+    """
+    return await PreferenceService(db).update_preferences(user_id, preferences)
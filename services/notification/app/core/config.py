@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseSettings, validator, AnyHttpUrl, EmailStr
 
 
@@ -9,6 +9,32 @@ class Settings(BaseSettings):
     # Database
     DATABASE_URL: str = "sqlite+aiosqlite:///./test.db"
     
+    # Database pool and connection tuning
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_JIT: bool = False
+    DB_SQLITE_SYNCHRONOUS: str = "NORMAL"
+    DB_ECHO: bool = False
+    
+    # Read replicas (comma-separated); empty means all reads go to DATABASE_URL
+    DATABASE_READ_URLS: List[str] = []
+    
+    @validator("DATABASE_READ_URLS", pre=True)
+    def assemble_read_urls(cls, v: str | List[str]) -> List[str]:
+        if isinstance(v, str) and not v.startswith("["):
+            return [i.strip() for i in v.split(",") if i.strip()]
+        elif isinstance(v, (list, str)):
+            return v
+        raise ValueError(v)
+    
+    DB_READ_STICKY_SECONDS: float = 2.0
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    DB_REPLICA_LAG_CHECK_INTERVAL: float = 5.0
+    
     # Redis
     REDIS_URL: str = "redis://localhost:6379/2"
     
@@ -39,6 +65,109 @@ class Settings(BaseSettings):
     SMTP_SSL: bool = False
     EMAIL_FROM: str = "noreply@example.com"
     EMAIL_FROM_NAME: str = "Advanced Chat"
+    SMTP_TIMEOUT: float = 10.0
+    EMAIL_CHANNEL_ENABLED: bool = True
+    EMAIL_POOL_SIZE: int = 4
+    EMAIL_MAX_CONCURRENCY: int = 16
+    EMAIL_MAX_MESSAGES_PER_CONNECTION: int = 1000
+    
+    # Rows per batched INSERT for bulk creation and fan-out
+    NOTIFICATION_INSERT_CHUNK_SIZE: int = 1000
+    
+    # Coalescing: notifications of these types for the same recipient and
+    # reference merge into one row within the window (0 disables)
+    NOTIFICATION_COALESCE_WINDOW_SECONDS: float = 300.0
+    NOTIFICATION_COALESCE_TYPES: List[str] = ["chat"]
+    
+    # Email digests: these types are emailed in one periodic digest per
+    # recipient instead of one email each (0 disables)
+    EMAIL_DIGEST_INTERVAL: float = 0.0
+    EMAIL_DIGEST_TYPES: List[str] = ["chat", "mention"]
+    EMAIL_DIGEST_BATCH_SIZE: int = 1000
+    EMAIL_DIGEST_LOOKBACK_SECONDS: float = 86400.0
+    
+    # Unread counters ("none", "local" or "redis" cache in front of the counters table)
+    NOTIFICATION_COUNTER_CACHE: str = "none"
+    NOTIFICATION_COUNTER_CACHE_TTL: int = 3600
+    NOTIFICATION_COUNTER_RECONCILE_INTERVAL: float = 3600.0
+    
+    # Event bus ("memory" or "nats" for JetStream) and ingestion consumers
+    EVENT_BUS_BACKEND: str = "memory"
+    EVENT_STREAM: str = "EVENTS"
+    EVENT_SUBJECTS: List[str] = ["chat.>", "auth.>"]
+    EVENT_CONSUMER_DURABLE: str = "notification-ingest"
+    EVENT_INGEST_ENABLED: bool = True
+    EVENT_BATCH_SIZE: int = 500
+    EVENT_FETCH_TIMEOUT: float = 1.0
+    EVENT_ACK_WAIT: float = 30.0
+    EVENT_MAX_DELIVER: int = 5
+    EVENT_MAX_ACK_PENDING: int = 5000
+    EVENT_RETRY_DELAY: float = 2.0
+    
+    # Real-time push ("local" or "redis" to reach clients on every instance)
+    NOTIFICATION_PUSH_BACKEND: str = "local"
+    NOTIFICATION_PUSH_CHANNEL: str = "notification:push"
+    NOTIFICATION_PUSH_QUEUE_SIZE: int = 100
+    NOTIFICATION_PUSH_HEARTBEAT_SECONDS: float = 15.0
+    NOTIFICATION_PUSH_REPLAY_LIMIT: int = 100
+    NOTIFICATION_PUSH_RETRY_MS: int = 3000
+    # Feed versions kept per process for ETags, and the longest a long-poll
+    # may wait for a change
+    NOTIFICATION_FEED_VERSIONS_SIZE: int = 100_000
+    NOTIFICATION_POLL_TIMEOUT_MAX: float = 30.0
+    
+    # Retention: days to keep read, delivered and failed rows, keyed by
+    # "type:status", "type", "*:status" or "*" (most specific wins; 0 keeps forever)
+    NOTIFICATION_RETENTION_DAYS: Dict[str, float] = {"*": 90, "chat": 30, "*:failed": 14}
+    NOTIFICATION_RETENTION_ARCHIVE: bool = False
+    NOTIFICATION_RETENTION_INTERVAL: float = 3600.0
+    NOTIFICATION_RETENTION_BATCH_SIZE: int = 1000
+    NOTIFICATION_RETENTION_BATCH_PAUSE: float = 0.1
+    
+    # Postgres only: range-partition notifications by month so expired
+    # months can be dropped (or detached when archiving) in one statement.
+    # Applies when the table is created. Future partitions are created every
+    # NOTIFICATION_PARTITION_INTERVAL seconds, even with retention disabled.
+    NOTIFICATION_PARTITIONING: bool = False
+    NOTIFICATION_PARTITION_MONTHS_AHEAD: int = 3
+    NOTIFICATION_PARTITION_INTERVAL: float = 3600.0
+    
+    # Notification preferences are compiled per user and cached in process;
+    # saving preferences invalidates the entry on every instance through the
+    # push pub/sub backend. Types in NOTIFICATION_QUIET_HOURS_BYPASS_TYPES are
+    # sent during quiet hours.
+    NOTIFICATION_PREFERENCE_CACHE_TTL: float = 60.0
+    NOTIFICATION_PREFERENCE_CACHE_SIZE: int = 100_000
+    NOTIFICATION_PREFERENCE_CHANNEL: str = "notification:preferences"
+    NOTIFICATION_QUIET_HOURS_BYPASS_TYPES: List[str] = ["alert"]
+    
+    # Delivery lanes. Each lane claims pending rows of its types and delivers
+    # them on concurrency slots; a recipient always maps to the same slot so
+    # their notifications go out in order. weight scales a lane's claim batch
+    # relative to DELIVERY_BATCH_SIZE. Types in no lane go to the lightest one.
+    DELIVERY_ENABLED: bool = True
+    DELIVERY_LANES: Dict[str, Dict[str, Any]] = {
+        "urgent": {"types": ["alert", "mention"], "weight": 4, "concurrency": 20, "poll_interval": 0.1},
+        "standard": {"types": ["chat", "friend_request"], "weight": 2, "concurrency": 20, "poll_interval": 0.5},
+        "bulk": {"types": ["system"], "weight": 1, "concurrency": 10, "poll_interval": 1.0},
+    }
+    # Recipients are split into DELIVERY_SHARD_COUNT shards; a process only
+    # claims its DELIVERY_SHARDS (all of them when empty)
+    DELIVERY_SHARD_COUNT: int = 1
+    DELIVERY_SHARDS: List[int] = []
+    DELIVERY_BATCH_SIZE: int = 100
+    # Failed deliveries are retried with exponential backoff and jitter
+    # (base * 2^(attempt-1), capped) and dead-lettered as FAILED once
+    # DELIVERY_MAX_ATTEMPTS attempts have failed. Lanes also scan for due
+    # retries every DELIVERY_RETRY_SCAN_INTERVAL, to pick up those scheduled
+    # by other processes.
+    DELIVERY_MAX_ATTEMPTS: int = 5
+    DELIVERY_RETRY_BASE_SECONDS: float = 30.0
+    DELIVERY_RETRY_MAX_SECONDS: float = 3600.0
+    DELIVERY_RETRY_SCAN_INTERVAL: float = 30.0
+    DELIVERY_LEASE_SECONDS: float = 60.0
+    DELIVERY_POLL_INTERVAL: float = 1.0
+    DELIVERY_CONCURRENCY: int = 50
     
     class Config:
         env_file = ".env"
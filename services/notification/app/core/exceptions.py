@@ -52,6 +52,11 @@ class NotificationDeliveryError(AppException):
     detail = "Failed to deliver notification"
 
 
+class UndeliverableError(NotificationDeliveryError):
+    """Exception raised when a notification can never be delivered, so it is not retried"""
+    detail = "Notification cannot be delivered"
+
+
 def setup_exception_handlers(app: FastAPI):
     """Set up exception handlers for the application"""
     
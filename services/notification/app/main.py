@@ -1,8 +1,45 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.api import notifications_router, preferences_router
 from app.core.config import settings
+from app.core.database import get_pool_metrics, lifespan
 from app.core.exceptions import setup_exception_handlers
+from app.services.delivery_worker import delivery_scheduler
+from app.services.email_channel import close_email_channel, get_email_channel
+from app.services.email_digest import email_digests
+from app.services.event_ingest import event_ingestor
+from app.services.preferences import preference_cache
+from app.services.push import push_hub
+from app.services.retention import retention_job
+from app.services.unread_counters import counter_reconciler
+
+
+@asynccontextmanager
+async def app_lifespan(app):
+    """Set up the database, then run the background workers for the app's lifetime"""
+    async with lifespan(app):
+        await retention_job.start()
+        await push_hub.start()
+        await preference_cache.start(push_hub.pubsub)
+        if settings.DELIVERY_ENABLED:
+            await delivery_scheduler.start()
+        await counter_reconciler.start()
+        await email_digests.start()
+        if settings.EVENT_INGEST_ENABLED:
+            await event_ingestor.start()
+        yield
+        await event_ingestor.stop()
+        await email_digests.stop()
+        await counter_reconciler.stop()
+        await delivery_scheduler.stop()
+        await close_email_channel()
+        await preference_cache.stop()
+        await push_hub.stop()
+        await retention_job.stop()
+
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -10,6 +47,7 @@ app = FastAPI(
     version="0.1.0",
     docs_url="/api/docs" if settings.ENVIRONMENT != "production" else None,
     redoc_url="/api/redoc" if settings.ENVIRONMENT != "production" else None,
+    lifespan=app_lifespan,
 )
 
 # Set up CORS
@@ -25,8 +63,8 @@ app.add_middleware(
 setup_exception_handlers(app)
 
 # Include routers
-# app.include_router(notifications_router, prefix="/api/notifications", tags=["notifications"])
-# app.include_router(preferences_router, prefix="/api/preferences", tags=["preferences"])
+app.include_router(notifications_router, prefix="/api/notifications", tags=["notifications"])
+app.include_router(preferences_router, prefix="/api/preferences", tags=["preferences"])
 
 @app.get("/api/health", tags=["health"])
 async def health_check():
@@ -35,6 +73,29 @@ async def health_check():
     """
     return {"status": "ok", "service": "notification"}
 
+@app.get("/api/health/db", tags=["health"])
+async def database_health():
+    """
+    Database connection pool usage and checkout wait metrics
+    """
+    return {"service": "notification", "pool": get_pool_metrics()}
+
+@app.get("/api/health/delivery", tags=["health"])
+async def delivery_health():
+    """
+    Delivery lane throughput, backlog and latency
+    """
+    return {
+        "service": "notification",
+        "lanes": await delivery_scheduler.stats(),
+        "email": get_email_channel().stats(),
+        "digests": email_digests.stats,
+        "push": push_hub.stats(),
+        "preferences": preference_cache.snapshot(),
+        "ingest": event_ingestor.stats,
+        "retention": retention_job.stats,
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
@@ -0,0 +1,38 @@
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+
+class ChatMessageCreated(BaseModel):
+    """chat.message.created: a message was posted to a chat"""
+    chat_id: str
+    message_id: str
+    sender_id: str
+    sender_name: Optional[str] = None
+    recipient_ids: List[str]
+    preview: str = Field(max_length=1000)
+    chat_name: Optional[str] = None
+
+
+class ChatMessageMentioned(BaseModel):
+    """chat.message.mentioned: users were mentioned in a message"""
+    chat_id: str
+    message_id: str
+    sender_id: str
+    sender_name: Optional[str] = None
+    recipient_ids: List[str]
+    preview: str = Field(max_length=1000)
+
+
+class FriendRequestCreated(BaseModel):
+    """auth.friend_request.created: a user sent a friend request"""
+    request_id: str
+    sender_id: str
+    sender_name: Optional[str] = None
+    recipient_id: str
+
+
+class UserRegistered(BaseModel):
+    """auth.user.registered: a new account was created"""
+    user_id: str
+    email: Optional[str] = None
+    full_name: Optional[str] = None
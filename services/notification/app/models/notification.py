@@ -1,8 +1,42 @@
+import zlib
 from datetime import datetime
 from enum import Enum
 from typing import Optional, List
 from sqlmodel import Field, SQLModel, Relationship
-from sqlalchemy import JSON
+from sqlalchemy import JSON, Column, DateTime, Index, Table, text
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects.postgresql import JSONB
+
+from app.core.config import settings
+
+
+# Range-partition notifications by month of created_at (Postgres only)
+PARTITIONED = settings.NOTIFICATION_PARTITIONING and settings.DATABASE_URL.startswith("postgresql")
+
+
+def recipient_hash(recipient_id: str) -> int:
+    """Stable hash of a recipient id, used to shard delivery by recipient"""
+    return zlib.crc32(recipient_id.encode()) & 0x7FFFFFFF
+
+
+def notification_idempotency_key(
+    notification_type: str, reference_type: Optional[str], reference_id: Optional[str]
+) -> Optional[str]:
+    """Default idempotency key: one notification per type and referenced entity"""
+    if reference_id is None:
+        return None
+    return f"{notification_type}:{reference_type or ''}:{reference_id}"
+
+
+class JSONDocument(TypeDecorator):
+    """JSON column stored as JSONB on Postgres, so it is parsed once and can be indexed"""
+    impl = JSON
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(JSON())
 
 
 class NotificationType(str, Enum):
@@ -27,24 +61,111 @@ class NotificationBase(SQLModel):
     type: NotificationType = Field(default=NotificationType.SYSTEM)
     title: str = Field(max_length=255)
     content: str
-    recipient_id: str = Field(index=True)
+    recipient_id: str
     sender_id: Optional[str] = Field(default=None, index=True)
     reference_id: Optional[str] = Field(default=None, description="ID of the related entity (chat, friend request, etc.)")
     reference_type: Optional[str] = Field(default=None, description="Type of the related entity")
     status: NotificationStatus = Field(default=NotificationStatus.PENDING)
     is_read: bool = Field(default=False)
-    metadata: Optional[dict] = Field(default=None, sa_column=Field(JSON))
+    # "metadata" is reserved on SQLModel/SQLAlchemy models, so the attribute is named meta
+    meta: Optional[dict] = Field(
+        default=None, sa_column=Column("metadata", JSONDocument())
+    )
+    # A recipient never gets two notifications with the same key; see
+    # notification_idempotency_key for the default derived from the reference
+    idempotency_key: Optional[str] = Field(default=None, max_length=255)
 
 
 class Notification(NotificationBase, table=True):
     """Notification model for database"""
     __tablename__ = "notifications"
+    __table_args__ = (
+        # Delivery workers scan pending rows in creation order
+        Index("ix_notifications_status_created_at", "status", "created_at"),
+        # Delivery lanes claim fresh pending rows of their types in creation order
+        Index(
+            "ix_notifications_pending_lane",
+            "type",
+            "created_at",
+            postgresql_where=text("status = 'pending' AND next_attempt_at IS NULL"),
+            sqlite_where=text("status = 'pending' AND next_attempt_at IS NULL"),
+        ),
+        # ... and retries once they fall due
+        Index(
+            "ix_notifications_retry_due",
+            "next_attempt_at",
+            postgresql_where=text("status = 'pending' AND next_attempt_at IS NOT NULL"),
+            sqlite_where=text("status = 'pending' AND next_attempt_at IS NOT NULL"),
+        ),
+        # Recipient feeds, newest first, paged by (created_at, id)
+        Index("ix_notifications_recipient_feed", "recipient_id", "created_at", "id"),
+        # Producers look notifications up by what they refer to
+        Index("ix_notifications_reference", "reference_type", "reference_id"),
+        # A partitioned table can only enforce uniqueness together with
+        # created_at, which would not dedupe anything; upserts then
+        # serialize on an advisory lock instead
+        Index(
+            "uq_notifications_idempotency",
+            "recipient_id",
+            "idempotency_key",
+            unique=not PARTITIONED,
+            postgresql_where=text("idempotency_key IS NOT NULL"),
+            sqlite_where=text("idempotency_key IS NOT NULL"),
+        ),
+        Index(
+            "ix_notifications_recipient_unread",
+            "recipient_id",
+            "created_at",
+            "id",
+            postgresql_where=text("is_read = false"),
+            sqlite_where=text("is_read = 0"),
+        ),
+        {"postgresql_partition_by": "RANGE (created_at)"} if PARTITIONED else {},
+    )
     
-    id: Optional[int] = Field(default=None, primary_key=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # A partitioned table's primary key must include the partition key
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
+    created_at: datetime = Field(default_factory=datetime.utcnow, primary_key=PARTITIONED)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     delivered_at: Optional[datetime] = Field(default=None)
     read_at: Optional[datetime] = Field(default=None)
+    
+    # Delivery lease, set while a worker holds the row
+    locked_by: Optional[str] = Field(default=None)
+    locked_until: Optional[datetime] = Field(default=None)
+    last_error: Optional[str] = Field(default=None)
+    # Delivery attempts so far, and when a failed row is retried. After
+    # DELIVERY_MAX_ATTEMPTS a row is dead-lettered as FAILED.
+    attempts: int = Field(default=0)
+    next_attempt_at: Optional[datetime] = Field(default=None)
+    # recipient_hash(recipient_id); delivery shards are ranges of it modulo DELIVERY_SHARD_COUNT
+    recipient_hash: int = Field(default=0)
+    
+    # Number of notifications merged into this row by coalescing
+    coalesced_count: int = Field(default=1)
+    # Set once the row has gone out in an email digest
+    digest_sent_at: Optional[datetime] = Field(default=None)
+
+
+# Rows moved out of notifications by retention when archiving is enabled
+notifications_archive = Table(
+    "notifications_archive",
+    SQLModel.metadata,
+    *[
+        Column(column.name, column.type, primary_key=column.name == "id", autoincrement=False)
+        for column in Notification.__table__.columns
+    ],
+    Column("archived_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+class NotificationCounter(SQLModel, table=True):
+    """Per-recipient unread counter kept in step with the notifications table"""
+    __tablename__ = "notification_counters"
+    
+    recipient_id: str = Field(primary_key=True)
+    unread_count: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
 class NotificationCreate(NotificationBase):
@@ -59,6 +180,18 @@ class NotificationRead(NotificationBase):
     updated_at: datetime
     delivered_at: Optional[datetime] = None
     read_at: Optional[datetime] = None
+    coalesced_count: int = 1
+
+
+class NotificationPage(SQLModel):
+    """Schema for a page of a recipient's feed"""
+    items: List[NotificationRead]
+    next_cursor: Optional[str] = None
+
+
+class UnreadCount(SQLModel):
+    """Schema for a recipient's unread count"""
+    unread_count: int
 
 
 class NotificationUpdate(SQLModel):
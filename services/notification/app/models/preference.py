@@ -0,0 +1,100 @@
+from datetime import datetime, time, timezone
+from enum import Enum
+from typing import List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from pydantic import validator
+from sqlmodel import Field, SQLModel
+from sqlalchemy import UniqueConstraint
+
+from app.models.notification import NotificationType
+
+
+# Matches every notification type or channel in a preference rule
+ANY = "*"
+
+
+class NotificationChannel(str, Enum):
+    """Enum for the channels a notification is sent over"""
+    EMAIL = "email"
+    # Real-time notification events on WebSocket and SSE connections
+    PUSH = "push"
+
+
+class NotificationPreference(SQLModel, table=True):
+    """A user's choice to receive or not a notification type on a channel"""
+    __tablename__ = "notification_preferences"
+    __table_args__ = (
+        UniqueConstraint("user_id", "type", "channel", name="uq_notification_preferences_rule"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: str = Field(index=True)
+    # A NotificationType or NotificationChannel value, or ANY
+    type: str = Field(default=ANY)
+    channel: str = Field(default=ANY)
+    enabled: bool = Field(default=True)
+
+
+class UserNotificationSettings(SQLModel, table=True):
+    """Per-user mute and quiet hours"""
+    __tablename__ = "user_notification_settings"
+
+    user_id: str = Field(primary_key=True)
+    # Nothing is sent before this time
+    muted_until: Optional[datetime] = Field(default=None)
+    # Daily window in the user's timezone in which nothing is sent; it may
+    # wrap past midnight
+    quiet_hours_start: Optional[time] = Field(default=None)
+    quiet_hours_end: Optional[time] = Field(default=None)
+    timezone: str = Field(default="UTC")
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class PreferenceRule(SQLModel):
+    """Schema for one preference rule; the most specific matching rule wins"""
+    type: str = ANY
+    channel: str = ANY
+    enabled: bool
+
+    @validator("type")
+    def validate_type(cls, v):
+        if v != ANY and v not in {t.value for t in NotificationType}:
+            raise ValueError(f"Unknown notification type {v}")
+        return v
+
+    @validator("channel")
+    def validate_channel(cls, v):
+        if v != ANY and v not in {c.value for c in NotificationChannel}:
+            raise ValueError(f"Unknown notification channel {v}")
+        return v
+
+
+class NotificationPreferences(SQLModel):
+    """Schema for reading and replacing a user's notification preferences"""
+    muted_until: Optional[datetime] = None
+    quiet_hours_start: Optional[time] = None
+    quiet_hours_end: Optional[time] = None
+    timezone: str = "UTC"
+    rules: List[PreferenceRule] = []
+
+    @validator("muted_until")
+    def validate_muted_until(cls, v):
+        # Stored as naive UTC like every other timestamp
+        if v is not None and v.tzinfo is not None:
+            v = v.astimezone(timezone.utc).replace(tzinfo=None)
+        return v
+
+    @validator("timezone")
+    def validate_timezone(cls, v):
+        try:
+            ZoneInfo(v)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone {v}")
+        return v
+
+    @validator("quiet_hours_end", always=True)
+    def validate_quiet_hours(cls, v, values):
+        if (v is None) != (values.get("quiet_hours_start") is None):
+            raise ValueError("Quiet hours need both a start and an end")
+        return v
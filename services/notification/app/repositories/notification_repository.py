@@ -1,11 +1,41 @@
-from datetime import datetime
-from typing import List, Optional, Dict, Any
+import base64
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Tuple
 
-from sqlalchemy import select, update, delete, func
+from sqlalchemy import DateTime, String, bindparam, case, cast, literal, select, text, tuple_, update, delete, func
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import col
 
-from app.models.notification import Notification, NotificationStatus, NotificationType
+from app.core.database import read_only
+from app.core.exceptions import ValidationError
+from app.models.notification import (
+    PARTITIONED,
+    Notification,
+    NotificationCounter,
+    NotificationStatus,
+    NotificationType,
+    notification_idempotency_key,
+    notifications_archive,
+    recipient_hash,
+)
+
+
+def encode_feed_cursor(notification: Notification) -> str:
+    """Opaque cursor pointing just after a notification in a recipient feed"""
+    raw = f"{notification.created_at.isoformat()}|{notification.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_feed_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a feed cursor into its (created_at, id) position"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, notification_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(notification_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError("Invalid pagination cursor")
 
 
 class NotificationRepository:
@@ -14,14 +44,430 @@ class NotificationRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
     
+    @property
+    def _postgres(self) -> bool:
+        return self.session.bind.dialect.name == "postgresql"
+    
+    def _insert(self, table):
+        """Dialect-specific INSERT supporting ON CONFLICT clauses"""
+        if self._postgres:
+            return postgresql.insert(table)
+        return sqlite.insert(table)
+    
+    async def _adjust_unread(self, recipient_id: str, delta: int) -> None:
+        """Apply a delta to a recipient's unread counter within the current transaction"""
+        table = NotificationCounter.__table__
+        adjusted = table.c.unread_count + delta
+        statement = self._insert(table).values(
+            recipient_id=recipient_id,
+            unread_count=max(delta, 0),
+            updated_at=datetime.utcnow(),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.recipient_id],
+            set_={
+                "unread_count": case((adjusted < 0, 0), else_=adjusted),
+                "updated_at": statement.excluded.updated_at,
+            },
+        )
+        await self.session.execute(statement)
+    
+    async def _set_unread(self, recipient_id: str, unread_count: int) -> None:
+        """Overwrite a recipient's unread counter within the current transaction"""
+        table = NotificationCounter.__table__
+        statement = self._insert(table).values(
+            recipient_id=recipient_id,
+            unread_count=unread_count,
+            updated_at=datetime.utcnow(),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.recipient_id],
+            set_={
+                "unread_count": statement.excluded.unread_count,
+                "updated_at": statement.excluded.updated_at,
+            },
+        )
+        await self.session.execute(statement)
+    
+    async def _adjust_unread_many(self, deltas: Dict[str, int]) -> None:
+        """Add positive deltas to many unread counters with one multi-row upsert"""
+        if not deltas:
+            return
+        table = NotificationCounter.__table__
+        now = datetime.utcnow()
+        statement = self._insert(table).values(
+            [
+                {"recipient_id": recipient_id, "unread_count": delta, "updated_at": now}
+                for recipient_id, delta in deltas.items()
+            ]
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.recipient_id],
+            set_={
+                "unread_count": table.c.unread_count + statement.excluded.unread_count,
+                "updated_at": statement.excluded.updated_at,
+            },
+        )
+        await self.session.execute(statement)
+    
     async def create(self, notification_data: Dict[str, Any]) -> Notification:
         """Create a new notification"""
         notification = Notification(**notification_data)
+        notification.recipient_hash = recipient_hash(notification.recipient_id)
         self.session.add(notification)
+        if not notification.is_read:
+            await self._adjust_unread(notification.recipient_id, 1)
         await self.session.commit()
         await self.session.refresh(notification)
         return notification
     
+    def _row_values(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate notification data, apply defaults and key it by column name"""
+        values = Notification(**data).dict(exclude={"id"})
+        values["recipient_hash"] = recipient_hash(values["recipient_id"])
+        column_keys = self._column_keys()
+        return {column_keys[key]: value for key, value in values.items()}
+    
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _column_keys() -> Dict[str, str]:
+        return {attr.key: attr.columns[0].key for attr in Notification.__mapper__.column_attrs}
+    
+    async def _insert_rows(self, rows: List[Dict[str, Any]], chunk_size: int) -> List[int]:
+        """
+        Insert prepared rows with cached executemany INSERTs and return their ids
+        
+        Postgres ids are reserved from the sequence up front. SQLite assigns
+        consecutive rowids while this transaction holds the write lock, so the
+        ids are the last len(rows) up to max(id).
+        """
+        table = Notification.__table__
+        postgres = self._postgres
+        ids: List[int] = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            if postgres:
+                result = await self.session.execute(
+                    text(
+                        "SELECT nextval(pg_get_serial_sequence('notifications', 'id')) "
+                        "FROM generate_series(1, :n)"
+                    ),
+                    {"n": len(chunk)},
+                )
+                chunk_ids = result.scalars().all()
+                chunk = [{**row, "id": row_id} for row, row_id in zip(chunk, chunk_ids)]
+                ids.extend(chunk_ids)
+            await self.session.execute(table.insert(), chunk)
+        
+        if not postgres:
+            last_id = (await self.session.execute(select(func.max(table.c.id)))).scalar_one()
+            ids = list(range(last_id - len(rows) + 1, last_id + 1))
+        return ids
+    
+    async def create_many(
+        self, notifications_data: List[Dict[str, Any]], chunk_size: int = 1000
+    ) -> List[int]:
+        """
+        Insert many notifications in one transaction and return their ids
+        
+        No ORM objects are built or refreshed, and unread counters are
+        bumped once per recipient. Rows whose idempotency key the recipient
+        already has are skipped.
+        """
+        if not notifications_data:
+            return []
+        
+        rows = await self._without_duplicates([self._row_values(data) for data in notifications_data])
+        if not rows:
+            return []
+        unread: Dict[str, int] = {}
+        for row in rows:
+            if not row["is_read"]:
+                unread[row["recipient_id"]] = unread.get(row["recipient_id"], 0) + 1
+        
+        ids = await self._insert_rows(rows, chunk_size)
+        await self._adjust_unread_many(unread)
+        await self.session.commit()
+        return ids
+    
+    async def _without_duplicates(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Drop rows whose (recipient_id, idempotency_key) exists already or repeats in rows"""
+        keyed = list({
+            (row["recipient_id"], row["idempotency_key"])
+            for row in rows if row["idempotency_key"] is not None
+        })
+        if not keyed:
+            return rows
+        existing = set()
+        for start in range(0, len(keyed), 500):
+            result = await self.session.execute(
+                select(Notification.recipient_id, Notification.idempotency_key).where(
+                    tuple_(Notification.recipient_id, Notification.idempotency_key).in_(keyed[start:start + 500])
+                )
+            )
+            existing.update(result.all())
+        unique = []
+        for row in rows:
+            key = (row["recipient_id"], row["idempotency_key"])
+            if row["idempotency_key"] is not None:
+                if key in existing:
+                    continue
+                existing.add(key)
+            unique.append(row)
+        return unique
+    
+    async def upsert(self, notification_data: Dict[str, Any]) -> Tuple[Notification, bool]:
+        """
+        Create a notification, or refresh the recipient's existing one with the same idempotency key
+        
+        The key defaults to one per type and referenced entity. An existing
+        row takes the new title, content, sender and meta but keeps its read
+        and delivery state. Runs as a single INSERT ... ON CONFLICT DO UPDATE
+        (on a partitioned table, under a per-key advisory lock). Returns the
+        row and whether it was created.
+        """
+        values = self._row_values(notification_data)
+        if values["idempotency_key"] is None:
+            values["idempotency_key"] = notification_idempotency_key(
+                NotificationType(values["type"]).value, values["reference_type"], values["reference_id"]
+            )
+        if values["idempotency_key"] is None:
+            raise ValidationError("An upsert needs an idempotency key or a reference_id")
+        
+        table = Notification.__table__
+        key = (Notification.recipient_id == values["recipient_id"]) & (
+            Notification.idempotency_key == values["idempotency_key"]
+        )
+        refreshed = {"title", "content", "sender_id", "metadata"}
+        
+        if self._postgres and PARTITIONED:
+            await self.session.execute(
+                select(func.pg_advisory_xact_lock(
+                    func.hashtext(f"{values['recipient_id']}:{values['idempotency_key']}")
+                ))
+            )
+            existing = (await self.session.execute(select(Notification.id).where(key))).scalar()
+            if existing is None:
+                await self._insert_rows([values], 1)
+            else:
+                await self.session.execute(
+                    table.update()
+                    .where(table.c.id == existing)
+                    .values({name: values[name] for name in refreshed}, updated_at=values["updated_at"])
+                )
+        else:
+            dialect = postgresql if self._postgres else sqlite
+            statement = dialect.insert(table).values(values)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.recipient_id, table.c.idempotency_key],
+                index_where=table.c.idempotency_key.isnot(None),
+                set_={
+                    **{name: statement.excluded[name] for name in refreshed},
+                    "updated_at": statement.excluded.updated_at,
+                },
+            )
+            await self.session.execute(statement)
+        
+        notification = (
+            await self.session.execute(
+                select(Notification).where(key).execution_options(populate_existing=True)
+            )
+        ).scalar_one()
+        # Only a row inserted just now carries this insert's created_at
+        created = notification.created_at == values["created_at"]
+        if created and not notification.is_read:
+            await self._adjust_unread(notification.recipient_id, 1)
+        await self.session.commit()
+        return notification, created
+    
+    @read_only
+    async def get_by_reference(
+        self,
+        recipient_id: str,
+        reference_type: str,
+        reference_id: str,
+        unread_only: bool = True,
+    ) -> List[Notification]:
+        """A recipient's notifications about one entity, newest first"""
+        query = select(Notification).where(
+            (Notification.reference_type == reference_type) &
+            (Notification.reference_id == reference_id) &
+            (Notification.recipient_id == recipient_id)
+        )
+        if unread_only:
+            query = query.where(Notification.is_read == False)
+        result = await self.session.execute(query.order_by(Notification.created_at.desc()))
+        return result.scalars().all()
+    
+    async def fan_out(
+        self, recipient_ids: List[str], template: Dict[str, Any], chunk_size: int = 1000
+    ) -> List[int]:
+        """Insert the same notification for many recipients and return their ids"""
+        # One row per recipient, so each counter goes up by exactly one
+        recipient_ids = list(dict.fromkeys(recipient_ids))
+        if not recipient_ids:
+            return []
+        
+        # Validate the template once rather than once per recipient
+        base = self._row_values({**template, "recipient_id": recipient_ids[0]})
+        rows = await self._without_duplicates([
+            {**base, "recipient_id": recipient_id, "recipient_hash": recipient_hash(recipient_id)}
+            for recipient_id in recipient_ids
+        ])
+        if not rows:
+            return []
+        
+        ids = await self._insert_rows(rows, chunk_size)
+        if not base["is_read"]:
+            await self._adjust_unread_many({row["recipient_id"]: 1 for row in rows})
+        await self.session.commit()
+        return ids
+    
+    @staticmethod
+    def _coalesce_filter(notification_data: Dict[str, Any], since: datetime):
+        """Open rows that a notification with this type and reference can merge into"""
+        return (
+            (Notification.type == notification_data["type"]) &
+            (Notification.reference_id == notification_data["reference_id"]) &
+            (Notification.is_read == False) &
+            (Notification.created_at >= since)
+        )
+    
+    async def coalesce(
+        self, notification_data: Dict[str, Any], since: datetime
+    ) -> Tuple[Notification, bool]:
+        """
+        Merge a notification into the recipient's open row for the same type and reference
+        
+        An unread row created at or after since absorbs the notification: its
+        count goes up and it takes the latest title, content, sender and meta.
+        Otherwise a new row is created. Returns the row and whether it was merged.
+        """
+        query = (
+            select(Notification)
+            .where(
+                (Notification.recipient_id == notification_data["recipient_id"]) &
+                self._coalesce_filter(notification_data, since)
+            )
+            .order_by(Notification.id.desc())
+            .limit(1)
+            .with_for_update()
+        )
+        notification = (await self.session.execute(query)).scalar_one_or_none()
+        if notification is None:
+            return await self.create(notification_data), False
+        
+        latest = Notification(**notification_data)
+        notification.title = latest.title
+        notification.content = latest.content
+        notification.sender_id = latest.sender_id
+        notification.meta = latest.meta
+        notification.coalesced_count += 1
+        notification.digest_sent_at = None
+        notification.updated_at = datetime.utcnow()
+        
+        await self.session.commit()
+        return notification, True
+    
+    async def held_idempotency_keys(
+        self, recipient_ids: List[str], keys: List[str], chunk_size: int = 1000
+    ) -> List[Tuple[str, str]]:
+        """(recipient_id, idempotency_key) of the given recipients' rows holding any of the keys"""
+        held: List[Tuple[str, str]] = []
+        if not keys:
+            return held
+        for start in range(0, len(recipient_ids), chunk_size):
+            result = await self.session.execute(
+                select(Notification.recipient_id, Notification.idempotency_key).where(
+                    col(Notification.recipient_id).in_(recipient_ids[start:start + chunk_size]) &
+                    col(Notification.idempotency_key).in_(keys)
+                )
+            )
+            held.extend(tuple(row) for row in result.all())
+        return held
+    
+    async def coalesce_many(
+        self,
+        recipient_ids: List[str],
+        template: Dict[str, Any],
+        since: datetime,
+        chunk_size: int = 1000,
+        increments: Optional[Dict[str, int]] = None,
+    ) -> Tuple[List[int], List[str]]:
+        """
+        Coalesce the same notification for many recipients in bulk
+        
+        Recipients with an open row get it updated in place, the rest get a
+        new row. increments gives how many notifications each recipient's
+        row absorbs (default 1). A template idempotency key is moved onto
+        merged rows, so it always marks the latest notification absorbed.
+        Returns the notification ids in recipient order and the recipients
+        that got a new row.
+        """
+        increments = increments or {}
+        if not recipient_ids:
+            return [], []
+        
+        table = Notification.__table__
+        base = self._row_values({**template, "recipient_id": recipient_ids[0]})
+        open_rows: Dict[str, int] = {}
+        for start in range(0, len(recipient_ids), chunk_size):
+            result = await self.session.execute(
+                select(Notification.recipient_id, func.max(Notification.id))
+                .where(
+                    col(Notification.recipient_id).in_(recipient_ids[start:start + chunk_size]) &
+                    self._coalesce_filter(template, since)
+                )
+                .group_by(Notification.recipient_id)
+            )
+            open_rows.update(result.all())
+        
+        # One UPDATE per chunk and distinct increment, usually just 1
+        merged_by_increment: Dict[int, List[int]] = {}
+        for recipient_id, notification_id in open_rows.items():
+            merged_by_increment.setdefault(increments.get(recipient_id, 1), []).append(notification_id)
+        merged_values: Dict[str, Any] = {
+            "title": base["title"],
+            "content": base["content"],
+            "sender_id": base["sender_id"],
+            "metadata": base["metadata"],
+            "digest_sent_at": None,
+        }
+        if base["idempotency_key"] is not None:
+            merged_values["idempotency_key"] = base["idempotency_key"]
+        for increment, merged_ids in merged_by_increment.items():
+            for start in range(0, len(merged_ids), chunk_size):
+                await self.session.execute(
+                    table.update()
+                    .where(table.c.id.in_(merged_ids[start:start + chunk_size]))
+                    .values(
+                        **merged_values,
+                        coalesced_count=table.c.coalesced_count + increment,
+                        updated_at=datetime.utcnow(),
+                    )
+                )
+        
+        new_recipients = [r for r in recipient_ids if r not in open_rows]
+        new_ids = await self._insert_rows(
+            [
+                {
+                    **base,
+                    "recipient_id": recipient_id,
+                    "recipient_hash": recipient_hash(recipient_id),
+                    "coalesced_count": increments.get(recipient_id, 1),
+                }
+                for recipient_id in new_recipients
+            ],
+            chunk_size,
+        ) if new_recipients else []
+        if new_recipients and not base["is_read"]:
+            await self._adjust_unread_many({recipient_id: 1 for recipient_id in new_recipients})
+        await self.session.commit()
+        
+        ids = dict(open_rows)
+        ids.update(zip(new_recipients, new_ids))
+        return [ids[recipient_id] for recipient_id in recipient_ids], new_recipients
+    
     async def get_by_id(self, notification_id: int) -> Optional[Notification]:
         """Get a notification by ID"""
         result = await self.session.execute(
@@ -29,71 +475,246 @@ class NotificationRepository:
         )
         return result.scalar_one_or_none()
     
+    @read_only
     async def get_by_recipient(
         self, 
         recipient_id: str, 
         skip: int = 0, 
         limit: int = 100,
-        include_read: bool = False
+        include_read: bool = False,
+        before: Optional[str] = None
     ) -> List[Notification]:
-        """Get notifications for a recipient"""
+        """
+        Get notifications for a recipient, newest first
+        
+        Pass the cursor of the last item seen as before to page by keyset,
+        which stays constant-time however deep the page; skip is kept for
+        existing callers.
+        """
         query = select(Notification).where(Notification.recipient_id == recipient_id)
         
         if not include_read:
             query = query.where(Notification.is_read == False)
+        
+        if before is not None:
+            created_at, notification_id = decode_feed_cursor(before)
+            query = query.where(
+                tuple_(Notification.created_at, Notification.id) < (created_at, notification_id)
+            )
+        elif skip:
+            query = query.offset(skip)
             
-        query = query.order_by(Notification.created_at.desc()).offset(skip).limit(limit)
+        query = query.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit)
         
         result = await self.session.execute(query)
         return result.scalars().all()
     
+    async def get_changed_since(
+        self, recipient_id: str, updated_at: datetime, notification_id: int, limit: int = 100
+    ) -> List[Notification]:
+        """
+        Notifications for a recipient created or updated after a stream position
+        
+        Returned oldest change first. Reads go to the primary so a resumed
+        stream never skips a change a lagging replica has not applied yet.
+        """
+        result = await self.session.execute(
+            select(Notification)
+            .where(
+                (Notification.recipient_id == recipient_id) &
+                (tuple_(Notification.updated_at, Notification.id) > (updated_at, notification_id))
+            )
+            .order_by(Notification.updated_at, Notification.id)
+            .limit(limit)
+        )
+        return result.scalars().all()
+    
+    async def _update_returning(self, where, values: Dict[Any, Any]) -> List[Notification]:
+        """
+        Apply an UPDATE and return the updated rows
+        
+        On Postgres this is a single UPDATE ... RETURNING. SQLAlchemy 1.4 has
+        no RETURNING for SQLite, so there the ids are selected first.
+        """
+        if self._postgres:
+            statement = (
+                update(Notification)
+                .where(where)
+                .values(values)
+                .returning(*Notification.__table__.columns)
+            )
+            result = await self.session.execute(
+                select(Notification)
+                .from_statement(statement)
+                .execution_options(populate_existing=True)
+            )
+            return result.scalars().all()
+        
+        ids = (await self.session.execute(select(Notification.id).where(where))).scalars().all()
+        if not ids:
+            return []
+        await self.session.execute(
+            update(Notification)
+            .where(Notification.id.in_(ids) & where)
+            .values(values)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(
+            select(Notification)
+            .where(Notification.id.in_(ids))
+            .execution_options(populate_existing=True)
+        )
+        return result.scalars().all()
+    
+    async def _delete_returning(self, where) -> List[Tuple[int, str, bool]]:
+        """Apply a DELETE and return (id, recipient_id, is_read) of the deleted rows"""
+        table = Notification.__table__
+        columns = (table.c.id, table.c.recipient_id, table.c.is_read)
+        if self._postgres:
+            result = await self.session.execute(table.delete().where(where).returning(*columns))
+            return [tuple(row) for row in result.all()]
+        
+        rows = [tuple(row) for row in (await self.session.execute(select(*columns).where(where))).all()]
+        if rows:
+            await self.session.execute(table.delete().where(table.c.id.in_([row[0] for row in rows])))
+        return rows
+    
+    async def _decrement_unread_many(self, deltas: Dict[str, int]) -> None:
+        """Subtract from many unread counters, never going below zero"""
+        if not deltas:
+            return
+        table = NotificationCounter.__table__
+        decremented = table.c.unread_count - bindparam("b_delta")
+        await self.session.execute(
+            table.update()
+            .where(table.c.recipient_id == bindparam("b_recipient_id"))
+            .values(
+                unread_count=case((decremented < 0, 0), else_=decremented),
+                updated_at=datetime.utcnow(),
+            ),
+            [
+                {"b_recipient_id": recipient_id, "b_delta": delta}
+                for recipient_id, delta in deltas.items()
+            ],
+        )
+    
+    @staticmethod
+    def _count_by_recipient(recipient_ids) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for recipient_id in recipient_ids:
+            counts[recipient_id] = counts.get(recipient_id, 0) + 1
+        return counts
+    
+    def _error_meta(self, error_message: str):
+        """SQL expression adding an error key to the metadata JSON column"""
+        column = Notification.__table__.c.metadata
+        # Rows created without meta hold JSON null rather than SQL NULL, so
+        # start from an empty object unless the column already holds one
+        if self._postgres:
+            base = case((func.jsonb_typeof(column) == "object", column), else_=text("'{}'::jsonb"))
+            return base.op("||")(
+                # Typed parameters, since jsonb_build_object accepts any type
+                func.jsonb_build_object(cast("error", String), cast(error_message, String))
+            )
+        base = case((func.json_type(column) == "object", column), else_=literal("{}"))
+        return func.json_set(base, "$.error", error_message)
+    
     async def mark_as_read(self, notification_id: int) -> Optional[Notification]:
         """Mark a notification as read"""
-        notification = await self.get_by_id(notification_id)
-        if not notification:
-            return None
-            
-        notification.is_read = True
-        notification.status = NotificationStatus.READ
-        notification.read_at = datetime.utcnow()
-        notification.updated_at = datetime.utcnow()
+        updated = await self.mark_many_as_read([notification_id])
+        if updated:
+            return updated[0]
+        # Already read, or missing
+        return await self.get_by_id(notification_id)
+    
+    async def mark_many_as_read(
+        self, notification_ids: List[int], recipient_id: Optional[str] = None
+    ) -> List[Notification]:
+        """
+        Mark several notifications as read, optionally only those of one recipient
         
+        Returns the notifications that were unread until now; unread counters
+        are decremented for exactly those in the same transaction.
+        """
+        if not notification_ids:
+            return []
+        where = col(Notification.id).in_(notification_ids) & (Notification.is_read == False)
+        if recipient_id is not None:
+            where = where & (Notification.recipient_id == recipient_id)
+        now = datetime.utcnow()
+        updated = await self._update_returning(
+            where,
+            {
+                Notification.is_read: True,
+                Notification.status: NotificationStatus.READ,
+                Notification.read_at: now,
+                Notification.updated_at: now,
+            },
+        )
+        await self._decrement_unread_many(self._count_by_recipient(n.recipient_id for n in updated))
         await self.session.commit()
-        await self.session.refresh(notification)
-        return notification
+        return updated
+    
+    async def transition_many(
+        self,
+        notification_ids: List[int],
+        from_statuses: List[NotificationStatus],
+        to_status: NotificationStatus,
+        error_message: Optional[str] = None,
+    ) -> List[Notification]:
+        """
+        Move notifications between delivery states in one statement
+        
+        Only rows currently in one of from_statuses change; the changed rows
+        are returned. Use mark_many_as_read for READ, which also keeps the
+        unread counters in step.
+        """
+        if not notification_ids:
+            return []
+        now = datetime.utcnow()
+        values: Dict[Any, Any] = {Notification.status: to_status, Notification.updated_at: now}
+        if to_status == NotificationStatus.DELIVERED:
+            values[Notification.delivered_at] = now
+        if to_status == NotificationStatus.PENDING:
+            # A requeued notification starts over with a full set of attempts
+            values[Notification.attempts] = 0
+            values[Notification.next_attempt_at] = None
+        if error_message:
+            values[Notification.last_error] = error_message
+            values[Notification.meta] = self._error_meta(error_message)
+        updated = await self._update_returning(
+            col(Notification.id).in_(notification_ids) & col(Notification.status).in_(from_statuses),
+            values,
+        )
+        await self.session.commit()
+        return updated
     
     async def mark_as_delivered(self, notification_id: int) -> Optional[Notification]:
         """Mark a notification as delivered"""
-        notification = await self.get_by_id(notification_id)
-        if not notification:
-            return None
-            
-        notification.status = NotificationStatus.DELIVERED
-        notification.delivered_at = datetime.utcnow()
-        notification.updated_at = datetime.utcnow()
-        
+        now = datetime.utcnow()
+        updated = await self._update_returning(
+            Notification.id == notification_id,
+            {
+                Notification.status: NotificationStatus.DELIVERED,
+                Notification.delivered_at: now,
+                Notification.updated_at: now,
+            },
+        )
         await self.session.commit()
-        await self.session.refresh(notification)
-        return notification
+        return updated[0] if updated else None
     
     async def mark_as_failed(self, notification_id: int, error_message: str = None) -> Optional[Notification]:
         """Mark a notification as failed"""
-        notification = await self.get_by_id(notification_id)
-        if not notification:
-            return None
-            
-        notification.status = NotificationStatus.FAILED
-        notification.updated_at = datetime.utcnow()
-        
-        if error_message and notification.metadata is None:
-            notification.metadata = {}
-            
-        if error_message and notification.metadata is not None:
-            notification.metadata["error"] = error_message
-        
+        values: Dict[Any, Any] = {
+            Notification.status: NotificationStatus.FAILED,
+            Notification.updated_at: datetime.utcnow(),
+        }
+        if error_message:
+            values[Notification.last_error] = error_message
+            values[Notification.meta] = self._error_meta(error_message)
+        updated = await self._update_returning(Notification.id == notification_id, values)
         await self.session.commit()
-        await self.session.refresh(notification)
-        return notification
+        return updated[0] if updated else None
     
     async def mark_all_as_read(self, recipient_id: str) -> int:
         """Mark all notifications for a recipient as read"""
@@ -112,23 +733,58 @@ class NotificationRepository:
             )
             .execution_options(synchronize_session=False)
         )
+        await self._set_unread(recipient_id, 0)
         await self.session.commit()
         return result.rowcount
     
     async def delete(self, notification_id: int) -> bool:
         """Delete a notification"""
-        notification = await self.get_by_id(notification_id)
-        if not notification:
-            return False
-            
-        await self.session.delete(notification)
+        return bool(await self.delete_many([notification_id]))
+    
+    async def delete_many(
+        self, notification_ids: List[int], recipient_id: Optional[str] = None
+    ) -> List[Tuple[int, str, bool]]:
+        """
+        Delete several notifications, optionally only those of one recipient
+        
+        Returns (id, recipient_id, is_read) for each deleted row.
+        """
+        if not notification_ids:
+            return []
+        table = Notification.__table__
+        where = table.c.id.in_(notification_ids)
+        if recipient_id is not None:
+            where = where & (table.c.recipient_id == recipient_id)
+        deleted = await self._delete_returning(where)
+        await self._decrement_unread_many(
+            self._count_by_recipient(row[1] for row in deleted if not row[2])
+        )
         await self.session.commit()
-        return True
+        return deleted
     
     async def count_unread(self, recipient_id: str) -> int:
-        """Count unread notifications for a recipient"""
+        """
+        Get a recipient's unread count from the counters table
+        
+        Read from the primary: the value fills the counter cache, and a
+        lagging replica would cache a count from before the latest write.
+        """
+        result = await self.session.execute(
+            select(NotificationCounter.unread_count)
+            .where(NotificationCounter.recipient_id == recipient_id)
+        )
+        unread_count = result.scalar_one_or_none()
+        if unread_count is None:
+            # No counter yet; recipients without one have had no notifications
+            # since counters were introduced, so the reconciler seeds them
+            return 0
+        return unread_count
+    
+    async def count_unread_exact(self, recipient_id: str) -> int:
+        """Count unread notifications for a recipient by scanning the notifications table"""
         result = await self.session.execute(
             select(func.count())
+            .select_from(Notification)
             .where(
                 (Notification.recipient_id == recipient_id) & 
                 (Notification.is_read == False)
@@ -136,6 +792,140 @@ class NotificationRepository:
         )
         return result.scalar_one()
     
+    async def reconcile_unread_counters(self) -> List[str]:
+        """
+        Repair drift between the counters table and the notifications table
+        
+        Writers change a counter in the same transaction as its notification
+        rows, so the drifted counters are locked first. That waits out any
+        change in flight, and the recount then runs in a fresh statement,
+        whose snapshot includes it. Recounting in the statement that finds
+        the drift would use a snapshot taken before that wait (READ
+        COMMITTED), and undo a concurrent +1. Returns the recipients whose
+        counter was repaired or created.
+        """
+        counters = NotificationCounter.__table__
+        notifications = Notification.__table__
+        unread_for_recipient = (
+            select(func.count())
+            .select_from(notifications)
+            .where(
+                (notifications.c.recipient_id == counters.c.recipient_id) &
+                (notifications.c.is_read == False)
+            )
+            .scalar_subquery()
+        )
+        drifted = counters.c.unread_count != unread_for_recipient
+        
+        repaired: List[str] = []
+        candidates = (await self.session.execute(select(counters.c.recipient_id).where(drifted))).scalars().all()
+        for start in range(0, len(candidates), 1000):
+            chunk = counters.c.recipient_id.in_(candidates[start:start + 1000])
+            await self.session.execute(
+                select(counters.c.recipient_id).where(chunk).order_by(counters.c.recipient_id).with_for_update()
+            )
+            repair = (
+                counters.update()
+                .where(chunk & drifted)
+                .values(unread_count=unread_for_recipient, updated_at=datetime.utcnow())
+            )
+            if self._postgres:
+                result = await self.session.execute(repair.returning(counters.c.recipient_id))
+                repaired += result.scalars().all()
+            else:
+                # No RETURNING for SQLite in SQLAlchemy 1.4; writers are
+                # serialized there, so the drift found above still holds
+                await self.session.execute(repair)
+                repaired += candidates[start:start + 1000]
+            await self.session.commit()
+        
+        # A counter created concurrently wins the conflict, and one created
+        # here is only changed by writers after it commits
+        missing = (
+            select(
+                notifications.c.recipient_id,
+                func.count().label("unread_count"),
+                func.max(notifications.c.updated_at).label("updated_at"),
+            )
+            .where(notifications.c.is_read == False)
+            .group_by(notifications.c.recipient_id)
+        )
+        seed = (
+            self._insert(counters)
+            .from_select(["recipient_id", "unread_count", "updated_at"], missing)
+            .on_conflict_do_nothing(index_elements=[counters.c.recipient_id])
+        )
+        if self._postgres:
+            result = await self.session.execute(seed.returning(counters.c.recipient_id))
+            repaired += result.scalars().all()
+        else:
+            result = await self.session.execute(
+                select(notifications.c.recipient_id)
+                .where(
+                    (notifications.c.is_read == False) &
+                    ~select(counters.c.recipient_id)
+                    .where(counters.c.recipient_id == notifications.c.recipient_id)
+                    .exists()
+                )
+                .distinct()
+            )
+            seeded = result.scalars().all()
+            if seeded:
+                await self.session.execute(seed)
+            repaired += seeded
+        
+        await self.session.commit()
+        return repaired
+    
+    async def purge_expired(
+        self,
+        notification_type: NotificationType,
+        statuses: List[NotificationStatus],
+        before: datetime,
+        limit: int = 1000,
+        archive: bool = False,
+    ) -> List[Tuple[int, str, bool]]:
+        """
+        Delete one batch of notifications of a type and status created before a cutoff
+        
+        With archive the rows are copied to notifications_archive first.
+        Unread counters are decremented for any unread rows removed. Returns
+        (id, recipient_id, is_read) for each removed row.
+        """
+        candidates = (
+            select(Notification.id)
+            .where(
+                col(Notification.status).in_(statuses) &
+                (Notification.type == notification_type) &
+                (Notification.created_at < before)
+            )
+            .order_by(Notification.created_at)
+            .limit(limit)
+        )
+        if self._postgres:
+            candidates = candidates.with_for_update(skip_locked=True)
+        ids = (await self.session.execute(candidates)).scalars().all()
+        if not ids:
+            return []
+        
+        table = Notification.__table__
+        if archive:
+            columns = [column.name for column in table.columns]
+            await self.session.execute(
+                notifications_archive.insert().from_select(
+                    columns + ["archived_at"],
+                    select(*table.columns, literal(datetime.utcnow(), DateTime)).where(
+                        table.c.id.in_(ids)
+                    ),
+                )
+            )
+        deleted = await self._delete_returning(table.c.id.in_(ids))
+        await self._decrement_unread_many(
+            self._count_by_recipient(row[1] for row in deleted if not row[2])
+        )
+        await self.session.commit()
+        return deleted
+    
     async def get_pending_notifications(self, limit: int = 100) -> List[Notification]:
         """Get pending notifications for processing"""
         query = (
@@ -146,4 +936,251 @@ class NotificationRepository:
         )
         
         result = await self.session.execute(query)
-        return result.scalars().all() 
\ No newline at end of file
+        return result.scalars().all() 
+    
+    async def claim_pending(
+        self,
+        worker_id: str,
+        limit: int = 100,
+        lease_seconds: float = 60.0,
+        types: Optional[List[NotificationType]] = None,
+        shards: Optional[Tuple[int, List[int]]] = None,
+        retries: bool = False,
+    ) -> List[Notification]:
+        """
+        Atomically claim a batch of pending notifications for a delivery worker
+        
+        Claimed rows get a lease (locked_by/locked_until) so other workers skip
+        them; rows whose lease expired, e.g. after a worker crash, can be
+        claimed again. On Postgres concurrent claimers skip each other's rows
+        with FOR UPDATE SKIP LOCKED instead of waiting on them. types limits
+        the claim to a delivery lane, and shards as (shard count, owned
+        shards) to the recipients this worker owns. Fresh rows are claimed
+        in creation order; with retries, failed rows whose next attempt is
+        due are claimed instead, each from its own partial index.
+        """
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=lease_seconds)
+        claimable = (Notification.status == NotificationStatus.PENDING) & (
+            (Notification.locked_until == None) | (Notification.locked_until < now)
+        )
+        if types:
+            claimable = claimable & col(Notification.type).in_(types)
+        if shards and shards[0] > 1:
+            shard_count, owned = shards
+            claimable = claimable & (Notification.recipient_hash % shard_count).in_(owned)
+        if retries:
+            claimable = claimable & (Notification.next_attempt_at != None) & (Notification.next_attempt_at <= now)
+            order = Notification.next_attempt_at
+        else:
+            claimable = claimable & (Notification.next_attempt_at == None)
+            order = Notification.created_at
+        candidates = (
+            select(Notification.id)
+            .where(claimable)
+            .order_by(order)
+            .limit(limit)
+        )
+        
+        if self._postgres:
+            candidates = candidates.with_for_update(skip_locked=True)
+            statement = (
+                update(Notification)
+                .where(Notification.id.in_(candidates.scalar_subquery()))
+                .values(locked_by=worker_id, locked_until=lease_until)
+                .returning(*Notification.__table__.columns)
+            )
+            result = await self.session.execute(
+                select(Notification).from_statement(statement)
+            )
+            claimed = sorted(result.scalars().all(), key=lambda n: n.created_at)
+        else:
+            # SQLite serializes writers, so a single UPDATE is already atomic
+            await self.session.execute(
+                update(Notification)
+                .where(Notification.id.in_(candidates.scalar_subquery()) & claimable)
+                .values(locked_by=worker_id, locked_until=lease_until)
+                .execution_options(synchronize_session=False)
+            )
+            result = await self.session.execute(
+                select(Notification)
+                .where(
+                    (Notification.locked_by == worker_id) &
+                    (Notification.locked_until == lease_until)
+                )
+                .order_by(Notification.created_at)
+            )
+            claimed = result.scalars().all()
+        
+        await self.session.commit()
+        return claimed
+    
+    @read_only
+    async def pending_backlog(self, types: List[NotificationType]) -> Tuple[int, int, Optional[datetime]]:
+        """
+        Pending notifications of the given types: how many, how many are
+        waiting to be retried, and the oldest one's creation time
+        """
+        result = await self.session.execute(
+            select(
+                func.count(),
+                func.count(Notification.next_attempt_at),
+                func.min(Notification.created_at),
+            )
+            .where(
+                (Notification.status == NotificationStatus.PENDING) &
+                col(Notification.type).in_(types)
+            )
+        )
+        count, retrying, oldest = result.one()
+        return count, retrying, oldest
+    
+    async def renew_leases(
+        self, notification_ids: List[int], worker_id: str, lease_seconds: float
+    ) -> List[int]:
+        """
+        Extend the lease of claimed rows still held by a worker
+        
+        Returns the ids renewed. A row whose lease has already expired is
+        left alone, since another worker may have claimed it meanwhile.
+        """
+        if not notification_ids:
+            return []
+        now = datetime.utcnow()
+        held = (
+            Notification.id.in_(notification_ids) &
+            (Notification.locked_by == worker_id) &
+            (Notification.locked_until > now)
+        )
+        renew = (
+            update(Notification)
+            .where(held)
+            .values(locked_until=now + timedelta(seconds=lease_seconds))
+            .execution_options(synchronize_session=False)
+        )
+        if self._postgres:
+            result = await self.session.execute(renew.returning(Notification.id))
+            renewed = list(result.scalars().all())
+        else:
+            renewed = list((await self.session.execute(select(Notification.id).where(held))).scalars().all())
+            if renewed:
+                await self.session.execute(renew)
+        await self.session.commit()
+        return renewed
+    
+    async def mark_many_as_delivered(self, notification_ids: List[int], worker_id: str) -> int:
+        """Mark a batch of claimed notifications as delivered and release their lease"""
+        if not notification_ids:
+            return 0
+        now = datetime.utcnow()
+        result = await self.session.execute(
+            update(Notification)
+            .where(
+                Notification.id.in_(notification_ids) &
+                (Notification.locked_by == worker_id)
+            )
+            .values(
+                status=NotificationStatus.DELIVERED,
+                delivered_at=now,
+                updated_at=now,
+                attempts=Notification.attempts + 1,
+                next_attempt_at=None,
+                locked_by=None,
+                locked_until=None,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await self.session.commit()
+        return result.rowcount
+    
+    async def record_failures(
+        self, failures: Dict[int, Tuple[str, Optional[datetime]]], worker_id: str
+    ) -> int:
+        """
+        Record failed delivery attempts for a batch of claimed notifications
+        
+        failures maps ids to (error, next attempt). Rows with a next attempt
+        stay pending until it is due; rows without one are dead-lettered as
+        FAILED.
+        """
+        if not failures:
+            return 0
+        now = datetime.utcnow()
+        table = Notification.__table__
+        result = await self.session.execute(
+            table.update()
+            .where((table.c.id == bindparam("b_id")) & (table.c.locked_by == worker_id))
+            .values(
+                status=bindparam("b_status"),
+                last_error=bindparam("b_error"),
+                next_attempt_at=bindparam("b_next_attempt_at"),
+                attempts=table.c.attempts + 1,
+                updated_at=now,
+                locked_by=None,
+                locked_until=None,
+            ),
+            [
+                {
+                    "b_id": notification_id,
+                    "b_error": error,
+                    "b_next_attempt_at": next_attempt_at,
+                    "b_status": NotificationStatus.PENDING if next_attempt_at else NotificationStatus.FAILED,
+                }
+                for notification_id, (error, next_attempt_at) in failures.items()
+            ],
+        )
+        await self.session.commit()
+        return result.rowcount
+    
+    async def claim_digest(
+        self, types: List[NotificationType], since: datetime, limit: int = 1000
+    ) -> List[Notification]:
+        """
+        Claim unread notifications that have not gone out in an email digest yet
+        
+        Claimed rows are stamped with digest_sent_at, so concurrent digest runs
+        never pick up the same rows. Rows come back grouped by recipient.
+        """
+        stamp = datetime.utcnow()
+        pending = (
+            (Notification.digest_sent_at == None) &
+            (Notification.is_read == False) &
+            col(Notification.type).in_(types) &
+            (Notification.created_at >= since)
+        )
+        candidates = (
+            select(Notification.id)
+            .where(pending)
+            .order_by(Notification.created_at)
+            .limit(limit)
+        )
+        if self._postgres:
+            candidates = candidates.with_for_update(skip_locked=True)
+        
+        await self.session.execute(
+            update(Notification)
+            .where(Notification.id.in_(candidates.scalar_subquery()) & pending)
+            .values(digest_sent_at=stamp)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(
+            select(Notification)
+            .where(Notification.digest_sent_at == stamp)
+            .order_by(Notification.recipient_id, Notification.created_at)
+        )
+        claimed = result.scalars().all()
+        await self.session.commit()
+        return claimed
+    
+    async def release_digest(self, notification_ids: List[int]) -> int:
+        """Return notifications whose digest could not be sent to the next digest run"""
+        if not notification_ids:
+            return 0
+        result = await self.session.execute(
+            update(Notification)
+            .where(Notification.id.in_(notification_ids))
+            .values(digest_sent_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        await self.session.commit()
+        return result.rowcount
@@ -0,0 +1,80 @@
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import col
+
+from app.core.database import read_only
+from app.models.preference import (
+    NotificationPreference,
+    NotificationPreferences,
+    PreferenceRule,
+    UserNotificationSettings,
+)
+
+
+class PreferenceRepository:
+    """Repository for notification preference database operations"""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    @read_only
+    async def get_for_users(
+        self, user_ids: List[str]
+    ) -> Tuple[Dict[str, UserNotificationSettings], Dict[str, List[NotificationPreference]]]:
+        """Load the settings and preference rules of many users in two queries"""
+        if not user_ids:
+            return {}, {}
+        result = await self.session.execute(
+            select(UserNotificationSettings).where(col(UserNotificationSettings.user_id).in_(user_ids))
+        )
+        user_settings = {row.user_id: row for row in result.scalars().all()}
+
+        result = await self.session.execute(
+            select(NotificationPreference).where(col(NotificationPreference.user_id).in_(user_ids))
+        )
+        rules: Dict[str, List[NotificationPreference]] = {}
+        for rule in result.scalars().all():
+            rules.setdefault(rule.user_id, []).append(rule)
+        return user_settings, rules
+
+    async def get(self, user_id: str) -> NotificationPreferences:
+        """Get a user's preferences, with defaults if none were saved"""
+        user_settings, rules = await self.get_for_users([user_id])
+        current = user_settings.get(user_id)
+        return NotificationPreferences(
+            muted_until=current.muted_until if current else None,
+            quiet_hours_start=current.quiet_hours_start if current else None,
+            quiet_hours_end=current.quiet_hours_end if current else None,
+            timezone=current.timezone if current else "UTC",
+            rules=[
+                PreferenceRule(type=rule.type, channel=rule.channel, enabled=rule.enabled)
+                for rule in rules.get(user_id, [])
+            ],
+        )
+
+    async def replace(self, user_id: str, preferences: NotificationPreferences) -> NotificationPreferences:
+        """Replace a user's settings and preference rules"""
+        current = await self.session.get(UserNotificationSettings, user_id)
+        if current is None:
+            current = UserNotificationSettings(user_id=user_id)
+            self.session.add(current)
+        current.muted_until = preferences.muted_until
+        current.quiet_hours_start = preferences.quiet_hours_start
+        current.quiet_hours_end = preferences.quiet_hours_end
+        current.timezone = preferences.timezone
+        current.updated_at = datetime.utcnow()
+
+        await self.session.execute(
+            delete(NotificationPreference).where(NotificationPreference.user_id == user_id)
+        )
+        # Later rules for the same type and channel win
+        rules = {(rule.type, rule.channel): rule.enabled for rule in preferences.rules}
+        self.session.add_all(
+            NotificationPreference(user_id=user_id, type=type_, channel=channel, enabled=enabled)
+            for (type_, channel), enabled in rules.items()
+        )
+        await self.session.commit()
+        return await self.get(user_id)
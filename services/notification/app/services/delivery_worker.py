@@ -0,0 +1,295 @@
+"""
+Delivery of pending notifications through priority lanes.
+
+Each lane owns a set of notification types, claims pending rows of those
+types on its own schedule and delivers them on its own slots, so a backlog
+of broadcasts in one lane never delays alerts or mentions in another. Within
+a lane every recipient maps to one slot and a slot delivers in claim order,
+so one recipient's notifications go out in order while different recipients
+are handled in parallel. Across processes, recipients are split into
+DELIVERY_SHARD_COUNT shards and each process only claims its own.
+
+Failed deliveries are retried with backoff. Each lane keeps the retry times
+it scheduled in a heap and claims due retries as soon as the earliest one
+falls due, plus a periodic scan for retries scheduled by other processes.
+
+Claimed rows may wait on their slot, so a slot renews the leases of a batch
+right before sending it and skips rows whose lease ran out, which another
+worker may have claimed and sent already. Both the claims and each slot's
+batches are sized from the measured send time, so that a batch is sent well
+within one lease.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import get_db_context
+from app.models.notification import Notification, NotificationStatus, NotificationType, recipient_hash
+from app.services.notification_service import NotificationService, default_worker_id
+
+
+logger = logging.getLogger(__name__)
+
+
+class RetryTimer:
+    """Min-heap of the retry times a lane has scheduled"""
+
+    def __init__(self):
+        self._heap: List[datetime] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, due_at: datetime) -> None:
+        heapq.heappush(self._heap, due_at)
+
+    def pop_due(self, now: datetime) -> int:
+        """Drop every entry due by now and return how many there were"""
+        due = 0
+        while self._heap and self._heap[0] <= now:
+            heapq.heappop(self._heap)
+            due += 1
+        return due
+
+
+class DeliveryLane:
+    """Claims pending notifications of some types and delivers them on per-recipient slots"""
+
+    def __init__(
+        self,
+        name: str,
+        types: List[NotificationType],
+        worker_id: str,
+        batch_size: int = 100,
+        concurrency: int = 10,
+        poll_interval: float = 1.0,
+        shards: Optional[Tuple[int, List[int]]] = None,
+    ):
+        self.name = name
+        self.types = types
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.shards = shards
+        self.slots: List["asyncio.Queue[Notification]"] = [asyncio.Queue() for _ in range(concurrency)]
+        self.queued = 0
+        self.in_flight = 0
+        self.stats: Dict[str, Any] = {
+            "batches": 0,
+            "claimed": 0,
+            "delivered": 0,
+            "failed": 0,
+            "retries_scheduled": 0,
+            "dead_lettered": 0,
+            "lease_expired": 0,
+            "latency_ms_max": 0.0,
+        }
+        # Moving average of the seconds one send takes, once measured
+        self.send_seconds: Optional[float] = None
+        self._latency_total = 0.0
+        self.retry_timer = RetryTimer()
+        self._next_retry_scan = datetime.utcnow()
+        # Set whenever the slots take work off the queue
+        self._room = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def claim_once(self, limit: int, retries: bool = False) -> int:
+        """Claim up to limit rows and queue them on the slots, returning the number claimed"""
+        async with get_db_context() as session:
+            claimed = await NotificationService(session).repository.claim_pending(
+                self.worker_id,
+                limit=limit,
+                lease_seconds=settings.DELIVERY_LEASE_SECONDS,
+                types=self.types,
+                shards=self.shards,
+                retries=retries,
+            )
+        for notification in claimed:
+            slot = recipient_hash(notification.recipient_id) % len(self.slots)
+            self.slots[slot].put_nowait(notification)
+        self.queued += len(claimed)
+        if claimed:
+            self.stats["batches"] += 1
+            self.stats["claimed"] += len(claimed)
+        return len(claimed)
+
+    def lease_capacity(self) -> int:
+        """How many rows one slot can send within half a lease"""
+        if not self.send_seconds:
+            return self.batch_size
+        return max(1, min(self.batch_size, int(settings.DELIVERY_LEASE_SECONDS / 2 / self.send_seconds)))
+
+    async def _claim(self) -> None:
+        while True:
+            # Claim only what the slots can work off within the lease, and
+            # wait for half a batch of room so claims stay reasonably large
+            capacity = min(self.batch_size, self.lease_capacity() * len(self.slots))
+            if self.queued > capacity // 2:
+                self._room.clear()
+                await self._room.wait()
+                continue
+            limit = capacity - self.queued
+            claimed = 0
+            try:
+                if self._retries_due():
+                    retried = await self.claim_once(limit, retries=True)
+                    if retried >= limit:
+                        # More may be due; look again on the next round
+                        self._next_retry_scan = datetime.utcnow()
+                    limit -= retried
+                if limit > 0:
+                    claimed = await self.claim_once(limit)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Delivery lane {self.name} failed to claim: {str(e)}")
+            # A short batch means the lane has caught up
+            if claimed < limit:
+                await asyncio.sleep(self.poll_interval)
+
+    def _retries_due(self) -> bool:
+        now = datetime.utcnow()
+        due = self.retry_timer.pop_due(now) > 0 or now >= self._next_retry_scan
+        if due:
+            self._next_retry_scan = now + timedelta(seconds=settings.DELIVERY_RETRY_SCAN_INTERVAL)
+        return due
+
+    async def _deliver(self, slot: "asyncio.Queue[Notification]") -> None:
+        while True:
+            batch = [await slot.get()]
+            limit = self.lease_capacity()
+            while not slot.empty() and len(batch) < limit:
+                batch.append(slot.get_nowait())
+            self.queued -= len(batch)
+            self.in_flight += len(batch)
+            self._room.set()
+            try:
+                async with get_db_context() as session:
+                    service = NotificationService(session)
+                    renewed = set(
+                        await service.repository.renew_leases(
+                            [n.id for n in batch], self.worker_id, settings.DELIVERY_LEASE_SECONDS
+                        )
+                    )
+                    held = [n for n in batch if n.id in renewed]
+                    self.stats["lease_expired"] += len(batch) - len(held)
+                    if held:
+                        started = time.perf_counter()
+                        delivered = await service.deliver_claimed(held, self.worker_id, ordered=True)
+                        self._measure((time.perf_counter() - started) / len(held))
+                        self._record(held, delivered)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The rows keep their lease and are claimed again once it expires
+                logger.error(f"Delivery lane {self.name} failed to deliver: {str(e)}")
+            finally:
+                self.in_flight -= len(batch)
+
+    def _measure(self, send_seconds: float) -> None:
+        if self.send_seconds is None:
+            self.send_seconds = send_seconds
+        else:
+            self.send_seconds = 0.8 * self.send_seconds + 0.2 * send_seconds
+
+    def _record(self, batch: List[Notification], delivered: List[Notification]) -> None:
+        now = datetime.utcnow()
+        for notification in delivered:
+            latency = (now - notification.created_at).total_seconds() * 1000
+            self._latency_total += latency
+            self.stats["latency_ms_max"] = max(self.stats["latency_ms_max"], latency)
+        self.stats["delivered"] += len(delivered)
+        self.stats["failed"] += len(batch) - len(delivered)
+        for notification in batch:
+            if notification.status == NotificationStatus.PENDING and notification.next_attempt_at:
+                self.retry_timer.schedule(notification.next_attempt_at)
+                self.stats["retries_scheduled"] += 1
+            elif notification.status == NotificationStatus.FAILED:
+                self.stats["dead_lettered"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        delivered = self.stats["delivered"]
+        return {
+            "types": [t.value for t in self.types],
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "retry_timers": len(self.retry_timer),
+            "send_ms_avg": self.send_seconds * 1000 if self.send_seconds else 0.0,
+            **self.stats,
+            "latency_ms_avg": self._latency_total / delivered if delivered else 0.0,
+        }
+
+    async def backlog(self) -> Dict[str, Any]:
+        """Pending rows of this lane's types in the database and the age of the oldest"""
+        async with get_db_context() as session:
+            pending, retrying, oldest = await NotificationService(session).repository.pending_backlog(self.types)
+        return {
+            "pending": pending,
+            "retrying": retrying,
+            "oldest_age_seconds": (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0,
+        }
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._claim()))
+        for slot in self.slots:
+            self._tasks.append(asyncio.create_task(self._deliver(slot)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class DeliveryScheduler:
+    """Runs the configured delivery lanes in this process"""
+
+    def __init__(self, lanes: Dict[str, Dict[str, Any]]):
+        max_weight = max((config.get("weight", 1) for config in lanes.values()), default=1)
+        shards = (settings.DELIVERY_SHARD_COUNT, settings.DELIVERY_SHARDS or list(range(settings.DELIVERY_SHARD_COUNT)))
+        self.lanes: List[DeliveryLane] = [
+            DeliveryLane(
+                name,
+                [NotificationType(t) for t in config["types"]],
+                default_worker_id(index),
+                # Heavier lanes claim proportionally more per round
+                batch_size=max(1, round(settings.DELIVERY_BATCH_SIZE * config.get("weight", 1) / max_weight)),
+                concurrency=config.get("concurrency", 10),
+                poll_interval=config.get("poll_interval", settings.DELIVERY_POLL_INTERVAL),
+                shards=shards,
+            )
+            for index, (name, config) in enumerate(lanes.items())
+        ]
+
+        # Types no lane lists would never be delivered; give them to the lightest lane
+        covered = {t for lane in self.lanes for t in lane.types}
+        missing = [t for t in NotificationType if t not in covered]
+        if missing and self.lanes:
+            lightest = min(lanes, key=lambda name: lanes[name].get("weight", 1))
+            lane = next(lane for lane in self.lanes if lane.name == lightest)
+            lane.types.extend(missing)
+            logger.warning(
+                f"Notification types {', '.join(t.value for t in missing)} are in no delivery lane, "
+                f"delivering them on {lane.name}"
+            )
+
+    async def start(self) -> None:
+        for lane in self.lanes:
+            await lane.start()
+
+    async def stop(self) -> None:
+        for lane in self.lanes:
+            await lane.stop()
+
+    async def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {lane.name: {**lane.snapshot(), **await lane.backlog()} for lane in self.lanes}
+
+
+delivery_scheduler = DeliveryScheduler(settings.DELIVERY_LANES)
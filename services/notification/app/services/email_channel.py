@@ -0,0 +1,264 @@
+"""
+Email delivery channel.
+
+Messages are sent over a bounded pool of persistent SMTP connections, so
+many notifications share one SMTP session instead of paying a connect,
+TLS and login round-trip each. Templates are compiled once per
+notification type, and rendering runs in a worker thread to keep the event
+loop free. Point SMTP_HOST/SMTP_PORT at a local sink such as MailHog
+(see docker-compose.yml) to exercise the channel end to end.
+"""
+
+import asyncio
+import logging
+import time
+from email.message import EmailMessage
+from email.utils import formataddr
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+
+from app.core.config import settings
+from app.core.exceptions import NotificationDeliveryError, UndeliverableError
+from app.models.notification import Notification, NotificationType
+
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates" / "email"
+
+
+class EmailTemplates:
+    """Compiled email templates cached by notification type"""
+
+    def __init__(self, directory: Path = TEMPLATES_DIR):
+        self.env = Environment(
+            loader=FileSystemLoader(str(directory)),
+            autoescape=select_autoescape(["html"]),
+            auto_reload=False,
+        )
+        self._cache: Dict[str, Tuple[Template, Template]] = {}
+
+    def get(self, notification_type: str) -> Tuple[Template, Template]:
+        """Return the (html, text) templates for a notification type"""
+        templates = self._cache.get(notification_type)
+        if templates is None:
+            templates = (
+                self.env.select_template([f"{notification_type}.html", "default.html"]),
+                self.env.select_template([f"{notification_type}.txt", "default.txt"]),
+            )
+            self._cache[notification_type] = templates
+        return templates
+
+    def render(self, notification: Notification) -> Tuple[str, str]:
+        """Render the html and text bodies for a notification"""
+        html, text = self.get(NotificationType(notification.type).value)
+        context = {
+            "notification": notification,
+            "meta": notification.meta or {},
+            "app_name": settings.EMAIL_FROM_NAME,
+        }
+        return html.render(context), text.render(context)
+
+    def render_digest(self, notifications: List[Notification]) -> Tuple[str, str]:
+        """Render the html and text bodies for a digest of notifications"""
+        html, text = self.get("digest")
+        context = {
+            "notifications": notifications,
+            "total": sum(n.coalesced_count for n in notifications),
+            "app_name": settings.EMAIL_FROM_NAME,
+        }
+        return html.render(context), text.render(context)
+
+
+class SMTPConnectionPool:
+    """Bounded pool of persistent SMTP connections"""
+
+    def __init__(self, size: int, max_messages_per_connection: int = 1000):
+        self.size = size
+        self.max_messages_per_connection = max_messages_per_connection
+        self._idle: "asyncio.LifoQueue[aiosmtplib.SMTP]" = asyncio.LifoQueue()
+        self._slots = asyncio.Semaphore(size)
+        self._sent: Dict[int, int] = {}
+        self.connects = 0
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=settings.SMTP_HOST,
+            port=settings.SMTP_PORT,
+            use_tls=settings.SMTP_SSL,
+            start_tls=settings.SMTP_TLS,
+            username=settings.SMTP_USER,
+            password=settings.SMTP_PASSWORD,
+            timeout=settings.SMTP_TIMEOUT,
+        )
+        await client.connect()
+        self.connects += 1
+        self._sent[id(client)] = 0
+        return client
+
+    async def acquire(self) -> aiosmtplib.SMTP:
+        await self._slots.acquire()
+        try:
+            while not self._idle.empty():
+                client = self._idle.get_nowait()
+                if client.is_connected:
+                    return client
+                self._sent.pop(id(client), None)
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, client: aiosmtplib.SMTP, healthy: bool = True) -> None:
+        try:
+            sent = self._sent.get(id(client), 0) + 1
+            self._sent[id(client)] = sent
+            if healthy and client.is_connected and sent < self.max_messages_per_connection:
+                self._idle.put_nowait(client)
+            else:
+                await self._discard(client)
+        finally:
+            self._slots.release()
+
+    async def _discard(self, client: aiosmtplib.SMTP) -> None:
+        self._sent.pop(id(client), None)
+        try:
+            if client.is_connected:
+                await client.quit()
+        except Exception:
+            client.close()
+
+    async def close(self) -> None:
+        while not self._idle.empty():
+            await self._discard(self._idle.get_nowait())
+
+
+class EmailChannel:
+    """Sends notification emails with bounded concurrency and latency metrics"""
+
+    name = "email"
+
+    def __init__(self, templates: Optional[EmailTemplates] = None):
+        self.templates = templates or EmailTemplates()
+        self.pool = SMTPConnectionPool(
+            settings.EMAIL_POOL_SIZE,
+            max_messages_per_connection=settings.EMAIL_MAX_MESSAGES_PER_CONNECTION,
+        )
+        self._concurrency = asyncio.Semaphore(settings.EMAIL_MAX_CONCURRENCY)
+        self.metrics: Dict[str, Any] = {
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "latency_total_ms": 0.0,
+            "latency_max_ms": 0.0,
+        }
+
+    @staticmethod
+    def recipient_address(notification: Notification) -> Optional[str]:
+        """Email address for a notification, supplied by the producer in meta"""
+        return (notification.meta or {}).get("email")
+
+    @staticmethod
+    def compose(to_address: str, subject: str, html: str, text: str) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = formataddr((settings.EMAIL_FROM_NAME, settings.EMAIL_FROM))
+        message["To"] = to_address
+        message["Subject"] = subject
+        message.set_content(text)
+        message.add_alternative(html, subtype="html")
+        return message
+
+    async def build_message(self, notification: Notification, to_address: str) -> EmailMessage:
+        html, text = await asyncio.to_thread(self.templates.render, notification)
+        return self.compose(to_address, notification.title, html, text)
+
+    async def send(self, notification: Notification) -> None:
+        """Send a notification by email; raises UndeliverableError if it has no address"""
+        to_address = self.recipient_address(notification)
+        if not to_address:
+            self.metrics["failed"] += 1
+            raise UndeliverableError("No email address for recipient")
+
+        message = await self.build_message(notification, to_address)
+        await self.send_message(message)
+
+    async def send_digest(self, notifications: List[Notification]) -> bool:
+        """Send one recipient's notifications as a single email; returns False if there is no address"""
+        to_address = next(
+            (a for a in map(self.recipient_address, reversed(notifications)) if a), None
+        )
+        if not to_address:
+            return False
+
+        html, text = await asyncio.to_thread(self.templates.render_digest, notifications)
+        total = sum(n.coalesced_count for n in notifications)
+        subject = f"You have {total} new notification{'s' if total != 1 else ''}"
+        await self.send_message(self.compose(to_address, subject, html, text))
+        return True
+
+    async def send_message(self, message: EmailMessage) -> None:
+        """Send a composed message over the pool, recording latency and failures"""
+        async with self._concurrency:
+            start = time.perf_counter()
+            try:
+                await self._send_with_reconnect(message)
+            except Exception as e:
+                self.metrics["failed"] += 1
+                raise NotificationDeliveryError(f"Email delivery failed: {str(e)}")
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+        self.metrics["sent"] += 1
+        self.metrics["latency_total_ms"] += elapsed_ms
+        if elapsed_ms > self.metrics["latency_max_ms"]:
+            self.metrics["latency_max_ms"] = elapsed_ms
+
+    async def _send_with_reconnect(self, message: EmailMessage) -> None:
+        # A pooled connection may have been dropped by the server while idle;
+        # retry once on a fresh connection before giving up
+        for attempt in range(2):
+            client = await self.pool.acquire()
+            try:
+                await client.send_message(message)
+            except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, ConnectionError):
+                await self.pool.release(client, healthy=False)
+                if attempt:
+                    raise
+                self.metrics["retries"] += 1
+                continue
+            except Exception:
+                await self.pool.release(client, healthy=False)
+                raise
+            await self.pool.release(client)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self.metrics)
+        stats["latency_avg_ms"] = (
+            stats["latency_total_ms"] / stats["sent"] if stats["sent"] else 0.0
+        )
+        stats["connects"] = self.pool.connects
+        return stats
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+
+_email_channel: Optional[EmailChannel] = None
+
+
+def get_email_channel() -> EmailChannel:
+    """Shared email channel, created on first use inside the event loop"""
+    global _email_channel
+    if _email_channel is None:
+        _email_channel = EmailChannel()
+    return _email_channel
+
+
+async def close_email_channel() -> None:
+    global _email_channel
+    if _email_channel is not None:
+        await _email_channel.close()
+        _email_channel = None
@@ -0,0 +1,100 @@
+"""
+Periodic email digests.
+
+Notification types listed in EMAIL_DIGEST_TYPES skip the per-notification
+email when EMAIL_DIGEST_INTERVAL is set. Instead, every interval each
+recipient gets one email covering their unread notifications since the
+last digest. Coalesced rows re-enter the next digest when they absorb new
+notifications.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import get_db_context
+from app.models.notification import Notification, NotificationType
+from app.models.preference import NotificationChannel
+from app.repositories.notification_repository import NotificationRepository
+from app.services.email_channel import get_email_channel
+from app.services.preferences import preference_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmailDigestScheduler:
+    """Sends each recipient one email per interval summarising their unread notifications"""
+
+    def __init__(self, interval: float, batch_size: int = 1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"runs": 0, "notifications": 0, "emails": 0, "failed": 0, "suppressed": 0}
+
+    async def run_once(self) -> int:
+        """Claim and send one batch of digests, returning the number of claimed rows"""
+        types = [NotificationType(t) for t in settings.EMAIL_DIGEST_TYPES]
+        since = datetime.utcnow() - timedelta(seconds=settings.EMAIL_DIGEST_LOOKBACK_SECONDS)
+        async with get_db_context() as session:
+            claimed = await NotificationRepository(session).claim_digest(
+                types, since, limit=self.batch_size
+            )
+        if not claimed:
+            return 0
+
+        # Rows the recipient does not want emailed are dropped from their digest
+        now = datetime.utcnow()
+        preferences = await preference_cache.get_many(n.recipient_id for n in claimed)
+        wanted = [
+            n for n in claimed
+            if preferences[n.recipient_id].allows(n.type, NotificationChannel.EMAIL, now)
+        ]
+        self.stats["suppressed"] += len(claimed) - len(wanted)
+
+        channel = get_email_channel()
+        groups = [list(rows) for _, rows in groupby(wanted, key=lambda n: n.recipient_id)]
+        results = await asyncio.gather(
+            *(channel.send_digest(rows) for rows in groups), return_exceptions=True
+        )
+
+        failed: List[Notification] = []
+        for rows, result in zip(groups, results):
+            if isinstance(result, Exception):
+                logger.error(f"Digest for recipient {rows[0].recipient_id} failed: {str(result)}")
+                failed.extend(rows)
+            elif result:
+                self.stats["emails"] += 1
+        if failed:
+            self.stats["failed"] += len(failed)
+            async with get_db_context() as session:
+                await NotificationRepository(session).release_digest([n.id for n in failed])
+
+        self.stats["runs"] += 1
+        self.stats["notifications"] += len(claimed)
+        return len(claimed)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # Keep going while batches come back full
+                while await self.run_once() >= self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"Email digest run failed: {str(e)}")
+
+    async def start(self) -> None:
+        if self.interval > 0 and settings.EMAIL_CHANNEL_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+email_digests = EmailDigestScheduler(settings.EMAIL_DIGEST_INTERVAL, settings.EMAIL_DIGEST_BATCH_SIZE)
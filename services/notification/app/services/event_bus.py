@@ -0,0 +1,255 @@
+"""
+Event bus used by other services to hand work to the notification service.
+
+Producers publish and move on; they never wait on the notification
+database. Consumers pull messages in batches and acknowledge them only after
+the resulting writes have committed, so a crash leads to redelivery rather
+than loss. Redelivery is bounded by EVENT_MAX_DELIVER, and the number of
+unacknowledged messages in flight by EVENT_MAX_ACK_PENDING.
+
+The "nats" backend uses JetStream pull consumers. The "memory" backend keeps
+the same semantics in process, for tests and single-process development.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventMessage:
+    """A delivered event awaiting acknowledgement"""
+
+    def __init__(self, subject: str, data: Dict[str, Any], num_delivered: int = 1):
+        self.subject = subject
+        self.data = data
+        self.num_delivered = num_delivered
+
+    async def ack(self) -> None:
+        """Mark the event as processed"""
+
+    async def nak(self, delay: Optional[float] = None) -> None:
+        """Ask for redelivery, optionally after a delay"""
+
+    async def term(self) -> None:
+        """Drop the event without redelivery, e.g. when it cannot be parsed"""
+
+
+class InMemoryMessage(EventMessage):
+    def __init__(self, consumer: "InMemoryConsumer", sequence: int, subject: str, data: Dict[str, Any], num_delivered: int):
+        super().__init__(subject, data, num_delivered)
+        self._consumer = consumer
+        self._sequence = sequence
+
+    async def ack(self) -> None:
+        self._consumer.settle(self._sequence)
+
+    async def nak(self, delay: Optional[float] = None) -> None:
+        self._consumer.redeliver(self._sequence, delay or 0.0)
+
+    async def term(self) -> None:
+        self._consumer.settle(self._sequence)
+
+
+class InMemoryConsumer:
+    """Durable pull consumer over an in-memory stream"""
+
+    def __init__(self, bus: "InMemoryEventBus", subject: str):
+        self.bus = bus
+        self.subject = subject
+        self.cursor = 0
+        # sequence -> (redeliver at, deliveries so far)
+        self.pending: Dict[int, List[float]] = {}
+
+    def matches(self, subject: str) -> bool:
+        if self.subject.endswith(">"):
+            return subject.startswith(self.subject[:-1])
+        return subject == self.subject
+
+    def settle(self, sequence: int) -> None:
+        self.pending.pop(sequence, None)
+
+    def redeliver(self, sequence: int, delay: float) -> None:
+        if sequence in self.pending:
+            self.pending[sequence][0] = time.monotonic() + delay
+
+    def _take(self, batch: int) -> List[EventMessage]:
+        now = time.monotonic()
+        messages: List[EventMessage] = []
+
+        for sequence, state in sorted(self.pending.items()):
+            if len(messages) >= batch:
+                return messages
+            redeliver_at, deliveries = state
+            if redeliver_at > now:
+                continue
+            if deliveries >= settings.EVENT_MAX_DELIVER:
+                logger.error(f"Dropping event {sequence} after {deliveries} deliveries")
+                del self.pending[sequence]
+                continue
+            state[0] = now + settings.EVENT_ACK_WAIT
+            state[1] += 1
+            subject, data = self.bus.stream[sequence]
+            messages.append(InMemoryMessage(self, sequence, subject, data, state[1]))
+
+        while (
+            len(messages) < batch
+            and len(self.pending) < settings.EVENT_MAX_ACK_PENDING
+            and self.cursor < len(self.bus.stream)
+        ):
+            sequence = self.cursor
+            self.cursor += 1
+            subject, data = self.bus.stream[sequence]
+            if not self.matches(subject):
+                continue
+            self.pending[sequence] = [now + settings.EVENT_ACK_WAIT, 1]
+            messages.append(InMemoryMessage(self, sequence, subject, data, 1))
+        return messages
+
+    async def fetch(self, batch: int, timeout: float) -> List[EventMessage]:
+        deadline = time.monotonic() + timeout
+        while True:
+            messages = self._take(batch)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                return messages
+            async with self.bus.published:
+                try:
+                    await asyncio.wait_for(self.bus.published.wait(), min(remaining, 0.1))
+                except asyncio.TimeoutError:
+                    pass
+
+
+class InMemoryEventBus:
+    """In-process event bus with JetStream-like pull semantics"""
+
+    def __init__(self):
+        self.stream: List[tuple] = []
+        self.consumers: Dict[str, InMemoryConsumer] = {}
+        self.published = asyncio.Condition()
+
+    async def connect(self) -> None:
+        pass
+
+    async def publish(self, subject: str, data: Dict[str, Any]) -> None:
+        self.stream.append((subject, data))
+        async with self.published:
+            self.published.notify_all()
+
+    async def pull_subscribe(self, subject: str, durable: str) -> InMemoryConsumer:
+        if durable not in self.consumers:
+            self.consumers[durable] = InMemoryConsumer(self, subject)
+        return self.consumers[durable]
+
+    async def close(self) -> None:
+        pass
+
+
+class JetStreamMessage(EventMessage):
+    def __init__(self, msg):
+        try:
+            num_delivered = msg.metadata.num_delivered
+        except Exception:
+            num_delivered = 1
+        super().__init__(msg.subject, json.loads(msg.data), num_delivered)
+        self._msg = msg
+
+    async def ack(self) -> None:
+        await self._msg.ack()
+
+    async def nak(self, delay: Optional[float] = None) -> None:
+        await self._msg.nak(delay=delay)
+
+    async def term(self) -> None:
+        await self._msg.term()
+
+
+class JetStreamConsumer:
+    """Durable JetStream pull consumer"""
+
+    def __init__(self, subscription):
+        self.subscription = subscription
+
+    async def fetch(self, batch: int, timeout: float) -> List[EventMessage]:
+        from nats.errors import TimeoutError as NatsTimeoutError
+
+        try:
+            msgs = await self.subscription.fetch(batch, timeout=timeout)
+        except (NatsTimeoutError, asyncio.TimeoutError):
+            return []
+
+        messages: List[EventMessage] = []
+        for msg in msgs:
+            try:
+                messages.append(JetStreamMessage(msg))
+            except ValueError:
+                logger.error(f"Dropping unparseable event on {msg.subject}")
+                await msg.term()
+        return messages
+
+
+class JetStreamEventBus:
+    """Event bus backed by a NATS JetStream stream"""
+
+    def __init__(self, url: str, stream: str, subjects: List[str]):
+        self.url = url
+        self.stream = stream
+        self.subjects = subjects
+        self._nc = None
+        self._js = None
+
+    async def connect(self) -> None:
+        if self._nc is not None:
+            return
+        import nats
+        from nats.js.errors import NotFoundError
+
+        self._nc = await nats.connect(self.url)
+        self._js = self._nc.jetstream()
+        try:
+            await self._js.stream_info(self.stream)
+        except NotFoundError:
+            await self._js.add_stream(name=self.stream, subjects=self.subjects)
+
+    async def publish(self, subject: str, data: Dict[str, Any]) -> None:
+        await self.connect()
+        await self._js.publish(subject, json.dumps(data).encode(), stream=self.stream)
+
+    async def pull_subscribe(self, subject: str, durable: str) -> JetStreamConsumer:
+        from nats.js.api import AckPolicy, ConsumerConfig
+
+        await self.connect()
+        subscription = await self._js.pull_subscribe(
+            subject,
+            durable=durable,
+            stream=self.stream,
+            config=ConsumerConfig(
+                ack_policy=AckPolicy.EXPLICIT,
+                ack_wait=settings.EVENT_ACK_WAIT,
+                max_deliver=settings.EVENT_MAX_DELIVER,
+                max_ack_pending=settings.EVENT_MAX_ACK_PENDING,
+            ),
+        )
+        return JetStreamConsumer(subscription)
+
+    async def close(self) -> None:
+        if self._nc is not None:
+            await self._nc.drain()
+            self._nc = None
+            self._js = None
+
+
+def create_event_bus():
+    """Build the event bus selected by EVENT_BUS_BACKEND"""
+    if settings.EVENT_BUS_BACKEND == "nats":
+        return JetStreamEventBus(settings.NATS_URL, settings.EVENT_STREAM, settings.EVENT_SUBJECTS)
+    return InMemoryEventBus()
+
+
+event_bus = create_event_bus()
@@ -0,0 +1,256 @@
+"""
+Ingestion of chat and auth events from the event bus.
+
+Each consumer pulls a batch, groups it into as few writes as possible and
+acknowledges every group only after its write has committed. Messages for
+chats are merged up front: a burst of messages in one chat becomes a single
+coalesced fan-out. Events that fail to parse are terminated, and events
+whose write fails are redelivered with a growing delay until
+EVENT_MAX_DELIVER is reached. Delivery is at least once, so every
+notification carries an idempotency key derived from its event. Rows built
+from single events are skipped if their key exists already. A coalesced
+chat row holds the key of the last message it absorbed, and a redelivered
+burst only counts the messages after that one.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from app.core.config import settings
+from app.core.database import get_db_context
+from app.models.events import (
+    ChatMessageCreated,
+    ChatMessageMentioned,
+    FriendRequestCreated,
+    UserRegistered,
+)
+from app.models.notification import NotificationType
+from app.services.event_bus import EventMessage, event_bus
+from app.services.notification_service import NotificationService
+
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(event: ChatMessageCreated) -> str:
+    return f"chat:{event.message_id}"
+
+
+def chat_template(event: ChatMessageCreated) -> Dict[str, Any]:
+    sender = event.sender_name or "Someone"
+    return {
+        "type": NotificationType.CHAT,
+        "title": f"{sender} in {event.chat_name}" if event.chat_name else f"New message from {sender}",
+        "content": event.preview,
+        "sender_id": event.sender_id,
+        "reference_id": event.chat_id,
+        "reference_type": "chat",
+        "meta": {"message_id": event.message_id},
+        "idempotency_key": chat_key(event),
+    }
+
+
+def mention_rows(event: ChatMessageMentioned) -> List[Dict[str, Any]]:
+    return [
+        {
+            "type": NotificationType.MENTION,
+            "title": f"{event.sender_name or 'Someone'} mentioned you",
+            "content": event.preview,
+            "recipient_id": recipient_id,
+            "sender_id": event.sender_id,
+            "reference_id": event.chat_id,
+            "reference_type": "chat",
+            "meta": {"message_id": event.message_id},
+            # Redelivered events must not mention anyone twice
+            "idempotency_key": f"mention:{event.message_id}",
+        }
+        for recipient_id in dict.fromkeys(event.recipient_ids)
+        if recipient_id != event.sender_id
+    ]
+
+
+def friend_request_rows(event: FriendRequestCreated) -> List[Dict[str, Any]]:
+    return [
+        {
+            "type": NotificationType.FRIEND_REQUEST,
+            "title": "New friend request",
+            "content": f"{event.sender_name or 'Someone'} sent you a friend request",
+            "recipient_id": event.recipient_id,
+            "sender_id": event.sender_id,
+            "reference_id": event.request_id,
+            "reference_type": "friend_request",
+            "meta": {},
+            "idempotency_key": f"friend_request:{event.request_id}",
+        }
+    ]
+
+
+def welcome_rows(event: UserRegistered) -> List[Dict[str, Any]]:
+    return [
+        {
+            "type": NotificationType.SYSTEM,
+            "title": f"Welcome to {settings.EMAIL_FROM_NAME}",
+            "content": f"Hi {event.full_name or 'there'}, your account is ready.",
+            "recipient_id": event.user_id,
+            "meta": {"email": event.email} if event.email else {},
+            "idempotency_key": "welcome",
+        }
+    ]
+
+
+ROW_BUILDERS = {
+    "chat.message.mentioned": (ChatMessageMentioned, mention_rows),
+    "auth.friend_request.created": (FriendRequestCreated, friend_request_rows),
+    "auth.user.registered": (UserRegistered, welcome_rows),
+}
+
+
+class EventIngestor:
+    """Consumes event bus subjects and turns each batch into bulk notification writes"""
+
+    def __init__(self, bus, subjects: List[str], durable: str, batch_size: int, fetch_timeout: float):
+        self.bus = bus
+        self.subjects = subjects
+        self.durable = durable
+        self.batch_size = batch_size
+        self.fetch_timeout = fetch_timeout
+        self._tasks: List[asyncio.Task] = []
+        self.stats: Dict[str, int] = {
+            "batches": 0,
+            "events": 0,
+            "acked": 0,
+            "retried": 0,
+            "rejected": 0,
+            "ignored": 0,
+        }
+
+    async def handle_batch(self, messages: List[EventMessage]) -> None:
+        """Write one batch of events and acknowledge each group once it has committed"""
+        chats: Dict[str, List[ChatMessageCreated]] = {}
+        chat_messages: Dict[str, List[EventMessage]] = {}
+        rows: List[Dict[str, Any]] = []
+        row_messages: List[EventMessage] = []
+
+        for message in messages:
+            try:
+                if message.subject == "chat.message.created":
+                    event = ChatMessageCreated.parse_obj(message.data)
+                    chats.setdefault(event.chat_id, []).append(event)
+                    chat_messages.setdefault(event.chat_id, []).append(message)
+                elif message.subject in ROW_BUILDERS:
+                    model, build = ROW_BUILDERS[message.subject]
+                    rows.extend(build(model.parse_obj(message.data)))
+                    row_messages.append(message)
+                else:
+                    self.stats["ignored"] += 1
+                    await message.ack()
+            except ValidationError as e:
+                logger.error(f"Rejecting malformed {message.subject} event: {str(e)}")
+                self.stats["rejected"] += 1
+                await message.term()
+
+        for chat_id, events in chats.items():
+            await self._commit_group(self._notify_chat(events), chat_messages[chat_id])
+        if row_messages:
+            await self._commit_group(self._create_rows(rows), row_messages)
+
+        self.stats["batches"] += 1
+        self.stats["events"] += len(messages)
+
+    async def _commit_group(self, write, messages: List[EventMessage]) -> None:
+        try:
+            await write
+        except Exception as e:
+            logger.error(f"Failed to ingest {len(messages)} events, will retry: {str(e)}")
+            self.stats["retried"] += len(messages)
+            for message in messages:
+                await message.nak(delay=settings.EVENT_RETRY_DELAY * message.num_delivered)
+            return
+        for message in messages:
+            await message.ack()
+        self.stats["acked"] += len(messages)
+
+    async def _notify_chat(self, events: List[ChatMessageCreated]) -> None:
+        async with get_db_context() as session:
+            service = NotificationService(session)
+            if service.coalesce_since(NotificationType.CHAT) is None:
+                await self._create_rows(
+                    [
+                        {**chat_template(event), "recipient_id": recipient_id}
+                        for event in events
+                        for recipient_id in dict.fromkeys(event.recipient_ids)
+                        if recipient_id != event.sender_id
+                    ],
+                    service,
+                )
+                return
+
+            # The whole burst becomes one coalesced fan-out carrying the latest
+            # preview. A recipient whose row already holds the key of one of
+            # these messages absorbed it and everything before it in the stream
+            keys = [chat_key(event) for event in events]
+            position = {key: index for index, key in enumerate(keys)}
+            recipients = list(dict.fromkeys(r for event in events for r in event.recipient_ids))
+            absorbed: Dict[str, int] = {}
+            for recipient_id, key in await service.repository.held_idempotency_keys(recipients, keys):
+                absorbed[recipient_id] = max(absorbed.get(recipient_id, -1), position[key])
+            increments: Dict[str, int] = {}
+            for index, event in enumerate(events):
+                for recipient_id in dict.fromkeys(event.recipient_ids):
+                    if recipient_id != event.sender_id and index > absorbed.get(recipient_id, -1):
+                        increments[recipient_id] = increments.get(recipient_id, 0) + 1
+            if increments:
+                await service.fan_out(list(increments), chat_template(events[-1]), increments)
+
+    async def _create_rows(
+        self, rows: List[Dict[str, Any]], service: Optional[NotificationService] = None
+    ) -> None:
+        if not rows:
+            return
+        if service is not None:
+            await service.create_notifications(rows)
+            return
+        async with get_db_context() as session:
+            await NotificationService(session).create_notifications(rows)
+
+    async def _consume(self, subject: str) -> None:
+        # Durable names cannot contain the subject's wildcards or dots
+        durable = f"{self.durable}-{subject.split('.')[0]}"
+        consumer = None
+        while True:
+            try:
+                if consumer is None:
+                    consumer = await self.bus.pull_subscribe(subject, durable)
+                messages = await consumer.fetch(self.batch_size, self.fetch_timeout)
+                if messages:
+                    await self.handle_batch(messages)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event consumer for {subject} failed: {str(e)}")
+                await asyncio.sleep(settings.EVENT_RETRY_DELAY)
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        for subject in self.subjects:
+            self._tasks.append(asyncio.create_task(self._consume(subject)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.bus.close()
+
+
+event_ingestor = EventIngestor(
+    event_bus,
+    settings.EVENT_SUBJECTS,
+    settings.EVENT_CONSUMER_DURABLE,
+    batch_size=settings.EVENT_BATCH_SIZE,
+    fetch_timeout=settings.EVENT_FETCH_TIMEOUT,
+)
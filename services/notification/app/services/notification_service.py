@@ -1,17 +1,58 @@
+import asyncio
 import logging
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Set, Tuple
 
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 
-from app.core.exceptions import ResourceNotFoundError, NotificationDeliveryError
+from app.core.config import settings
+from app.core.exceptions import ResourceNotFoundError, NotificationDeliveryError, UndeliverableError
 from app.models.notification import Notification, NotificationStatus, NotificationType
-from app.repositories.notification_repository import NotificationRepository
+from app.models.preference import NotificationChannel
+from app.repositories.notification_repository import NotificationRepository, encode_feed_cursor
+from app.services.email_channel import get_email_channel
+from app.services.push import (
+    SYNC,
+    UNREAD,
+    marker,
+    notification_event,
+    push_hub,
+)
+from app.services.preferences import preference_cache
+from app.services.unread_counters import counter_cache
 
 
 logger = logging.getLogger(__name__)
 
 
+# Statuses each delivery status may be entered from; READ goes through mark_many_as_read
+ALLOWED_TRANSITIONS: Dict[NotificationStatus, List[NotificationStatus]] = {
+    NotificationStatus.PENDING: [NotificationStatus.FAILED],
+    NotificationStatus.DELIVERED: [NotificationStatus.PENDING, NotificationStatus.FAILED],
+    NotificationStatus.FAILED: [NotificationStatus.PENDING],
+}
+
+
+def default_worker_id(index: int = 0) -> str:
+    """Identify a delivery worker uniquely across hosts and processes"""
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def retry_delay(attempt: int) -> float:
+    """Seconds to wait before retrying after the given failed attempt, with jitter"""
+    delay = min(
+        settings.DELIVERY_RETRY_MAX_SECONDS,
+        settings.DELIVERY_RETRY_BASE_SECONDS * 2 ** (attempt - 1),
+    )
+    # Equal jitter: keep half the delay and randomize the rest so failures
+    # from one outage do not all come back at the same moment
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
 class NotificationService:
     """Service for handling notification business logic"""
     
@@ -21,7 +62,122 @@ class NotificationService:
     
     async def create_notification(self, notification_data: Dict[str, Any]) -> Notification:
         """Create a new notification"""
-        return await self.repository.create(notification_data)
+        notification = await self.repository.create(notification_data)
+        await counter_cache.invalidate(notification.recipient_id)
+        await push_hub.publish([notification.recipient_id], *await self._push_events(notification))
+        return notification
+    
+    async def create_notifications(self, notifications_data: List[Dict[str, Any]]) -> List[int]:
+        """Create many notifications in bulk and return their ids"""
+        ids = await self.repository.create_many(
+            notifications_data, chunk_size=settings.NOTIFICATION_INSERT_CHUNK_SIZE
+        )
+        recipients = {data["recipient_id"] for data in notifications_data}
+        await counter_cache.invalidate_many(recipients)
+        await push_hub.publish(recipients, marker(SYNC), marker(UNREAD))
+        return ids
+    
+    async def fan_out(
+        self,
+        recipient_ids: List[str],
+        template: Dict[str, Any],
+        increments: Optional[Dict[str, int]] = None,
+    ) -> List[int]:
+        """
+        Send the same notification to many recipients, e.g. every member of a room
+        
+        The template holds every notification field except recipient_id.
+        Coalesced types update recipients' open rows instead of adding new
+        ones; increments gives how many notifications each recipient's row
+        stands for when several are merged up front.
+        """
+        recipients = list(dict.fromkeys(recipient_ids))
+        since = self.coalesce_since(template.get("type", NotificationType.SYSTEM))
+        if since is not None and template.get("reference_id"):
+            ids, new_recipients = await self.repository.coalesce_many(
+                recipients,
+                template,
+                since,
+                chunk_size=settings.NOTIFICATION_INSERT_CHUNK_SIZE,
+                increments=increments,
+            )
+            await counter_cache.invalidate_many(new_recipients)
+            await push_hub.publish(recipients, marker(SYNC))
+            await push_hub.publish(new_recipients, marker(UNREAD))
+            return ids
+        
+        ids = await self.repository.fan_out(
+            recipients, template, chunk_size=settings.NOTIFICATION_INSERT_CHUNK_SIZE
+        )
+        await counter_cache.invalidate_many(recipients)
+        await push_hub.publish(recipients, marker(SYNC), marker(UNREAD))
+        return ids
+    
+    @staticmethod
+    def coalesce_since(notification_type: NotificationType) -> Optional[datetime]:
+        """Start of the coalescing window for a type, or None if it is not coalesced"""
+        window = settings.NOTIFICATION_COALESCE_WINDOW_SECONDS
+        if window <= 0 or NotificationType(notification_type).value not in settings.NOTIFICATION_COALESCE_TYPES:
+            return None
+        return datetime.utcnow() - timedelta(seconds=window)
+    
+    async def coalesce_notification(self, notification_data: Dict[str, Any]) -> Notification:
+        """
+        Create a notification, or merge it into the recipient's open one for the same reference
+        
+        A merged row keeps a single unread entry and, if still pending, a
+        single delivery carrying the latest preview.
+        """
+        since = self.coalesce_since(notification_data.get("type", NotificationType.SYSTEM))
+        if since is None or not notification_data.get("reference_id"):
+            return await self.create_notification(notification_data)
+        notification, merged = await self.repository.coalesce(notification_data, since)
+        if not merged:
+            await counter_cache.invalidate(notification.recipient_id)
+        await push_hub.publish(
+            [notification.recipient_id], *await self._push_events(notification, unread_changed=not merged)
+        )
+        return notification
+    
+    async def upsert_notification(self, notification_data: Dict[str, Any]) -> Notification:
+        """
+        Create a notification unless the recipient already has one with the same idempotency key
+        
+        The key defaults to one per type and referenced entity, so producers
+        can retry freely. An existing row is refreshed with the new content.
+        """
+        notification, created = await self.repository.upsert(notification_data)
+        if created:
+            await counter_cache.invalidate(notification.recipient_id)
+        await push_hub.publish(
+            [notification.recipient_id], *await self._push_events(notification, unread_changed=created)
+        )
+        return notification
+    
+    async def get_notifications_by_reference(
+        self, recipient_id: str, reference_type: str, reference_id: str, unread_only: bool = True
+    ) -> List[Notification]:
+        """A recipient's notifications about one entity, e.g. a friend request"""
+        return await self.repository.get_by_reference(
+            recipient_id, reference_type, reference_id, unread_only=unread_only
+        )
+    
+    @staticmethod
+    async def _push_events(notification: Notification, unread_changed: bool = True) -> List[Dict[str, Any]]:
+        """
+        Push events for a new notification
+        
+        Recipients who do not want this type pushed right now only get their
+        feed kept in sync, without the notification itself.
+        """
+        events = [marker(UNREAD)] if unread_changed else []
+        if await preference_cache.allows(
+            notification.recipient_id, notification.type, NotificationChannel.PUSH
+        ):
+            events.insert(0, notification_event(notification))
+        else:
+            events.insert(0, marker(SYNC))
+        return events
     
     async def get_notification(self, notification_id: int) -> Notification:
         """Get a notification by ID"""
@@ -35,37 +191,132 @@ class NotificationService:
         recipient_id: str, 
         skip: int = 0, 
         limit: int = 100,
-        include_read: bool = False
+        include_read: bool = False,
+        before: Optional[str] = None
     ) -> List[Notification]:
         """Get notifications for a recipient"""
         return await self.repository.get_by_recipient(
             recipient_id=recipient_id,
             skip=skip,
             limit=limit,
-            include_read=include_read
+            include_read=include_read,
+            before=before
+        )
+    
+    async def get_notification_page(
+        self,
+        recipient_id: str,
+        limit: int = 50,
+        include_read: bool = False,
+        before: Optional[str] = None
+    ) -> Tuple[List[Notification], Optional[str]]:
+        """Get a page of a recipient's feed and the cursor for the next page"""
+        notifications = await self.repository.get_by_recipient(
+            recipient_id=recipient_id,
+            limit=limit,
+            include_read=include_read,
+            before=before
         )
+        next_cursor = encode_feed_cursor(notifications[-1]) if len(notifications) == limit else None
+        return notifications, next_cursor
     
     async def mark_as_read(self, notification_id: int) -> Notification:
         """Mark a notification as read"""
         notification = await self.repository.mark_as_read(notification_id)
         if not notification:
             raise ResourceNotFoundError(f"Notification with ID {notification_id} not found")
+        await counter_cache.invalidate(notification.recipient_id)
+        await push_hub.publish(
+            [notification.recipient_id], notification_event(notification), marker(UNREAD)
+        )
         return notification
     
+    async def mark_many_as_read(
+        self, notification_ids: List[int], recipient_id: Optional[str] = None
+    ) -> List[Notification]:
+        """Mark several notifications as read, returning those that were unread"""
+        updated = await self.repository.mark_many_as_read(notification_ids, recipient_id=recipient_id)
+        await self._publish_changes(updated)
+        return updated
+    
     async def mark_all_as_read(self, recipient_id: str) -> int:
         """Mark all notifications for a recipient as read"""
-        return await self.repository.mark_all_as_read(recipient_id)
+        updated = await self.repository.mark_all_as_read(recipient_id)
+        await counter_cache.invalidate(recipient_id)
+        await push_hub.publish([recipient_id], {"event": "read_all"}, marker(UNREAD))
+        return updated
+    
+    async def transition_notifications(
+        self,
+        notification_ids: List[int],
+        status: NotificationStatus,
+        error_message: Optional[str] = None,
+    ) -> List[Notification]:
+        """
+        Move notifications to a new status where the state machine allows it
+        
+        Rows not in an allowed source status are left alone; the changed rows
+        are returned.
+        """
+        status = NotificationStatus(status)
+        if status == NotificationStatus.READ:
+            return await self.mark_many_as_read(notification_ids)
+        updated = await self.repository.transition_many(
+            notification_ids, ALLOWED_TRANSITIONS[status], status, error_message=error_message
+        )
+        await self._publish_changes(updated, unread_changed=False)
+        return updated
     
     async def delete_notification(self, notification_id: int) -> bool:
         """Delete a notification"""
-        result = await self.repository.delete(notification_id)
-        if not result:
+        if not await self.delete_notifications([notification_id]):
             raise ResourceNotFoundError(f"Notification with ID {notification_id} not found")
-        return result
+        return True
+    
+    async def delete_notifications(
+        self, notification_ids: List[int], recipient_id: Optional[str] = None
+    ) -> int:
+        """Delete several notifications, returning how many were deleted"""
+        deleted = await self.repository.delete_many(notification_ids, recipient_id=recipient_id)
+        by_recipient: Dict[str, List[int]] = {}
+        for notification_id, owner_id, _ in deleted:
+            by_recipient.setdefault(owner_id, []).append(notification_id)
+        await counter_cache.invalidate_many(by_recipient)
+        for owner_id, ids in by_recipient.items():
+            await push_hub.publish(
+                [owner_id], {"event": "deleted", "data": {"ids": ids}}, marker(UNREAD)
+            )
+        return len(deleted)
+    
+    async def _publish_changes(
+        self, notifications: List[Notification], unread_changed: bool = True
+    ) -> None:
+        """Invalidate counters and push updated notifications to their recipients"""
+        recipients = {n.recipient_id for n in notifications}
+        if unread_changed:
+            await counter_cache.invalidate_many(recipients)
+        for notification in notifications:
+            await push_hub.publish([notification.recipient_id], notification_event(notification))
+        if unread_changed:
+            await push_hub.publish(recipients, marker(UNREAD))
+    
+    async def get_changes_since(
+        self, recipient_id: str, position: Tuple[datetime, int], limit: int = 100
+    ) -> List[Notification]:
+        """Notifications created or updated after a push stream position"""
+        updated_at, notification_id = position
+        return await self.repository.get_changed_since(
+            recipient_id, updated_at, notification_id, limit=limit
+        )
     
     async def count_unread_notifications(self, recipient_id: str) -> int:
-        """Count unread notifications for a recipient"""
-        return await self.repository.count_unread(recipient_id)
+        """Count unread notifications for a recipient in O(1)"""
+        unread_count = await counter_cache.get(recipient_id)
+        if unread_count is None:
+            token = await counter_cache.reserve(recipient_id)
+            unread_count = await self.repository.count_unread(recipient_id)
+            await counter_cache.fill(recipient_id, unread_count, token)
+        return unread_count
     
     async def create_system_notification(
         self,
@@ -80,7 +331,7 @@ class NotificationService:
             "title": title,
             "content": content,
             "recipient_id": recipient_id,
-            "metadata": metadata or {}
+            "meta": metadata or {}
         }
         return await self.create_notification(notification_data)
     
@@ -102,9 +353,9 @@ class NotificationService:
             "sender_id": sender_id,
             "reference_id": chat_id,
             "reference_type": "chat",
-            "metadata": metadata or {}
+            "meta": metadata or {}
         }
-        return await self.create_notification(notification_data)
+        return await self.coalesce_notification(notification_data)
     
     async def create_friend_request_notification(
         self,
@@ -124,28 +375,113 @@ class NotificationService:
             "sender_id": sender_id,
             "reference_id": request_id,
             "reference_type": "friend_request",
-            "metadata": metadata or {}
+            "meta": metadata or {}
         }
         return await self.create_notification(notification_data)
     
-    async def process_pending_notifications(self, limit: int = 100) -> List[Notification]:
-        """Process pending notifications"""
-        pending_notifications = await self.repository.get_pending_notifications(limit)
-        processed_notifications = []
+    async def deliver(self, notification: Notification) -> None:
+        """Deliver a notification over its channels"""
+        logger.info(f"Processing notification {notification.id} for recipient {notification.recipient_id}")
+        if settings.EMAIL_CHANNEL_ENABLED and not self.is_digested(notification):
+            # Checked before rendering, so suppressed emails cost nothing
+            if await preference_cache.allows(
+                notification.recipient_id, notification.type, NotificationChannel.EMAIL
+            ):
+                await get_email_channel().send(notification)
+    
+    @staticmethod
+    def is_digested(notification: Notification) -> bool:
+        """Whether a notification is emailed in the periodic digest instead of on its own"""
+        return (
+            settings.EMAIL_DIGEST_INTERVAL > 0
+            and NotificationType(notification.type).value in settings.EMAIL_DIGEST_TYPES
+        )
+    
+    async def deliver_claimed(
+        self, notifications: List[Notification], worker_id: str, ordered: bool = False
+    ) -> List[Notification]:
+        """
+        Deliver a claimed batch and write the status transitions in bulk
+        
+        With ordered the notifications are delivered one after another in
+        the given order, otherwise up to DELIVERY_CONCURRENCY at a time.
+        """
+        semaphore = asyncio.Semaphore(settings.DELIVERY_CONCURRENCY)
+        undeliverable: Set[int] = set()
+        # Load the recipients' preferences in one round trip up front
+        await preference_cache.get_many(n.recipient_id for n in notifications)
         
-        for notification in pending_notifications:
-            try:
-                # Here you would implement the actual delivery logic
-                # For example, sending an email, push notification, etc.
-                logger.info(f"Processing notification {notification.id} for recipient {notification.recipient_id}")
-                
-                # Mark as delivered
-                processed_notification = await self.repository.mark_as_delivered(notification.id)
-                if processed_notification:
-                    processed_notifications.append(processed_notification)
-                
-            except Exception as e:
-                logger.error(f"Failed to process notification {notification.id}: {str(e)}")
-                await self.repository.mark_as_failed(notification.id, str(e))
+        async def attempt(notification: Notification) -> Optional[str]:
+            async with semaphore:
+                try:
+                    await self.deliver(notification)
+                    return None
+                except UndeliverableError as e:
+                    logger.warning(f"Notification {notification.id} is undeliverable: {str(e)}")
+                    undeliverable.add(notification.id)
+                    return str(e)
+                except Exception as e:
+                    logger.error(f"Failed to process notification {notification.id}: {str(e)}")
+                    return str(e) or e.__class__.__name__
         
-        return processed_notifications 
\ No newline at end of file
+        if ordered:
+            results = [await attempt(n) for n in notifications]
+        else:
+            results = await asyncio.gather(*(attempt(n) for n in notifications))
+        
+        now = datetime.utcnow()
+        delivered = [n for n, error in zip(notifications, results) if error is None]
+        failures: Dict[int, Tuple[str, Optional[datetime]]] = {}
+        for notification, error in zip(notifications, results):
+            if error is None:
+                continue
+            attempt_number = notification.attempts + 1
+            next_attempt_at = None
+            if notification.id in undeliverable:
+                # Retrying cannot help, so the row fails right away
+                pass
+            elif attempt_number < settings.DELIVERY_MAX_ATTEMPTS:
+                next_attempt_at = now + timedelta(seconds=retry_delay(attempt_number))
+            else:
+                logger.error(f"Dead-lettering notification {notification.id} after {attempt_number} attempts")
+            failures[notification.id] = (error, next_attempt_at)
+        
+        await self.repository.mark_many_as_delivered([n.id for n in delivered], worker_id)
+        await self.repository.record_failures(failures, worker_id)
+        # Status and error changes show up in the recipients' feeds
+        await push_hub.publish({n.recipient_id for n in notifications}, marker(SYNC))
+        
+        # Reflect the bulk update on the loaded objects without re-reading them
+        for notification in notifications:
+            set_committed_value(notification, "attempts", notification.attempts + 1)
+            if notification.id in failures:
+                error, next_attempt_at = failures[notification.id]
+                set_committed_value(notification, "last_error", error)
+                set_committed_value(notification, "next_attempt_at", next_attempt_at)
+                if next_attempt_at is None:
+                    set_committed_value(notification, "status", NotificationStatus.FAILED)
+            else:
+                set_committed_value(notification, "status", NotificationStatus.DELIVERED)
+                set_committed_value(notification, "delivered_at", now)
+                set_committed_value(notification, "next_attempt_at", None)
+        
+        return delivered
+    
+    async def process_pending_notifications(
+        self, limit: int = 100, worker_id: Optional[str] = None
+    ) -> List[Notification]:
+        """Claim and process a batch of pending notifications"""
+        worker_id = worker_id or default_worker_id()
+        claimed = await self.repository.claim_pending(
+            worker_id, limit=limit, lease_seconds=settings.DELIVERY_LEASE_SECONDS
+        )
+        if len(claimed) < limit:
+            claimed += await self.repository.claim_pending(
+                worker_id,
+                limit=limit - len(claimed),
+                lease_seconds=settings.DELIVERY_LEASE_SECONDS,
+                retries=True,
+            )
+        if not claimed:
+            return []
+        return await self.deliver_claimed(claimed, worker_id)
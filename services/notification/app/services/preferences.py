@@ -0,0 +1,223 @@
+"""
+Notification preference evaluation.
+
+Before a notification is rendered or sent on a channel, delivery asks the
+preference cache whether the recipient wants it. Each user's settings and
+rules are compiled once into a set of blocked (type, channel) pairs plus
+their mute and quiet hours, so an evaluation is a few dictionary lookups.
+Compiled entries expire after NOTIFICATION_PREFERENCE_CACHE_TTL and are
+dropped on every instance as soon as a user saves new preferences.
+"""
+
+import logging
+from datetime import datetime, time, timezone
+from time import monotonic
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import get_db_context
+from app.models.notification import NotificationType
+from app.models.preference import (
+    ANY,
+    NotificationChannel,
+    NotificationPreference,
+    NotificationPreferences,
+    UserNotificationSettings,
+)
+from app.repositories.preference_repository import PreferenceRepository
+
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledPreferences:
+    """A user's preferences reduced to what delivery needs to decide quickly"""
+
+    __slots__ = ("blocked", "muted_until", "quiet_hours", "zone")
+
+    def __init__(
+        self,
+        user_settings: Optional[UserNotificationSettings] = None,
+        rules: Iterable[NotificationPreference] = (),
+    ):
+        by_key = {(rule.type, rule.channel): rule.enabled for rule in rules}
+        blocked = set()
+        for notification_type in NotificationType:
+            for channel in NotificationChannel:
+                # The most specific rule wins; without one everything is sent
+                for key in (
+                    (notification_type.value, channel.value),
+                    (notification_type.value, ANY),
+                    (ANY, channel.value),
+                    (ANY, ANY),
+                ):
+                    if key in by_key:
+                        if not by_key[key]:
+                            blocked.add((notification_type.value, channel.value))
+                        break
+        self.blocked: FrozenSet[Tuple[str, str]] = frozenset(blocked)
+
+        self.muted_until: Optional[datetime] = None
+        self.quiet_hours: Optional[Tuple[time, time]] = None
+        self.zone = timezone.utc
+        if user_settings is not None:
+            self.muted_until = user_settings.muted_until
+            if user_settings.quiet_hours_start is not None and user_settings.quiet_hours_end is not None:
+                self.quiet_hours = (user_settings.quiet_hours_start, user_settings.quiet_hours_end)
+            try:
+                self.zone = ZoneInfo(user_settings.timezone)
+            except (ZoneInfoNotFoundError, ValueError):
+                logger.warning(f"Unknown timezone {user_settings.timezone} for user {user_settings.user_id}")
+
+    def in_quiet_hours(self, now: datetime) -> bool:
+        if self.quiet_hours is None:
+            return False
+        start, end = self.quiet_hours
+        local = now.replace(tzinfo=timezone.utc).astimezone(self.zone).time()
+        if start <= end:
+            return start <= local < end
+        # The window wraps past midnight
+        return local >= start or local < end
+
+    def allows(
+        self, notification_type: NotificationType, channel: NotificationChannel, now: datetime
+    ) -> bool:
+        """Whether a notification of this type may be sent on this channel at now (UTC)"""
+        notification_type = NotificationType(notification_type)
+        if (notification_type.value, channel.value) in self.blocked:
+            return False
+        if self.muted_until is not None and now < self.muted_until:
+            return False
+        if (
+            notification_type.value not in settings.NOTIFICATION_QUIET_HOURS_BYPASS_TYPES
+            and self.in_quiet_hours(now)
+        ):
+            return False
+        return True
+
+
+# Users without saved preferences receive everything
+DEFAULT_PREFERENCES = CompiledPreferences()
+
+
+class PreferenceCache:
+    """In-process TTL cache of compiled preferences, invalidated across instances on update"""
+
+    def __init__(self, ttl: float, max_entries: int = 100_000, channel: str = "notification:preferences"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.channel = channel
+        self.pubsub = None
+        # user id -> (expires at, compiled preferences)
+        self._entries: Dict[str, Tuple[float, CompiledPreferences]] = {}
+        # Bumped on every invalidation so a load racing one is not cached
+        self._generation = 0
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0, "suppressed": 0}
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, CompiledPreferences]:
+        """Compiled preferences for many users, loading the missing ones in one round trip"""
+        now = monotonic()
+        found: Dict[str, CompiledPreferences] = {}
+        missing: List[str] = []
+        for user_id in dict.fromkeys(user_ids):
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                found[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(missing)
+        if not missing:
+            return found
+
+        generation = self._generation
+        async with get_db_context() as session:
+            user_settings, rules = await PreferenceRepository(session).get_for_users(missing)
+        expires_at = monotonic() + self.ttl
+        for user_id in missing:
+            if user_id in user_settings or user_id in rules:
+                compiled = CompiledPreferences(user_settings.get(user_id), rules.get(user_id, ()))
+            else:
+                compiled = DEFAULT_PREFERENCES
+            found[user_id] = compiled
+            if self.ttl > 0 and generation == self._generation:
+                self._store(user_id, expires_at, compiled)
+        return found
+
+    def _store(self, user_id: str, expires_at: float, compiled: CompiledPreferences) -> None:
+        if len(self._entries) >= self.max_entries and user_id not in self._entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[user_id] = (expires_at, compiled)
+
+    async def allows(
+        self,
+        user_id: str,
+        notification_type: NotificationType,
+        channel: NotificationChannel,
+        now: Optional[datetime] = None,
+    ) -> bool:
+        """Whether a user wants a notification of this type on this channel right now"""
+        compiled = (await self.get_many([user_id]))[user_id]
+        allowed = compiled.allows(notification_type, channel, now or datetime.utcnow())
+        if not allowed:
+            self.stats["suppressed"] += 1
+        return allowed
+
+    async def invalidate(self, user_id: str) -> None:
+        """Drop a user's entry here and on every other instance"""
+        self._drop(user_id)
+        if self.pubsub is not None:
+            try:
+                await self.pubsub.publish(self.channel, {"user_id": user_id})
+            except Exception as e:
+                # Other instances catch up when their entry expires
+                logger.error(f"Failed to publish preference invalidation: {str(e)}")
+
+    def _drop(self, user_id: str) -> None:
+        self._generation += 1
+        if self._entries.pop(user_id, None) is not None:
+            self.stats["invalidations"] += 1
+
+    async def _on_invalidate(self, message: Dict) -> None:
+        self._drop(message["user_id"])
+
+    async def start(self, pubsub) -> None:
+        """Listen for invalidations from other instances on a shared pub/sub"""
+        if self.pubsub is None:
+            self.pubsub = pubsub
+            await pubsub.subscribe(self.channel, self._on_invalidate)
+
+    async def stop(self) -> None:
+        self.pubsub = None
+        self._entries.clear()
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), **self.stats}
+
+
+preference_cache = PreferenceCache(
+    settings.NOTIFICATION_PREFERENCE_CACHE_TTL,
+    max_entries=settings.NOTIFICATION_PREFERENCE_CACHE_SIZE,
+    channel=settings.NOTIFICATION_PREFERENCE_CHANNEL,
+)
+
+
+class PreferenceService:
+    """Service for reading and saving notification preferences"""
+
+    def __init__(self, session: AsyncSession):
+        self.repository = PreferenceRepository(session)
+
+    async def get_preferences(self, user_id: str) -> NotificationPreferences:
+        return await self.repository.get(user_id)
+
+    async def update_preferences(
+        self, user_id: str, preferences: NotificationPreferences
+    ) -> NotificationPreferences:
+        """Replace a user's preferences; delivery sees them immediately"""
+        saved = await self.repository.replace(user_id, preferences)
+        await preference_cache.invalidate(user_id)
+        return saved
@@ -0,0 +1,379 @@
+"""
+Real-time push of notification changes to connected clients.
+
+Each WebSocket or SSE connection registers with the push hub under its user
+id and gets a bounded queue. Services publish events for recipients; with
+the "redis" backend events go through Redis pub/sub so a recipient
+connected to any notification instance receives them.
+
+Events either carry their payload (a new or coalesced notification) or are
+markers the connection resolves itself: "unread" re-reads the unread count
+and "sync" replays the feed from the last change it sent. Markers are
+deduplicated per connection, so a burst of writes costs one read. A
+connection whose queue overflows is closed; the client reconnects with its
+last event id and resumes from the database.
+
+Every message also bumps the recipients' feed version, which polling
+clients get as an ETag. A poll whose ETag still matches is answered with a
+304 without touching the database, and long-polls park on the version until
+it changes. Versions are bumped by the publishing instance itself and again
+by every instance that receives the message. A failed publish or a Redis
+reconnect may have lost messages, so it rotates the epoch, which changes
+every ETag. With the "local" backend other instances' writes are never
+seen, so no ETags are issued at all.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.exceptions import ValidationError
+from app.models.notification import Notification, NotificationRead
+
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[Dict], Awaitable[None]]
+
+# Marker events resolved by the connection rather than carrying a payload
+UNREAD = "unread"
+SYNC = "sync"
+
+
+def encode_event_id(updated_at: datetime, notification_id: int) -> str:
+    """Event id that resumes a stream just after a notification change"""
+    raw = f"{updated_at.isoformat()}|{notification_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_event_id(event_id: str) -> Tuple[datetime, int]:
+    """Decode an event id into its (updated_at, id) position"""
+    try:
+        padded = event_id + "=" * (-len(event_id) % 4)
+        updated_at, notification_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(updated_at), int(notification_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError("Invalid last event id")
+
+
+def marker(name: str) -> Dict[str, Any]:
+    return {"event": name}
+
+
+def notification_event(notification: Notification) -> Dict[str, Any]:
+    """Push event for a created or updated notification"""
+    return {
+        "event": "notification",
+        "id": encode_event_id(notification.updated_at, notification.id),
+        "data": json.loads(NotificationRead.from_orm(notification).json()),
+    }
+
+
+class PushConnection:
+    """One live client connection and its bounded outgoing queue"""
+
+    # Put in place of the queued events when the client falls behind
+    OVERFLOW = {"event": "overflow"}
+
+    def __init__(self, user_id: str, max_queue: int):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(max_queue)
+        self.pending_markers: Set[str] = set()
+        self.overflowed = False
+
+    def offer(self, event: Dict[str, Any]) -> bool:
+        """Queue an event without blocking; returns False if it was dropped"""
+        if self.overflowed:
+            return False
+        name = event["event"]
+        if name in (UNREAD, SYNC):
+            if name in self.pending_markers:
+                return True
+            self.pending_markers.add(name)
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(self.OVERFLOW)
+            return False
+
+    async def next_event(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Next queued event, or None if nothing arrived within the timeout"""
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.pending_markers.discard(event["event"])
+        return event
+
+
+class FeedVersions:
+    """
+    Per-recipient feed versions and the long-polls waiting on them
+
+    Versions come from one increasing sequence. A recipient without an entry,
+    e.g. after eviction, reports the highest version ever evicted, so a
+    version never repeats for a recipient once their feed has changed. The
+    epoch keeps ETags from different processes from ever matching. Unless
+    shared, i.e. every instance's changes reach this one, there are no ETags.
+    """
+
+    def __init__(self, max_entries: int = 100_000, shared: bool = True):
+        self.max_entries = max_entries
+        self.shared = shared
+        self.epoch = uuid.uuid4().hex[:8]
+        self._sequence = 0
+        self._floor = 0
+        self._versions: Dict[str, int] = {}
+        # recipient id -> [event set on the next change, waiting requests]
+        self._waiters: Dict[str, List] = {}
+
+    def etag(self, recipient_id: str) -> Optional[str]:
+        if not self.shared:
+            return None
+        version = self._versions.get(recipient_id, self._floor)
+        return f'W/"{self.epoch}-{version}"'
+
+    def rotate(self) -> None:
+        """Change every ETag, after changes may have been missed"""
+        self.epoch = uuid.uuid4().hex[:8]
+        waiters, self._waiters = self._waiters, {}
+        for waiter in waiters.values():
+            waiter[0].set()
+
+    def bump(self, recipient_ids: Iterable[str]) -> None:
+        for recipient_id in recipient_ids:
+            self._sequence += 1
+            # Re-insert so the dict stays in least recently changed order
+            self._versions.pop(recipient_id, None)
+            self._versions[recipient_id] = self._sequence
+            waiter = self._waiters.pop(recipient_id, None)
+            if waiter is not None:
+                waiter[0].set()
+        while len(self._versions) > self.max_entries:
+            evicted = next(iter(self._versions))
+            self._floor = max(self._floor, self._versions.pop(evicted))
+
+    async def wait(self, recipient_id: str, etag: str, timeout: float) -> bool:
+        """Wait until a recipient's ETag differs from etag; False on timeout"""
+        if not self.shared or self.etag(recipient_id) != etag:
+            return True
+        waiter = self._waiters.setdefault(recipient_id, [asyncio.Event(), 0])
+        waiter[1] += 1
+        try:
+            await asyncio.wait_for(waiter[0].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiter[1] -= 1
+            if waiter[1] == 0 and self._waiters.get(recipient_id) is waiter:
+                del self._waiters[recipient_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "versions": len(self._versions),
+            "waiting": sum(waiter[1] for waiter in self._waiters.values()),
+        }
+
+
+class LocalPubSub:
+    """In-process pub/sub used when no shared broker is configured"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+
+    async def publish(self, channel: str, message: Dict) -> None:
+        for handler in list(self._handlers.get(channel, ())):
+            await handler(message)
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def close(self) -> None:
+        self._handlers.clear()
+
+
+class RedisPubSub:
+    """Redis pub/sub so events reach connections on every notification instance"""
+
+    def __init__(self, redis_url: str):
+        self.redis_url = redis_url
+        self._client = None
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        # Called once resubscribed after a lost connection
+        self.on_reconnect: Optional[Callable[[], None]] = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from redis import asyncio as aioredis
+
+            self._client = aioredis.from_url(self.redis_url, decode_responses=True)
+        return self._client
+
+    async def publish(self, channel: str, message: Dict) -> None:
+        await self.client.publish(channel, json.dumps(message))
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        if self._pubsub is None:
+            self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._handlers.setdefault(channel, []).append(handler)
+        await self._pubsub.subscribe(channel)
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+
+    async def _read(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                async for raw in self._pubsub.listen():
+                    delay = 1.0
+                    try:
+                        message = json.loads(raw["data"])
+                        for handler in self._handlers.get(raw["channel"], ()):
+                            await handler(message)
+                    except Exception as e:
+                        logger.error(f"Failed to dispatch push message: {str(e)}")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Lost Redis pub/sub connection, reconnecting in {delay:.0f}s: {str(e)}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+            try:
+                await self._resubscribe()
+            except Exception as e:
+                logger.error(f"Failed to resubscribe to Redis: {str(e)}")
+                continue
+            if self.on_reconnect is not None:
+                # Messages published while disconnected are gone
+                self.on_reconnect()
+
+    async def _resubscribe(self) -> None:
+        """Replace the pub/sub connection and subscribe it to every channel again"""
+        old, self._pubsub = self._pubsub, self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await old.close()
+        except Exception:
+            pass
+        if self._handlers:
+            await self._pubsub.subscribe(*self._handlers)
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class PushHub:
+    """Per-user registry of live connections"""
+
+    def __init__(
+        self,
+        pubsub=None,
+        channel: str = "notification:push",
+        max_queue: int = 100,
+        versions: Optional[FeedVersions] = None,
+    ):
+        self.pubsub = pubsub or LocalPubSub()
+        self.channel = channel
+        self.max_queue = max_queue
+        self.versions = versions or FeedVersions()
+        self.connections: Dict[str, Set[PushConnection]] = {}
+        self.counters: Dict[str, int] = {"published": 0, "delivered": 0, "dropped": 0, "overflows": 0}
+        self._started = False
+
+    def connect(self, user_id: str) -> PushConnection:
+        connection = PushConnection(user_id, self.max_queue)
+        self.connections.setdefault(user_id, set()).add(connection)
+        return connection
+
+    def disconnect(self, connection: PushConnection) -> None:
+        connections = self.connections.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.connections[connection.user_id]
+
+    async def publish(self, recipient_ids: Iterable[str], *events: Dict[str, Any]) -> None:
+        """Push events to every live connection of the given recipients"""
+        recipients = list(recipient_ids)
+        if not recipients or not events:
+            return
+        self.counters["published"] += len(events)
+        # Receiving the message back bumps again, which is harmless
+        self.versions.bump(recipients)
+        try:
+            await self.pubsub.publish(self.channel, {"recipients": recipients, "events": events})
+        except Exception as e:
+            # Clients resync on reconnect, so a lost push is not fatal, but
+            # other instances' ETags must not keep matching
+            logger.error(f"Failed to publish push event: {str(e)}")
+            self.versions.rotate()
+
+    async def _dispatch(self, message: Dict) -> None:
+        self.versions.bump(message["recipients"])
+        for recipient_id in message["recipients"]:
+            for connection in list(self.connections.get(recipient_id, ())):
+                for event in message["events"]:
+                    was_overflowed = connection.overflowed
+                    if connection.offer(event):
+                        self.counters["delivered"] += 1
+                    else:
+                        self.counters["dropped"] += 1
+                        if not was_overflowed:
+                            self.counters["overflows"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "users": len(self.connections),
+            "connections": sum(len(c) for c in self.connections.values()),
+            **self.counters,
+            **self.versions.stats(),
+        }
+
+    async def start(self) -> None:
+        if not self._started:
+            if isinstance(self.pubsub, RedisPubSub):
+                self.pubsub.on_reconnect = self.versions.rotate
+            await self.pubsub.subscribe(self.channel, self._dispatch)
+            self._started = True
+
+    async def stop(self) -> None:
+        await self.pubsub.close()
+        self._started = False
+
+
+def create_push_hub() -> PushHub:
+    """Build the push hub for the configured NOTIFICATION_PUSH_BACKEND"""
+    pubsub = RedisPubSub(settings.REDIS_URL) if settings.NOTIFICATION_PUSH_BACKEND == "redis" else None
+    return PushHub(
+        pubsub,
+        channel=settings.NOTIFICATION_PUSH_CHANNEL,
+        max_queue=settings.NOTIFICATION_PUSH_QUEUE_SIZE,
+        versions=FeedVersions(
+            settings.NOTIFICATION_FEED_VERSIONS_SIZE,
+            shared=settings.NOTIFICATION_PUSH_BACKEND == "redis",
+        ),
+    )
+
+
+push_hub = create_push_hub()
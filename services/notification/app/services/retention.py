@@ -0,0 +1,235 @@
+"""
+Notification retention.
+
+Read, delivered and failed notifications are removed once they are older
+than the retention configured for their type and status in
+NOTIFICATION_RETENTION_DAYS, optionally copying them to
+notifications_archive first. Rows are removed in small batches with a pause
+in between so the job never holds long locks or saturates the database.
+Pending rows are never removed.
+
+With NOTIFICATION_PARTITIONING on Postgres the table is range-partitioned by
+month of created_at. Partitions are created ahead of time on their own
+schedule, so inserts keep working with retention disabled. The job
+drops (or, when archiving, detaches) whole months once everything in them
+has expired, which is instant however many rows they hold.
+"""
+
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import engine, get_db_context
+from app.models.notification import PARTITIONED, NotificationStatus, NotificationType
+from app.repositories.notification_repository import NotificationRepository
+from app.services.push import UNREAD, marker, push_hub
+from app.services.unread_counters import counter_cache
+
+
+logger = logging.getLogger(__name__)
+
+# Statuses retention applies to; pending rows are still work to do
+RETAINED_STATUSES = [NotificationStatus.READ, NotificationStatus.DELIVERED, NotificationStatus.FAILED]
+
+
+def retention_days(rules: Dict[str, float], notification_type: NotificationType, status: NotificationStatus) -> float:
+    """Days to keep rows of a type and status; the most specific rule wins"""
+    for key in (
+        f"{notification_type.value}:{status.value}",
+        notification_type.value,
+        f"*:{status.value}",
+        "*",
+    ):
+        if key in rules:
+            return rules[key]
+    return 0
+
+
+def retention_plan(rules: Dict[str, float]) -> List[Tuple[NotificationType, List[NotificationStatus], float]]:
+    """(type, statuses, days) to purge, grouping statuses that share a retention"""
+    plan = []
+    for notification_type in NotificationType:
+        by_days: Dict[float, List[NotificationStatus]] = {}
+        for status in RETAINED_STATUSES:
+            days = retention_days(rules, notification_type, status)
+            if days > 0:
+                by_days.setdefault(days, []).append(status)
+        plan.extend((notification_type, statuses, days) for days, statuses in by_days.items())
+    return plan
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    month = moment.month - 1 + months
+    return datetime(moment.year + month // 12, month % 12 + 1, 1)
+
+
+class PartitionManager:
+    """Creates monthly notification partitions ahead of time and retires expired ones"""
+
+    NAME = re.compile(r"^notifications_y(\d{4})m(\d{2})$")
+
+    @staticmethod
+    def partition_name(month: datetime) -> str:
+        return f"notifications_y{month.year}m{month.month:02d}"
+
+    async def ensure_partitions(self, months_ahead: int) -> None:
+        """Create partitions for the current month and the next months_ahead"""
+        current = add_months(datetime.utcnow(), 0)
+        async with engine.begin() as conn:
+            for offset in range(months_ahead + 1):
+                start = add_months(current, offset)
+                end = add_months(start, 1)
+                await conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {self.partition_name(start)} "
+                    f"PARTITION OF notifications FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+                ))
+
+    async def retire_expired(self, before: datetime, archive: bool = False) -> List[str]:
+        """
+        Drop or detach partitions whose whole month ends before a cutoff
+
+        Partitions still holding pending rows are kept.
+        """
+        retired = []
+        async with engine.begin() as conn:
+            result = await conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = 'notifications'"
+            ))
+            for (name,) in result.all():
+                match = self.NAME.match(name)
+                if not match:
+                    continue
+                end = add_months(datetime(int(match.group(1)), int(match.group(2)), 1), 1)
+                if end > before:
+                    continue
+                has_pending = (await conn.execute(text(
+                    f"SELECT EXISTS (SELECT 1 FROM {name} WHERE status = 'pending')"
+                ))).scalar()
+                if has_pending:
+                    logger.warning(f"Keeping expired partition {name}: it still has pending notifications")
+                    continue
+                if archive:
+                    await conn.execute(text(f"ALTER TABLE notifications DETACH PARTITION {name}"))
+                    await conn.execute(text(f"ALTER TABLE {name} RENAME TO {name.replace('notifications_', 'notifications_archive_', 1)}"))
+                else:
+                    await conn.execute(text(f"DROP TABLE {name}"))
+                retired.append(name)
+        return retired
+
+
+partition_manager = PartitionManager()
+
+
+class RetentionJob:
+    """Periodically purges expired notifications in throttled batches"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._partition_task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"runs": 0, "purged": 0, "partitions_retired": 0}
+
+    async def purge(self, notification_type: NotificationType, statuses: List[NotificationStatus], before: datetime) -> int:
+        """Purge all expired rows of one type and status group, batch by batch"""
+        batch_size = settings.NOTIFICATION_RETENTION_BATCH_SIZE
+        purged = 0
+        while True:
+            async with get_db_context() as session:
+                removed = await NotificationRepository(session).purge_expired(
+                    notification_type,
+                    statuses,
+                    before,
+                    limit=batch_size,
+                    archive=settings.NOTIFICATION_RETENTION_ARCHIVE,
+                )
+            await counter_cache.invalidate_many({row[1] for row in removed if not row[2]})
+            by_recipient: Dict[str, List[int]] = {}
+            for notification_id, recipient_id, is_read in removed:
+                by_recipient.setdefault(recipient_id, []).append(notification_id)
+            for recipient_id, ids in by_recipient.items():
+                await push_hub.publish([recipient_id], {"event": "deleted", "data": {"ids": ids}}, marker(UNREAD))
+            purged += len(removed)
+            if len(removed) < batch_size:
+                return purged
+            await asyncio.sleep(settings.NOTIFICATION_RETENTION_BATCH_PAUSE)
+
+    async def run_once(self) -> int:
+        now = datetime.utcnow()
+        purged = 0
+        for notification_type, statuses, days in retention_plan(settings.NOTIFICATION_RETENTION_DAYS):
+            purged += await self.purge(notification_type, statuses, now - timedelta(days=days))
+
+        if PARTITIONED:
+            before = self.partition_cutoff(now)
+            if before is not None:
+                retired = await partition_manager.retire_expired(
+                    before, archive=settings.NOTIFICATION_RETENTION_ARCHIVE
+                )
+                if retired:
+                    logger.info(f"Retired notification partitions: {', '.join(retired)}")
+                    self.stats["partitions_retired"] += len(retired)
+                    # Retired partitions may have held unread rows
+                    async with get_db_context() as session:
+                        repaired = await NotificationRepository(session).reconcile_unread_counters()
+                    await counter_cache.invalidate_many(repaired)
+                    await push_hub.publish(repaired, marker(UNREAD))
+
+        self.stats["runs"] += 1
+        self.stats["purged"] += purged
+        return purged
+
+    @staticmethod
+    def partition_cutoff(now: datetime) -> Optional[datetime]:
+        """Rows created before this are expired under every rule, or None if some are kept forever"""
+        days = [
+            retention_days(settings.NOTIFICATION_RETENTION_DAYS, notification_type, status)
+            for notification_type in NotificationType
+            for status in RETAINED_STATUSES
+        ]
+        if min(days) <= 0:
+            return None
+        return now - timedelta(days=max(days))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Notification retention run failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def _maintain_partitions(self) -> None:
+        while True:
+            await asyncio.sleep(settings.NOTIFICATION_PARTITION_INTERVAL)
+            try:
+                await partition_manager.ensure_partitions(settings.NOTIFICATION_PARTITION_MONTHS_AHEAD)
+            except Exception as e:
+                logger.error(f"Notification partition maintenance failed: {str(e)}")
+
+    async def start(self) -> None:
+        if PARTITIONED:
+            # Partitions must exist before the first insert, and keep being
+            # created ahead whether or not retention runs
+            await partition_manager.ensure_partitions(settings.NOTIFICATION_PARTITION_MONTHS_AHEAD)
+            if settings.NOTIFICATION_PARTITION_INTERVAL > 0 and self._partition_task is None:
+                self._partition_task = asyncio.create_task(self._maintain_partitions())
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._partition_task):
+            if task is not None:
+                task.cancel()
+        self._task = None
+        self._partition_task = None
+
+
+retention_job = RetentionJob(settings.NOTIFICATION_RETENTION_INTERVAL)
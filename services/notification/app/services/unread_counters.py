@@ -0,0 +1,198 @@
+"""
+Unread counter cache and reconciliation.
+
+The notification_counters table is the source of truth and is updated in
+the same transaction as the notification rows. An optional cache in front
+of it absorbs badge polling: entries are filled on read and dropped after
+every change, so a stale value never outlives the next write.
+
+A fill first reserves the entry, then reads the counter from the primary,
+and only stores the value if the reservation is still in place. An
+invalidation in between drops the reservation, so a count read before a
+write can never be cached after that write's invalidation.
+"""
+
+import asyncio
+import itertools
+import logging
+import uuid
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.core.database import get_db_context
+from app.repositories.notification_repository import NotificationRepository
+from app.services.push import UNREAD, marker, push_hub
+
+
+logger = logging.getLogger(__name__)
+
+
+class NullCounterCache:
+    """Cache that stores nothing; every read goes to the counters table"""
+
+    async def get(self, recipient_id: str) -> Optional[int]:
+        return None
+
+    async def reserve(self, recipient_id: str) -> Optional[str]:
+        """Start a fill; returns a token for fill(), or None if it should not be cached"""
+        return None
+
+    async def fill(self, recipient_id: str, unread_count: int, token: Optional[str]) -> None:
+        """Store a value read after reserve(), unless invalidated since"""
+        pass
+
+    async def invalidate(self, recipient_id: str) -> None:
+        pass
+
+    async def invalidate_many(self, recipient_ids) -> None:
+        for recipient_id in recipient_ids:
+            await self.invalidate(recipient_id)
+
+    async def clear(self) -> None:
+        pass
+
+
+class LocalCounterCache(NullCounterCache):
+    """In-process cache, for single-process deployments and tests"""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._values: Dict[str, int] = {}
+        # recipient id -> token of the fill in flight
+        self._fills: Dict[str, str] = {}
+        self._tokens = itertools.count(1)
+
+    async def get(self, recipient_id: str) -> Optional[int]:
+        return self._values.get(recipient_id)
+
+    async def reserve(self, recipient_id: str) -> Optional[str]:
+        token = str(next(self._tokens))
+        self._fills[recipient_id] = token
+        return token
+
+    async def fill(self, recipient_id: str, unread_count: int, token: Optional[str]) -> None:
+        if token is None or self._fills.get(recipient_id) != token:
+            return
+        del self._fills[recipient_id]
+        if len(self._values) >= self.max_entries and recipient_id not in self._values:
+            self._values.pop(next(iter(self._values)))
+        self._values[recipient_id] = unread_count
+
+    async def invalidate(self, recipient_id: str) -> None:
+        self._values.pop(recipient_id, None)
+        self._fills.pop(recipient_id, None)
+
+    async def clear(self) -> None:
+        self._values.clear()
+        self._fills.clear()
+
+
+class RedisCounterCache(NullCounterCache):
+    """Redis cache shared by all notification service instances"""
+
+    PENDING = "pending:"
+    # Seconds a reservation outlives a fill that never completes
+    FILL_TIMEOUT = 10
+    _COMPARE_AND_SET = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+return false
+"""
+
+    def __init__(self, redis_url: str, ttl: int = 3600, prefix: str = "notification:unread:"):
+        self.redis_url = redis_url
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from redis import asyncio as aioredis
+
+            self._client = aioredis.from_url(self.redis_url, decode_responses=True)
+        return self._client
+
+    async def get(self, recipient_id: str) -> Optional[int]:
+        value = await self.client.get(self.prefix + recipient_id)
+        if value is None or value.startswith(self.PENDING):
+            return None
+        return int(value)
+
+    async def reserve(self, recipient_id: str) -> Optional[str]:
+        # The reservation holds the entry's key, so invalidate() drops it
+        token = self.PENDING + uuid.uuid4().hex
+        if await self.client.set(self.prefix + recipient_id, token, ex=self.FILL_TIMEOUT, nx=True):
+            return token
+        # Another fill is in flight
+        return None
+
+    async def fill(self, recipient_id: str, unread_count: int, token: Optional[str]) -> None:
+        if token is not None:
+            await self.client.eval(
+                self._COMPARE_AND_SET, 1, self.prefix + recipient_id, token, unread_count, self.ttl
+            )
+
+    async def invalidate(self, recipient_id: str) -> None:
+        await self.client.delete(self.prefix + recipient_id)
+
+    async def invalidate_many(self, recipient_ids) -> None:
+        keys = [self.prefix + recipient_id for recipient_id in recipient_ids]
+        for start in range(0, len(keys), 1000):
+            await self.client.delete(*keys[start:start + 1000])
+
+    async def clear(self) -> None:
+        # Entries expire on their own; scanning the keyspace is not worth it
+        pass
+
+
+def create_counter_cache():
+    """Build the counter cache selected by NOTIFICATION_COUNTER_CACHE"""
+    if settings.NOTIFICATION_COUNTER_CACHE == "redis":
+        return RedisCounterCache(settings.REDIS_URL, ttl=settings.NOTIFICATION_COUNTER_CACHE_TTL)
+    if settings.NOTIFICATION_COUNTER_CACHE == "local":
+        return LocalCounterCache()
+    return NullCounterCache()
+
+
+counter_cache = create_counter_cache()
+
+
+class UnreadCounterReconciler:
+    """Periodically repairs drift between counters and notification rows"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> int:
+        async with get_db_context() as session:
+            repaired = await NotificationRepository(session).reconcile_unread_counters()
+        if repaired:
+            logger.warning(f"Repaired {len(repaired)} unread counters")
+            # Cached values and clients' badges may reflect the drifted counts
+            await counter_cache.invalidate_many(repaired)
+            await push_hub.publish(repaired, marker(UNREAD))
+        return len(repaired)
+
+    async def _run(self) -> None:
+        # Run once at startup so counters are seeded for pre-existing rows
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Unread counter reconciliation failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+counter_reconciler = UnreadCounterReconciler(settings.NOTIFICATION_COUNTER_RECONCILE_INTERVAL)
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/test.db")
+
+import pytest  # noqa: E402
+
+from app.core.database import create_db_and_tables, get_db_context  # noqa: E402
+from app.models.notification import NotificationStatus, NotificationType  # noqa: E402
+from app.repositories.notification_repository import NotificationRepository  # noqa: E402
+
+
+async def create(repository: NotificationRepository, meta=None):
+    return await repository.create(
+        {
+            "type": NotificationType.SYSTEM,
+            "title": "Title",
+            "content": "Content",
+            "recipient_id": "user-1",
+            "meta": meta,
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_failed_notification_without_meta_records_error():
+    await create_db_and_tables()
+    async with get_db_context() as session:
+        repository = NotificationRepository(session)
+        notification = await create(repository)
+        failed = await repository.mark_as_failed(notification.id, "boom")
+        assert failed.status == NotificationStatus.FAILED
+        assert failed.meta == {"error": "boom"}
+
+
+@pytest.mark.asyncio
+async def test_failed_notification_keeps_existing_meta():
+    await create_db_and_tables()
+    async with get_db_context() as session:
+        repository = NotificationRepository(session)
+        notification = await create(repository, {"chat_id": "c1"})
+        failed = await repository.transition_many(
+            [notification.id], [NotificationStatus.PENDING], NotificationStatus.FAILED, error_message="boom"
+        )
+        assert failed[0].meta == {"chat_id": "c1", "error": "boom"}